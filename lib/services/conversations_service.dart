@@ -1,6 +1,8 @@
 import 'dart:convert';
+import 'dart:math';
 import 'package:escort/config/api_config.dart';
 import 'package:escort/services/api_client.dart';
+import 'package:escort/services/socket_service.dart';
 import 'package:http/http.dart' as http;
 import 'package:http_parser/http_parser.dart';
 import 'package:mime/mime.dart';
@@ -93,7 +95,16 @@ class ConversationsService {
     return [];
   }
 
-  /// Send a text message to a conversation
+  /// Id for one send, reused across retries so the server stores it once
+  static String _newClientMessageId() {
+    final random = Random.secure();
+    final suffix = List.generate(8, (_) => random.nextInt(256).toRadixString(16).padLeft(2, '0')).join();
+    return '${DateTime.now().microsecondsSinceEpoch.toRadixString(16)}-$suffix';
+  }
+
+  /// Send a text message to a conversation.
+  /// Goes over the socket when it is connected (acked, no HTTP round trip)
+  /// and falls back to POST with the same client_message_id otherwise.
   static Future<Map<String, dynamic>> sendMessage({
     required int conversationId,
     required int senderId,
@@ -101,6 +112,23 @@ class ConversationsService {
     required String content,
   }) async {
     String normalizedType = _normalizeSenderType(senderType);
+    final clientMessageId = _newClientMessageId();
+    
+    if (SocketService.isConnected()) {
+      try {
+        final ack = await SocketService.sendMessage(
+          conversationId: conversationId,
+          content: content,
+          clientMessageId: clientMessageId,
+        );
+        if (ack['ok'] == true && ack['message'] is Map) {
+          return Map<String, dynamic>.from(ack['message']);
+        }
+        print('[ConversationsService] Socket send rejected: ${ack['error']}');
+      } catch (e) {
+        print('[ConversationsService] Socket send failed, retrying over HTTP: $e');
+      }
+    }
     
     final Map<String, dynamic> body = {
       'conversation_id': conversationId,
@@ -108,6 +136,7 @@ class ConversationsService {
       'sender_type': normalizedType,
       'content': content,
       'message_type': 'text',
+      'client_message_id': clientMessageId,
     };
     final url = '${ApiConfig.api}/messages/';
     
@@ -1,10 +1,17 @@
+import 'dart:async';
+
 import 'package:escort/config/api_config.dart';
+import 'package:escort/services/user_session.dart';
 import 'package:socket_io_client/socket_io_client.dart' as IO;
 
 class SocketService {
   static IO.Socket? _socket;
   static final Map<String, dynamic> _listeners = {};
   static bool _isConnecting = false;
+  static Timer? _heartbeat;
+
+  /// Presence on the server expires after ~90s without a heartbeat
+  static const Duration _heartbeatInterval = Duration(seconds: 30);
 
   /// Get or create Socket.IO connection
   static IO.Socket socket() {
@@ -33,13 +40,18 @@ class SocketService {
     if (_isConnecting) return;
     
     _isConnecting = true;
-    try {
-      _socket?.connect();
-      print('Socket.IO connecting...');
-    } catch (e) {
-      print('Error establishing Socket.IO connection: $e');
-      _isConnecting = false;
-    }
+    // Authenticated sockets count towards the user's online presence
+    UserSession.getAccessToken().then((token) {
+      if (token != null) _socket?.auth = {'token': token};
+    }).catchError((_) {}).whenComplete(() {
+      try {
+        _socket?.connect();
+        print('Socket.IO connecting...');
+      } catch (e) {
+        print('Error establishing Socket.IO connection: $e');
+        _isConnecting = false;
+      }
+    });
   }
 
   /// Setup global error handlers
@@ -47,6 +59,10 @@ class SocketService {
     _socket?.on('connect', (_) {
       print('WebSocket connected successfully');
       _isConnecting = false;
+      _heartbeat?.cancel();
+      _heartbeat = Timer.periodic(_heartbeatInterval, (_) {
+        if (_socket?.connected ?? false) _socket?.emit('heartbeat');
+      });
     });
 
     _socket?.on('connect_error', (error) {
@@ -57,6 +73,8 @@ class SocketService {
     _socket?.on('disconnect', (reason) {
       print('WebSocket disconnected: $reason');
       _isConnecting = false;
+      _heartbeat?.cancel();
+      _heartbeat = null;
     });
 
     _socket?.on('error', (error) {
@@ -94,6 +112,30 @@ class SocketService {
     }
   }
 
+  /// Send a text message over the socket. Completes with the server's ack:
+  /// {'ok': true, 'message': {...}} or {'ok': false, 'error': '...'}.
+  /// Throws on timeout; resend with the same [clientMessageId] to retry.
+  static Future<Map<String, dynamic>> sendMessage({
+    required int conversationId,
+    required String content,
+    required String clientMessageId,
+    Duration timeout = const Duration(seconds: 10),
+  }) {
+    final completer = Completer<Map<String, dynamic>>();
+    final s = socket();
+    s.emitWithAck('send_message', {
+      'conversation_id': conversationId,
+      'content': content,
+      'client_message_id': clientMessageId,
+    }, ack: (data) {
+      if (completer.isCompleted) return;
+      completer.complete(data is Map
+          ? Map<String, dynamic>.from(data)
+          : {'ok': false, 'error': 'Unexpected ack: $data'});
+    });
+    return completer.future.timeout(timeout);
+  }
+
   /// Listen for new messages in a conversation
   static void onNewMessage(void Function(Map<String, dynamic>) handler) {
     final s = socket();
@@ -307,6 +349,8 @@ class SocketService {
   /// Disconnect socket
   static void disconnect() {
     try {
+      _heartbeat?.cancel();
+      _heartbeat = null;
       _socket?.disconnect();
       _socket = null;
       _listeners.clear();
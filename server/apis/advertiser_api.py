@@ -1,9 +1,17 @@
 from flask import request, jsonify
 from flask_restx import Namespace, Resource, fields
-from models import Advertiser, db
+from models import Advertiser, DeviceToken, db
 from .decorators import advertiser_required
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from utils.pagination import paginate, created_desc, InvalidCursor
+from utils.geo_index import advertiser_geo_index
+from cloudinary_service import responsive_srcset
+from utils.geo import NUMPY_AVAILABLE, distances_km, spatial_prefilter
+from services.presence import presence
+
+if NUMPY_AVAILABLE:
+    import numpy as np
 
 api = Namespace('advertisers', description='Advertiser management operations')
 
@@ -45,11 +53,13 @@ advertiser_update_model = api.model('AdvertiserUpdate', {
     'location': fields.String(description='Location'),
     'bio': fields.String(description='Bio/Description'),
     'profile_image_url': fields.String(description='Profile image URL'),
-    'is_online': fields.Boolean(description='Online status'),
     'latitude': fields.Float(description='Latitude'),
     'longitude': fields.Float(description='Longitude')
 })
 
+# Written by the presence tracker only (services/presence.py); ignored on profile updates
+PRESENCE_FIELDS = ('is_online', 'last_active')
+
 advertiser_login_model = api.model('AdvertiserLogin', {
     'email': fields.String(required=True, description='Email address'),
     'password': fields.String(required=True, description='Password')
@@ -61,8 +71,6 @@ class AdvertiserList(Resource):
     def get(self):
         """Get all advertisers (paginated)."""
         try:
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
             location = request.args.get('location')
             verified_only = request.args.get('verified_only', False, type=bool)
 
@@ -72,15 +80,11 @@ class AdvertiserList(Resource):
             if verified_only:
                 query = query.filter_by(is_verified=True)
 
-            pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-            items = [adv.to_dict_safe() for adv in pagination.items]
-            return {
-                'items': items,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'current_page': pagination.page,
-                'per_page': pagination.per_page,
-            }
+            advertisers, meta = paginate(query, created_desc(Advertiser))
+            items = [adv.to_dict_safe() for adv in advertisers]
+            return {'items': items, **meta}
+        except InvalidCursor as e:
+            api.abort(400, str(e))
         except Exception as e:
             api.abort(500, f'Failed to retrieve advertisers: {str(e)}')
     
@@ -148,8 +152,10 @@ class AdvertiserDetail(Resource):
             if current_advertiser.id != advertiser_id:
                 api.abort(403, 'Can only update your own profile')
             
-            data = request.get_json()
+            data = {k: v for k, v in request.get_json().items() if k not in PRESENCE_FIELDS}
             advertiser.update(**data)
+            if 'latitude' in data or 'longitude' in data:
+                advertiser_geo_index.upsert(advertiser.id, advertiser.latitude, advertiser.longitude)
             
             return advertiser.to_dict_safe()
             
@@ -168,6 +174,7 @@ class AdvertiserDetail(Resource):
                 api.abort(403, 'Can only delete your own account')
             
             advertiser.delete()
+            advertiser_geo_index.remove(advertiser_id)
             return {'message': 'Advertiser account deleted successfully'}
             
         except Exception as e:
@@ -242,6 +249,7 @@ class AdvertiserCoords(Resource):
             if not adv:
                 api.abort(404, 'Advertiser not found')
             adv.update(latitude=lat, longitude=lon)
+            advertiser_geo_index.upsert(adv.id, adv.latitude, adv.longitude)
             return {'message': 'Coordinates updated', 'advertiser': adv.to_dict_safe()}
         except Exception as e:
             api.abort(500, f'Failed to update coordinates: {str(e)}')
@@ -320,7 +328,8 @@ class AdvertiserPosts(Resource):
             from models import Post
             
             # Query posts by advertiser
-            posts_query = Post.query.filter_by(advertiser_id=advertiser_id)
+            # Posts whose image is still being ingested have nothing to show yet
+            posts_query = Post.query.filter_by(advertiser_id=advertiser_id).filter(Post.image_url.isnot(None))
             pagination = posts_query.paginate(
                 page=page, 
                 per_page=per_page, 
@@ -334,6 +343,7 @@ class AdvertiserPosts(Resource):
                     'id': post.id,
                     'caption': post.caption,
                     'image_url': post.image_url,
+                    'srcset': responsive_srcset(post.image_url),
                     'likes_count': getattr(post, 'likes_count', 0),
                     'comments_count': getattr(post, 'comments_count', 0),
                     'created_at': post.created_at.isoformat() if hasattr(post, 'created_at') else None,
@@ -409,39 +419,110 @@ class NearbyAdvertisers(Resource):
             except Exception:
                 api.abort(400, 'lat and lon are required')
             radius_km = float(request.args.get('radius_km', 10))
+            limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+            offset = max(0, request.args.get('offset', 0, type=int))
 
-            # Simple in-Python filter (not using geography type)
-            from math import radians, sin, cos, sqrt, atan2
-
-            def haversine(lat1, lon1, lat2, lon2):
-                R = 6371.0
-                dlat = radians(lat2 - lat1)
-                dlon = radians(lon2 - lon1)
-                a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-                c = 2 * atan2(sqrt(a), sqrt(1-a))
-                return R * c
+            # Ranked from the in-memory coordinate index; only the page is loaded as rows
+            ids, distances, total = advertiser_geo_index.nearby(lat, lon, radius_km, limit=limit, offset=offset)
+            by_id = {a.id: a for a in Advertiser.query.filter(Advertiser.id.in_(ids)).all()} if ids else {}
 
-            advs = Advertiser.query.filter(Advertiser.latitude.isnot(None), Advertiser.longitude.isnot(None)).all()
             out = []
-            for a in advs:
-                d = haversine(lat, lon, float(a.latitude), float(a.longitude))
-                if d <= radius_km:
-                    obj = a.to_dict_safe()
-                    obj['distance_km'] = round(d, 2)
-                    out.append(obj)
-            out.sort(key=lambda x: x['distance_km'])
-            return {'items': out, 'total': len(out)}
+            for advertiser_id, d in zip(ids, distances):
+                a = by_id.get(advertiser_id)
+                if not a:
+                    continue
+                obj = a.to_dict_safe()
+                obj['distance_km'] = round(d, 2)
+                out.append(obj)
+            return {
+                'items': out,
+                'total': total,
+                'limit': limit,
+                'offset': offset,
+                'has_more': offset + len(ids) < total,
+            }
         except Exception as e:
             api.abort(500, f'Failed to compute nearby advertisers: {str(e)}')
 
 
-# Add this new endpoint to your advertiser_api.py
+def _as_km(value):
+    """Distance as a float, or None for missing/NaN (advertisers without coordinates)."""
+    if value is None:
+        return None
+    value = float(value)
+    return None if value != value else value
+
+
+def _rank_by_distance(advertiser_query, relevance_order, lat, lon, max_km, by_distance):
+    """
+    Distance-aware search: one column-only SQL query for the candidate set,
+    one vectorized haversine pass to filter/rank it, then only the requested
+    page is loaded as rows. Returns (advertisers, distances, meta).
+    """
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', 10, type=int), 100))
+
+    candidate_query = advertiser_query.with_entities(Advertiser.id, Advertiser.latitude, Advertiser.longitude)
+    if max_km is not None:
+        candidate_query = candidate_query.filter(*spatial_prefilter(Advertiser, lat, lon, max_km))
+    candidates = candidate_query.order_by(
+        *[col.desc() if direction == 'desc' else col.asc() for col, direction in relevance_order]
+    ).all()
+
+    ids = [c[0] for c in candidates]
+    distances = distances_km(lat, lon, [(c[1], c[2]) for c in candidates])
+
+    if NUMPY_AVAILABLE:
+        distances = np.asarray(distances, dtype=np.float64)
+        positions = np.arange(len(ids))
+        if max_km is not None:
+            positions = positions[distances <= max_km]
+        if by_distance:
+            # NaN (no coordinates) sorts last; ties keep relevance order
+            positions = positions[np.argsort(distances[positions], kind='stable')]
+        positions = positions.tolist()
+    else:
+        positions = [i for i, d in enumerate(distances) if max_km is None or (d is not None and d <= max_km)]
+        if by_distance:
+            positions.sort(key=lambda i: (distances[i] is None, distances[i] or 0.0))
+
+    total = len(positions)
+    window = positions[(page - 1) * per_page:page * per_page]
+    page_ids = [ids[i] for i in window]
+    by_id = {a.id: a for a in Advertiser.query.filter(Advertiser.id.in_(page_ids)).all()} if page_ids else {}
+
+    advertisers, page_distances = [], []
+    for i in window:
+        advertiser = by_id.get(ids[i])
+        if advertiser:
+            advertisers.append(advertiser)
+            page_distances.append(distances[i])
+
+    meta = {
+        'total': total,
+        'pages': (total + per_page - 1) // per_page if total else 0,
+        'current_page': page,
+        'per_page': per_page,
+        'has_more': page * per_page < total,
+        'next_cursor': None,
+    }
+    return advertisers, page_distances, meta
+
 
 @api.route('/search/filtered')
 class SearchAdvertisersWithFilters(Resource):
     @api.doc('search_advertisers_with_filters')
     def get(self):
         """Search advertisers with advanced filtering by name, gender, location, and other criteria."""
+        # Optional caller location for distances
+        lat = request.args.get('lat', None, type=float)
+        lon = request.args.get('lon', None, type=float)
+        sort = request.args.get('sort', 'relevance')
+        max_km = request.args.get('max_km', None, type=float)
+        has_location = lat is not None and lon is not None
+        if (sort == 'distance' or max_km is not None) and not has_location:
+            api.abort(400, 'lat and lon are required for sort=distance or max_km')
+
         try:
             # Get search parameters
             query = request.args.get('q', '').strip()
@@ -450,10 +531,6 @@ class SearchAdvertisersWithFilters(Resource):
             verified_only = request.args.get('verified_only', False, type=bool)
             online_only = request.args.get('online_only', False, type=bool)
             
-            # Pagination
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
             # Start with base query
             advertiser_query = Advertiser.query
             
@@ -485,79 +562,118 @@ class SearchAdvertisersWithFilters(Resource):
                     Advertiser.is_verified == True
                 )
             
-            # Apply online status filter
+            # Apply online status filter. is_online is only written by the presence flush
+            # (clients cannot set it), so it lags live presence by at most one flush.
             if online_only:
                 advertiser_query = advertiser_query.filter(
                     Advertiser.is_online == True
                 )
             
-            # Order by verification status, online status, then name
-            advertiser_query = advertiser_query.order_by(
-                Advertiser.is_verified.desc(),
-                Advertiser.is_online.desc(),
-                Advertiser.name.asc()
-            )
+            # Order by verification status, flushed online status, then name (id breaks ties for the cursor).
+            # The flags are nullable, so coalesce them to keep the keyset comparison well defined.
+            verified = db.func.coalesce(Advertiser.is_verified, False)
+            online = db.func.coalesce(Advertiser.is_online, False)
+            relevance_order = [(verified, 'desc'), (online, 'desc'), (Advertiser.name, 'asc'), (Advertiser.id, 'asc')]
             
-            # Execute query with pagination
-            pagination = advertiser_query.paginate(
-                page=page, 
-                per_page=per_page, 
-                error_out=False
-            )
+            if sort == 'distance' or max_km is not None:
+                advertisers, distances, meta = _rank_by_distance(
+                    advertiser_query, relevance_order, lat, lon, max_km, by_distance=(sort == 'distance')
+                )
+            else:
+                advertisers, meta = paginate(
+                    advertiser_query,
+                    relevance_order,
+                    key=lambda a: (bool(a.is_verified), bool(a.is_online), a.name, a.id)
+                )
+                distances = None
+                if has_location:
+                    # One vectorized pass over the page
+                    distances = distances_km(lat, lon, [(a.latitude, a.longitude) for a in advertisers])
+            
+            # Live presence for the page in one lookup; the stored flag lags by up to one flush
+            online_now = presence.online_ids('advertiser', [a.id for a in advertisers])
             
             # Build response
             results = []
-            for advertiser in pagination.items:
+            for i, advertiser in enumerate(advertisers):
                 adv_data = advertiser.to_dict_safe()
-                # Add distance info if coordinates are available (placeholder for now)
-                adv_data['distance'] = '-- km'  # Could calculate real distance if user location provided
+                adv_data['is_online'] = advertiser.id in online_now
+                d = _as_km(distances[i]) if distances is not None else None
+                adv_data['distance_km'] = round(d, 2) if d is not None else None
+                adv_data['distance'] = f'{d:.1f} km' if d is not None else '-- km'
                 results.append(adv_data)
             
             return {
                 'items': results,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'current_page': pagination.page,
-                'per_page': pagination.per_page,
+                **meta,
                 'filters_applied': {
                     'query': query if query else None,
                     'gender': gender if gender else None,
                     'location': location if location else None,
                     'verified_only': verified_only,
-                    'online_only': online_only
+                    'online_only': online_only,
+                    'max_km': max_km,
+                    'sort': sort
                 },
-                'has_filters': bool(query or gender or location or verified_only or online_only)
+                'has_filters': bool(query or gender or location or verified_only or online_only or max_km is not None)
             }
             
+        except InvalidCursor as e:
+            api.abort(400, str(e))
         except Exception as e:
             api.abort(500, f'Failed to search advertisers: {str(e)}')
 
 
+MAX_PRESENCE_IDS = 500
+
+
+@api.route('/online')
+class OnlineAdvertisers(Resource):
+    @api.doc('get_online_advertisers', params={'ids': 'Comma-separated advertiser ids (max 500)'})
+    def get(self):
+        """Which of the given advertisers are online right now, from live socket presence"""
+        try:
+            ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+        except ValueError:
+            api.abort(400, 'ids must be a comma-separated list of integers')
+        if len(ids) > MAX_PRESENCE_IDS:
+            api.abort(400, f'At most {MAX_PRESENCE_IDS} ids per request')
+        
+        try:
+            online = presence.online_ids('advertiser', ids)
+            return {
+                'online': sorted(online),
+                'checked': len(set(ids))
+            }
+        except Exception as e:
+            api.abort(500, f'Failed to look up presence: {str(e)}')
+
+
 @api.route('/fcm-token')
 class FCMToken(Resource):
     @api.doc('update_fcm_token')
     @advertiser_required
     def post(self, current_user):
         """
-        Update user's FCM token for push notifications
+        Register this device's FCM token for push notifications. Each device
+        registers its own token; all of them are notified.
         
         Request body:
         {
-            "fcm_token": "firebase_token_here"
+            "fcm_token": "firebase_token_here",
+            "platform": "android"   // optional: android, ios, web
         }
         """
+        data = request.get_json(silent=True) or {}
+        fcm_token = data.get('fcm_token')
+        if not fcm_token:
+            api.abort(400, 'fcm_token is required')
+        
         try:
-            data = request.get_json()
-            fcm_token = data.get('fcm_token')
-            
-            if not fcm_token:
-                api.abort(400, 'fcm_token is required')
-            
-            # Update user's FCM token
-            current_user.fcm_token = fcm_token
+            DeviceToken.register('advertiser', current_user.id, fcm_token, data.get('platform'))
             db.session.commit()
             
-            print(f'[FCMToken] Updated token for {current_user.__class__.__name__}:{current_user.id}')
+            print(f'[FCMToken] Registered device token for {current_user.__class__.__name__}:{current_user.id}')
             
             return {
                 'message': 'FCM token updated successfully',
@@ -573,10 +689,12 @@ class FCMToken(Resource):
     @advertiser_required
     def delete(self, current_user):
         """
-        Delete user's FCM token (for logout)
+        Unregister a device token (for logout). Send {"fcm_token": ...} to
+        remove only this device; without it every device is removed.
         """
+        data = request.get_json(silent=True) or {}
         try:
-            current_user.fcm_token = None
+            DeviceToken.unregister('advertiser', current_user.id, data.get('fcm_token'))
             db.session.commit()
             
             print(f'[FCMToken] Deleted token for {current_user.__class__.__name__}:{current_user.id}')
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 import jwt
 import os
 from models import User, Advertiser, AuthToken, Subscription, db
+from utils.principal_cache import invalidate_principal
 
 api = Namespace('auth', description='Authentication operations')
 
@@ -511,6 +512,7 @@ class Logout(Resource):
                 if auth_token:
                     db.session.delete(auth_token)
                     db.session.commit()
+                    invalidate_principal(auth_token.user_type, auth_token.user_id)
             except Exception as db_error:
                 db.session.rollback()
                 api.abort(500, f'Database error: {str(db_error)}')
@@ -2,6 +2,9 @@ from flask import request, jsonify
 from flask_restx import Namespace, Resource, fields
 from models import Comment, CommentLike, User, Post, db
 from .decorators import token_required
+from sqlalchemy.exc import IntegrityError
+from utils.pagination import paginate, created_desc, InvalidCursor
+from utils.identity_loader import get_identity_loader
 
 api = Namespace('comments', description='Comment management operations')
 
@@ -105,6 +108,8 @@ class CommentList(Resource):
             )
             
             db.session.add(comment)
+            if target_type == 'post':
+                Post.increment_counter(target_id, 'comments_count', 1)
             db.session.commit()
             
             # Return complete comment data with user information
@@ -145,17 +150,20 @@ class CommentDetail(Resource):
             if not comment or comment.is_deleted:
                 api.abort(404, 'Comment not found')
             
-            user = User.find_by_id(comment.user_id)
-            
             # Get replies
             replies = Comment.query.filter_by(
                 parent_comment_id=comment_id,
                 is_deleted=False
             ).order_by(Comment.created_at.asc()).all()
             
+            # Author and reply authors in one batch
+            loader = get_identity_loader()
+            loader.want(('user', c.user_id) for c in [comment] + replies)
+            user = loader.get('user', comment.user_id)
+            
             reply_list = []
             for reply in replies:
-                reply_user = User.find_by_id(reply.user_id)
+                reply_user = loader.get('user', reply.user_id)
                 reply_dict = {
                     'id': reply.id,
                     'content': reply.content,
@@ -237,6 +245,8 @@ class CommentDetail(Resource):
             
             # Soft delete
             comment.is_deleted = True
+            if comment.target_type == 'post':
+                Post.increment_counter(comment.target_id, 'comments_count', -1)
             db.session.commit()
             
             return {'message': 'Comment deleted successfully'}
@@ -270,9 +280,14 @@ class CommentLikeResource(Resource):
                 user_id=current_user.id
             )
             db.session.add(like)
+            try:
+                db.session.flush()
+            except IntegrityError:
+                db.session.rollback()
+                api.abort(400, 'Comment already liked')
             
-            # Update likes count
-            comment.likes_count += 1
+            # Update likes count in SQL so concurrent likes are not lost
+            Comment.increment_likes(comment_id, 1)
             db.session.commit()
             
             return {'message': 'Comment liked successfully'}
@@ -289,19 +304,16 @@ class CommentLikeResource(Resource):
             if not comment or comment.is_deleted:
                 api.abort(404, 'Comment not found')
             
-            like = CommentLike.query.filter_by(
+            deleted = CommentLike.query.filter_by(
                 comment_id=comment_id,
                 user_id=current_user.id
-            ).first()
+            ).delete(synchronize_session=False)
             
-            if not like:
+            if not deleted:
                 api.abort(404, 'Like not found')
             
-            db.session.delete(like)
-            
-            # Update likes count
-            if comment.likes_count > 0:
-                comment.likes_count -= 1
+            # Update likes count in SQL so concurrent unlikes are not lost
+            Comment.increment_likes(comment_id, -1)
             
             db.session.commit()
             
@@ -321,34 +333,39 @@ class TargetComments(Resource):
             if target_type not in ['post', 'profile']:
                 api.abort(400, 'Invalid target_type')
             
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
             # Get parent comments only (not replies)
-            comments = Comment.query.filter_by(
-                target_type=target_type,
-                target_id=target_id,
-                parent_comment_id=None,
-                is_deleted=False
-            ).order_by(Comment.created_at.desc()).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
+            comments, meta = paginate(
+                Comment.query.filter_by(
+                    target_type=target_type,
+                    target_id=target_id,
+                    parent_comment_id=None,
+                    is_deleted=False
+                ),
+                created_desc(Comment)
             )
             
+            # Replies for the whole page in one query, grouped by parent
+            replies_by_parent = {}
+            if comments:
+                for reply in Comment.query.filter(
+                    Comment.parent_comment_id.in_([c.id for c in comments]),
+                    Comment.is_deleted == False
+                ).order_by(Comment.created_at.asc(), Comment.id.asc()).all():
+                    replies_by_parent.setdefault(reply.parent_comment_id, []).append(reply)
+            
+            # Every author on the page (comments and replies) in one batch
+            loader = get_identity_loader()
+            loader.want(('user', c.user_id) for c in comments)
+            loader.want(('user', r.user_id) for replies in replies_by_parent.values() for r in replies)
+            
             result = []
-            for comment in comments.items:
-                user = User.find_by_id(comment.user_id)
-                
-                # Get replies for this comment
-                replies = Comment.query.filter_by(
-                    parent_comment_id=comment.id,
-                    is_deleted=False
-                ).order_by(Comment.created_at.asc()).all()
+            for comment in comments:
+                user = loader.get('user', comment.user_id)
+                replies = replies_by_parent.get(comment.id, [])
                 
                 reply_list = []
                 for reply in replies:
-                    reply_user = User.find_by_id(reply.user_id)
+                    reply_user = loader.get('user', reply.user_id)
                     reply_dict = {
                         'id': reply.id,
                         'content': reply.content,
@@ -379,7 +396,15 @@ class TargetComments(Resource):
                 }
                 result.append(comment_dict)
             
-            return result
+            # The body stays a bare list for existing clients; paging info rides in headers
+            headers = {'X-Has-More': 'true' if meta['has_more'] else 'false'}
+            if meta['next_cursor']:
+                headers['X-Next-Cursor'] = meta['next_cursor']
+            if 'total' in meta:
+                headers['X-Total-Count'] = str(meta['total'])
+            return result, 200, headers
             
+        except InvalidCursor as e:
+            api.abort(400, str(e))
         except Exception as e:
             api.abort(500, f'Failed to retrieve comments: {str(e)}')
\ No newline at end of file
@@ -1,9 +1,13 @@
-from flask import request, jsonify
+from flask import request, jsonify, current_app
 from flask_cors import cross_origin
 from flask_restx import Namespace, Resource, fields
-from models import Conversation, ConversationParticipant, Message, User, Advertiser, db
+from models import Conversation, ConversationParticipant, Message, MediaBlob, User, Advertiser, db
 from .decorators import token_required
 from sqlalchemy.orm import aliased
+from services.inbox_service import load_inbox
+from utils.identity_loader import get_identity_loader
+from utils.pagination import InvalidCursor
+from services.socket_sessions import socket_sessions
 
 api = Namespace('conversations', description='Conversation management operations')
 
@@ -87,6 +91,7 @@ class ConversationWithAdvertiser(Resource):
             db.session.add(user_participant)
             db.session.add(advertiser_participant)
             db.session.commit()
+            socket_sessions.invalidate([('user', current_user.id), ('advertiser', advertiser_id)])
             
             print(f'[ConversationWithAdvertiser] Created conversation {conv.id}')
             
@@ -136,19 +141,15 @@ conversation_with_details_model = api.model('ConversationWithDetails', {
 
 def _get_unread_count_for_conversation(conversation_id, current_user_id, current_user_type):
     """
-    Helper to calculate unread count correctly by checking BOTH sender_id AND sender_type.
-    Only counts messages NOT sent by current user (matching both ID and type).
+    Helper to read the unread badge for the current participant.
+    The count is maintained on the participant row (see ConversationParticipant.record_message),
+    so this is a primary-key style lookup rather than a scan over messages.
     """
-    return Message.query.filter(
-        Message.conversation_id == conversation_id,
-        Message.is_read == False,
-        db.not_(
-            db.and_(
-                Message.sender_id == current_user_id,
-                Message.sender_type == current_user_type
-            )
-        )
-    ).count()
+    return db.session.query(ConversationParticipant.unread_count).filter_by(
+        conversation_id=conversation_id,
+        participant_type=current_user_type,
+        participant_id=current_user_id
+    ).scalar() or 0
 
 @api.route('/')
 class ConversationList(Resource):
@@ -157,60 +158,14 @@ class ConversationList(Resource):
     def get(self, current_user):
         """Get all conversations for current user"""
         try:
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 20, type=int)
-            
-            # Determine current user type
-            current_user_type = 'advertiser' if isinstance(current_user, Advertiser) else 'user'
-            
-            conversations = db.session.query(Conversation).join(
-                ConversationParticipant,
-                ConversationParticipant.conversation_id == Conversation.id,
-            ).filter(
-                ConversationParticipant.participant_type == current_user_type,
-                ConversationParticipant.participant_id == current_user.id,
-            ).order_by(Conversation.last_message_at.desc()).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False,
-            )
+            # Whole page in a fixed number of queries (see services/inbox_service.py)
+            entries, meta = load_inbox(current_user)
             
             result = []
-            for conversation in conversations.items:
-                # Get last message details
-                last_message = None
-                if conversation.last_message_id:
-                    last_message = Message.query.get(conversation.last_message_id)
-                
-                # FIXED: Get unread count with proper sender type filtering
-                unread_count = _get_unread_count_for_conversation(
-                    conversation.id,
-                    current_user.id,
-                    current_user_type
-                )
-                
-                # For direct conversations, get the other participant
-                participant = None
-                participant_type = None
-                if conversation.type == 'direct':
-                    # Get all participants
-                    all_participants = ConversationParticipant.query.filter_by(
-                        conversation_id=conversation.id
-                    ).all()
-                    
-                    # Find the OTHER participant (not current user)
-                    for p in all_participants:
-                        if p.participant_type == current_user_type and p.participant_id == current_user.id:
-                            continue
-                        
-                        participant_type = p.participant_type
-                        if p.participant_type == 'user':
-                            participant = User.find_by_id(p.participant_id)
-                        elif p.participant_type == 'advertiser':
-                            participant = Advertiser.find_by_id(p.participant_id)
-                        
-                        if participant:
-                            break
+            for entry in entries:
+                conversation = entry['conversation']
+                last_message = entry['last_message']
+                participant = entry['participant'] if conversation.type == 'direct' else None
                 
                 conversation_dict = {
                     'id': conversation.id,
@@ -220,25 +175,33 @@ class ConversationList(Resource):
                     'last_message_at': conversation.last_message_at.isoformat() if conversation.last_message_at else None,
                     'updated_at': conversation.updated_at.isoformat() if conversation.updated_at else None,
                     'participant': {
-                        'type': participant_type,
-                        'id': participant.id if participant else None,
-                        'name': participant.name if participant else 'Unknown User',
-                        'username': participant.username if participant else 'unknown',
-                        'profile_image_url': getattr(participant, 'profile_image_url', None) if participant else None,
+                        'type': entry['participant_type'],
+                        'id': participant.id,
+                        'name': participant.name,
+                        'username': participant.username,
+                        'profile_image_url': getattr(participant, 'profile_image_url', None),
                     } if participant else None,
                     'last_message': {
                         'id': last_message.id,
                         'content': last_message.content,
+                        'message_type': conversation.last_message_type or 'text',
+                        'preview': conversation.last_message_preview,
                         'sender_id': last_message.sender_id,
                         'sender_type': last_message.sender_type or 'user',
                         'created_at': last_message.created_at.isoformat() if last_message.created_at else None
                     } if last_message else None,
-                    'unread_count': unread_count
+                    'unread_count': entry['unread_count']
                 }
                 result.append(conversation_dict)
             
-            return result
+            # The body stays a bare list for existing clients; paging info rides in headers
+            headers = {'X-Has-More': 'true' if meta['has_more'] else 'false'}
+            if meta['next_cursor']:
+                headers['X-Next-Cursor'] = meta['next_cursor']
+            return result, 200, headers
             
+        except InvalidCursor as e:
+            api.abort(400, str(e))
         except Exception as e:
             api.abort(500, f'Failed to retrieve conversations: {str(e)}')
     
@@ -296,6 +259,7 @@ class ConversationList(Resource):
             db.session.add(ConversationParticipant(conversation_id=conversation.id, participant_type='user', participant_id=current_user.id))
             db.session.add(ConversationParticipant(conversation_id=conversation.id, participant_type='user', participant_id=participant_id))
             db.session.commit()
+            socket_sessions.invalidate([('user', current_user.id), ('user', int(participant_id))])
             
             return {
                 'id': conversation.id,
@@ -350,15 +314,15 @@ class ConversationDetail(Resource):
                     conversation_id=conversation.id
                 ).all()
                 
-                for p in all_participants:
-                    if p.participant_type == current_user_type and p.participant_id == current_user.id:
-                        continue
-                    
+                others = [
+                    p for p in all_participants
+                    if not (p.participant_type == current_user_type and p.participant_id == current_user.id)
+                ]
+                loader = get_identity_loader()
+                loader.want((p.participant_type, p.participant_id) for p in others)
+                for p in others:
                     participant_type = p.participant_type
-                    if p.participant_type == 'user':
-                        participant = User.find_by_id(p.participant_id)
-                    elif p.participant_type == 'advertiser':
-                        participant = Advertiser.find_by_id(p.participant_id)
+                    participant = loader.get(p.participant_type, p.participant_id)
                     
                     if participant:
                         break
@@ -409,6 +373,18 @@ class ConversationDetail(Resource):
             if not is_participant:
                 api.abort(403, 'Can only delete conversations you participate in')
             
+            participants = db.session.query(
+                ConversationParticipant.participant_type, ConversationParticipant.participant_id
+            ).filter_by(conversation_id=conversation_id).all()
+            
+            # The bulk delete skips MessageDetail's per-message unref, so release each blob's refs first
+            MediaBlob.release_refs(dict(
+                db.session.query(Message.media_blob_id, db.func.count(Message.id)).filter(
+                    Message.conversation_id == conversation_id,
+                    Message.media_blob_id.isnot(None)
+                ).group_by(Message.media_blob_id).all()
+            ))
+            
             # Delete all messages in the conversation
             Message.query.filter_by(conversation_id=conversation_id).delete()
             
@@ -419,6 +395,15 @@ class ConversationDetail(Resource):
             db.session.delete(conversation)
             db.session.commit()
             
+            # Drop it from cached socket membership and close its room
+            socket_sessions.invalidate([tuple(p) for p in participants])
+            try:
+                socketio = current_app.extensions.get('socketio')
+                if socketio:
+                    socketio.close_room(f"conv_{conversation_id}")
+            except Exception as ws_error:
+                print(f'[Conversations] WebSocket close_room error: {ws_error}')
+            
             return {'message': 'Conversation deleted successfully'}
             
         except Exception as e:
@@ -442,27 +427,8 @@ class ConversationStats(Resource):
                 ConversationParticipant.participant_id == current_user.id
             ).count()
             
-            # Get all user conversations
-            user_conversations = db.session.query(Conversation.id).join(
-                ConversationParticipant,
-                ConversationParticipant.conversation_id == Conversation.id
-            ).filter(
-                ConversationParticipant.participant_type == current_user_type,
-                ConversationParticipant.participant_id == current_user.id
-            ).all()
-            conversation_ids = [c[0] for c in user_conversations]
-            
-            # FIXED: Total unread messages with proper sender type filtering
-            total_unread = Message.query.filter(
-                Message.conversation_id.in_(conversation_ids),
-                Message.is_read == False,
-                db.not_(
-                    db.and_(
-                        Message.sender_id == current_user.id,
-                        Message.sender_type == current_user_type
-                    )
-                )
-            ).count()
+            # Total unread messages: sum of the maintained per-conversation badges
+            total_unread = ConversationParticipant.total_unread(current_user_type, current_user.id)
             
             # Active conversations (with messages in last 30 days)
             from datetime import datetime, timedelta
@@ -2,7 +2,8 @@ from functools import wraps
 from flask import request, jsonify
 import jwt
 import os
-from models import User, Advertiser
+from utils.identity_loader import get_identity_loader
+from utils.principal_cache import load_principal
 
 
 def _decode_token():
@@ -13,6 +14,11 @@ def _decode_token():
             token = auth_header.split(" ")[1]
         except IndexError:
             return None, ('Invalid token format', 401)
+    return decode_access_token(token)
+
+
+def decode_access_token(token):
+    """(payload, None) for a valid access token, else (None, (message, status))."""
     if not token:
         return None, ('Token is missing', 401)
     try:
@@ -37,9 +43,10 @@ def token_required(f):
             return jsonify({'message': msg}), code
         user_type = payload.get('user_type', 'user')
         user_id = payload.get('user_id')
-        current = Advertiser.find_by_id(user_id) if user_type == 'advertiser' else User.find_by_id(user_id)
+        current = load_principal('advertiser' if user_type == 'advertiser' else 'user', user_id)
         if not current:
             return jsonify({'message': 'User not found'}), 401
+        get_identity_loader().prime(current)
         return f(self, current, *args, **kwargs)
     return wrapper
 
@@ -54,8 +61,9 @@ def advertiser_required(f):
             return jsonify({'message': msg}), code
         if payload.get('user_type') != 'advertiser':
             return jsonify({'message': 'Advertiser access required'}), 403
-        adv = Advertiser.find_by_id(payload.get('user_id'))
+        adv = load_principal('advertiser', payload.get('user_id'))
         if not adv:
             return jsonify({'message': 'Advertiser not found'}), 401
+        get_identity_loader().prime(adv)
         return f(self, adv, *args, **kwargs)
     return wrapper
@@ -1,24 +1,42 @@
 from flask import request, jsonify
 from flask_restx import Namespace, Resource, fields
-from models import Message, Conversation, ConversationParticipant, User, Advertiser, db
+from models import Message, Conversation, ConversationParticipant, User, Advertiser, UploadSession, MediaBlob, db
 from flask import current_app
 from .decorators import token_required
-from datetime import datetime
+from datetime import datetime, timedelta
 from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
 from werkzeug.utils import secure_filename
+from models.conversations import message_preview_text
+from services.inbox_service import load_inbox, normalize_sender_type, read_marks_for, is_read_for, participant_type_of
+from utils.identity_loader import get_identity_loader
+from utils.pagination import InvalidCursor, cached_count, keyset_after
 import os
+import uuid
 
 api = Namespace('messages', description='Message management operations')
 
 # Import media utilities (create this file from the artifact)
 try:
-    from utils.media_utils import upload_media_file
+    from utils.media_utils import (
+        upload_media_file, srcset_from_metadata,
+        check_media_extension, create_partial_upload, append_upload_chunk,
+        partial_upload_path, discard_partial_upload, MAX_RESUMABLE_UPLOAD_MB
+    )
+    from services.media_store import store_upload, store_file, stored_media_for_key
+    from services.media_worker import media_pool, MediaQueueFull
 
     MEDIA_UPLOAD_ENABLED = True
 except ImportError:
     print("[MessageAPI] WARNING:  not found. Media upload disabled.")
     MEDIA_UPLOAD_ENABLED = False
 
+    class MediaQueueFull(Exception):
+        pass
+
+    def srcset_from_metadata(media_metadata):
+        return None
+
 # Models for Swagger documentation
 message_model = api.model('Message', {
     'id': fields.Integer(description='Message ID'),
@@ -36,6 +54,7 @@ message_model = api.model('Message', {
     'media_url': fields.String(description='Media file URL'),
     'thumbnail_url': fields.String(description='Thumbnail URL (for videos)'),
     'media_metadata': fields.Raw(description='Media metadata (dimensions, duration, etc.)'),
+    'client_message_id': fields.String(description='Sender-generated id, if one was sent'),
     'is_read': fields.Boolean(description='Read status'),
     'created_at': fields.String(description='Creation timestamp'),
     'updated_at': fields.String(description='Last update timestamp')
@@ -46,7 +65,8 @@ message_create_model = api.model('MessageCreate', {
     'sender_id': fields.Integer(required=True, description='Sender user ID'),
     'sender_type': fields.String(description='Sender type (user or advertiser)'),
     'content': fields.String(description='Message content'),
-    'message_type': fields.String(description='Message type (text, image, video, audio)', default='text')
+    'message_type': fields.String(description='Message type (text, image, video, audio)', default='text'),
+    'client_message_id': fields.String(description='Sender-generated id; retrying with the same id returns the original message')
 })
 
 message_update_model = api.model('MessageUpdate', {
@@ -54,10 +74,15 @@ message_update_model = api.model('MessageUpdate', {
     'is_read': fields.Boolean(description='Read status')
 })
 
-def _build_message_dict(msg, include_sender=True):
+def _build_message_dict(msg, include_sender=True, read_marks=None):
     """
     Helper function to build a message dictionary with sender info.
     UPDATED: Now includes multimedia fields
+    
+    Senders come from the request's identity loader; register them with
+    ``get_identity_loader().want(...)`` before serializing a list so they load
+    in one batch. Pass ``read_marks`` (from inbox_service.read_marks_for) to derive is_read from the
+    participants' read high-water marks.
     """
     msg_dict = {
         'id': msg.id,
@@ -69,7 +94,9 @@ def _build_message_dict(msg, include_sender=True):
         'media_url': getattr(msg, 'media_url', None),  # NEW
         'thumbnail_url': getattr(msg, 'thumbnail_url', None),  # NEW
         'media_metadata': getattr(msg, 'media_metadata', None),  # NEW
-        'is_read': msg.is_read,
+        'client_message_id': getattr(msg, 'client_message_id', None),
+        'srcset': srcset_from_metadata(getattr(msg, 'media_metadata', None)),
+        'is_read': is_read_for(msg, read_marks) if read_marks else msg.is_read,
         'created_at': msg.created_at.isoformat() if msg.created_at else None,
         'updated_at': msg.updated_at.isoformat() if msg.updated_at else None
     }
@@ -79,12 +106,8 @@ def _build_message_dict(msg, include_sender=True):
         sender_type = msg.sender_type or 'user'
         
         # Normalize sender type
-        if sender_type.lower() in ['advertiser', 'escort', 'provider']:
-            sender_type = 'advertiser'
-            sender = Advertiser.find_by_id(msg.sender_id)
-        else:
-            sender_type = 'user'
-            sender = User.find_by_id(msg.sender_id)
+        sender_type = normalize_sender_type(sender_type)
+        sender = get_identity_loader().get(sender_type, msg.sender_id)
         
         msg_dict['sender_type'] = sender_type
         msg_dict['sender'] = {
@@ -98,12 +121,167 @@ def _build_message_dict(msg, include_sender=True):
 
 # Import notification utils if available
 try:
-    from .notification_utils import send_message_notification
+    from services.push_dispatcher import push_dispatcher
     NOTIFICATIONS_ENABLED = True
 except ImportError:
     print("[MessageAPI] WARNING: notification_utils not found. Notifications disabled.")
     NOTIFICATIONS_ENABLED = False
 
+CLIENT_MESSAGE_ID_MAX = 64
+
+def _find_client_message(conversation_id, sender_type, sender_id, client_message_id):
+    if not client_message_id:
+        return None
+    return Message.query.filter_by(
+        conversation_id=conversation_id,
+        sender_type=sender_type,
+        sender_id=sender_id,
+        client_message_id=client_message_id
+    ).first()
+
+def _create_message(conversation, sender, sender_type, content, message_type='text', media_url=None,
+                    thumbnail_url=None, media_metadata=None, saved_media=None, client_message_id=None):
+    """
+    Insert a message from an authorized participant and fan it out: inbox
+    preview, unread badges, media processing, push and the ``new_message``
+    emit to the conversation room. Shared by POST /messages/ and the
+    ``send_message`` socket event.
+    
+    Returns (message, payload, created). Resending a ``client_message_id``
+    returns the stored message with created=False, without emitting again.
+    """
+    existing = _find_client_message(conversation.id, sender_type, sender.id, client_message_id)
+    if existing:
+        return existing, _build_message_dict(existing, include_sender=True), False
+    
+    message = Message(
+        conversation_id=conversation.id,
+        sender_id=sender.id,
+        sender_type=sender_type,
+        content=content,
+        message_type=message_type,
+        media_url=media_url,
+        thumbnail_url=thumbnail_url,
+        media_metadata=media_metadata,
+        client_message_id=client_message_id
+    )
+    if saved_media:
+        message.media_blob_id = saved_media['blob_id']
+    
+    try:
+        # Savepoint: a duplicate only undoes this insert, not the rest of the request
+        with db.session.begin_nested():
+            db.session.add(message)
+    except IntegrityError:
+        # A concurrent retry of the same send won the insert
+        existing = _find_client_message(conversation.id, sender_type, sender.id, client_message_id)
+        if not existing:
+            raise
+        return existing, _build_message_dict(existing, include_sender=True), False
+    if saved_media:
+        MediaBlob.add_ref(saved_media['blob_id'])
+    
+    # Update conversation's last message pointer and inbox preview
+    conversation.set_last_message(message)
+    conversation.updated_at = datetime.utcnow()
+    
+    # Bump the other participants' unread badges; the sender has read their own message
+    ConversationParticipant.record_message(conversation.id, message.id, sender_type, sender.id)
+    
+    db.session.commit()
+    
+    print(f'[MessageAPI] Message {message.id} created (type: {message_type})')
+    
+    if saved_media and not saved_media['processed']:
+        try:
+            media_pool.process_message_media(message.id, saved_media)
+        except MediaQueueFull:
+            # Lost the race for the last slot; the message still has its media_url
+            print(f'[MessageAPI] Media queue full, message {message.id} will have no thumbnail')
+
+    # Build response payload
+    payload = _build_message_dict(message, include_sender=True)
+    
+    # ========== SEND PUSH NOTIFICATIONS ==========
+    # Recipients, tokens and FCM calls are handled off-request by the push dispatcher
+    if NOTIFICATIONS_ENABLED:
+        try:
+            push_dispatcher.notify_new_message(
+                conversation_id=conversation.id,
+                sender_type=sender_type,
+                sender_id=sender.id,
+                sender_name=sender.name if hasattr(sender, 'name') else 'Someone',
+                preview=message_preview_text(message_type, content),
+                sender_avatar=getattr(sender, 'profile_image_url', None)
+            )
+        except Exception as notif_error:
+            print(f'[MessageAPI] Error queueing notification: {notif_error}')
+    
+    # ========== END PUSH NOTIFICATIONS ==========
+    
+    # Emit via WebSocket
+    try:
+        socketio = current_app.extensions.get('socketio')
+        if socketio:
+            room = f"conv_{message.conversation_id}"
+            socketio.emit('new_message', payload, room=room)
+            print(f'[MessageAPI] WebSocket emitted for message {message.id}')
+    except Exception as ws_error:
+        print(f'[MessageAPI] WebSocket emit error: {ws_error}')
+    
+    return message, payload, True
+
+def send_socket_message(principal_key, data):
+    """
+    ``send_message`` socket event. The sender is the principal bound to the
+    socket at connect and membership comes from the socket session cache, so
+    a send is one insert plus one emit. Returns the ack for the client:
+    
+        {'ok': True, 'client_message_id': ..., 'message': {...id, created_at...}}
+        {'ok': False, 'client_message_id': ..., 'error': '...'}
+    
+    Text only; media goes through POST /api/messages/ (upload or upload_id).
+    """
+    from services.socket_sessions import socket_sessions
+    from utils.principal_cache import load_principal
+    
+    data = data if isinstance(data, dict) else {}
+    client_message_id = data.get('client_message_id') or None
+    
+    def nack(error):
+        return {'ok': False, 'client_message_id': client_message_id, 'error': error}
+    
+    if principal_key is None:
+        return nack('Not authenticated')
+    if client_message_id and (not isinstance(client_message_id, str) or len(client_message_id) > CLIENT_MESSAGE_ID_MAX):
+        return nack(f'client_message_id must be a string of at most {CLIENT_MESSAGE_ID_MAX} characters')
+    if data.get('message_type', 'text') != 'text':
+        return nack('Media messages must be sent with POST /api/messages/')
+    content = data.get('content')
+    if not isinstance(content, str) or not content.strip():
+        return nack('content is required')
+    try:
+        conversation_id = int(data.get('conversation_id'))
+    except (TypeError, ValueError):
+        return nack('conversation_id is required')
+    
+    try:
+        if not socket_sessions.is_member(principal_key, conversation_id):
+            return nack('Not a participant in this conversation')
+        sender = load_principal(*principal_key)
+        conversation = Conversation.query.get(conversation_id)
+        if not sender or not conversation:
+            return nack('Conversation not found')
+        
+        _, payload, _ = _create_message(
+            conversation, sender, principal_key[0], content, client_message_id=client_message_id
+        )
+        return {'ok': True, 'client_message_id': client_message_id, 'message': payload}
+    except Exception as e:
+        db.session.rollback()
+        print(f'[MessageAPI] Error sending socket message: {str(e)}')
+        return nack('Failed to send message')
+
 @api.route('/')
 class MessageList(Resource):
     @api.doc('create_message')
@@ -132,13 +310,16 @@ class MessageList(Resource):
                 if message_type not in ['image', 'video', 'audio']:
                     api.abort(400, 'Invalid message_type for file upload. Must be: image, video, or audio')
                 
-                # Upload file and get URL
+                # Refuse early rather than queue thumbnail work without bound
+                media_pool.ensure_capacity()
+                
+                # Store file (content-addressed) and get URL; thumbnails/metadata are filled in by
+                # the media worker, or reused straight away when the same bytes were processed before
                 try:
                     print(f'[MessageAPI] Uploading {message_type} file...')
-                    upload_result = upload_media_file(file, message_type)
-                    media_url = upload_result['url']
-                    thumbnail_url = upload_result.get('thumbnail_url')
-                    media_metadata = upload_result.get('metadata', {})
+                    saved_media = store_upload(file, message_type)
+                    media_url = saved_media['url']
+                    thumbnail_url, media_metadata = _initial_media_fields(saved_media)
                     print(f'[MessageAPI] File uploaded successfully: {media_url}')
                 except ValueError as ve:
                     api.abort(400, str(ve))
@@ -154,6 +335,32 @@ class MessageList(Resource):
                 media_url = None
                 thumbnail_url = None
                 media_metadata = None
+                saved_media = None
+
+                # A retry after a lost response gets the stored message back, before the
+                # upload_id below (consumed by the first attempt) is validated again
+                existing = _find_client_message(
+                    data.get('conversation_id'), participant_type_of(current_user), current_user.id,
+                    data.get('client_message_id')
+                )
+                if existing:
+                    return _build_message_dict(existing, include_sender=True), 200
+
+                if data.get('upload_id'):
+                    # Media from a completed resumable upload session
+                    upload = _owned_upload_session(data['upload_id'], current_user)
+                    if not upload or upload.status != 'complete':
+                        api.abort(400, 'upload_id does not refer to a completed upload')
+                    if upload.media_type != message_type:
+                        api.abort(400, f'Upload is {upload.media_type}, message_type is {message_type}')
+                    media_pool.ensure_capacity()
+                    saved_media = stored_media_for_key(upload.media_path)
+                    if not saved_media:
+                        api.abort(410, 'Uploaded file is no longer available')
+                    media_url = saved_media['url']
+                    thumbnail_url, media_metadata = _initial_media_fields(saved_media)
+                    # One message per upload
+                    upload.status = 'consumed'
             
             sender_id = int(data.get('sender_id'))
             sender_type = data.get('sender_type', 'user').lower()
@@ -192,118 +399,26 @@ class MessageList(Resource):
             if message_type != 'text' and not media_url:
                 api.abort(400, 'Media URL is required for non-text messages')
             
-            # Create message with multimedia support
-            message_data = {
-                'conversation_id': data['conversation_id'],
-                'sender_id': sender_id,
-                'sender_type': sender_type,
-                'content': content,
-            }
-            
-            # Add multimedia fields if they exist in the model
-            if hasattr(Message, 'message_type'):
-                message_data['message_type'] = message_type
-            if hasattr(Message, 'media_url'):
-                message_data['media_url'] = media_url
-            if hasattr(Message, 'thumbnail_url'):
-                message_data['thumbnail_url'] = thumbnail_url
-            if hasattr(Message, 'media_metadata'):
-                message_data['media_metadata'] = media_metadata
-            
-            message = Message(**message_data)
-            
-            db.session.add(message)
-            db.session.flush()
-            
-            # Update conversation's last_message_id and last_message_at
-            conversation.last_message_id = message.id
-            conversation.last_message_at = datetime.utcnow()
-            conversation.updated_at = datetime.utcnow()
-            
-            db.session.commit()
-            
-            print(f'[MessageAPI] Message {message.id} created (type: {message_type})')
-
-            # Build response payload
-            payload = _build_message_dict(message, include_sender=True)
+            client_message_id = data.get('client_message_id') or None
+            if client_message_id and len(client_message_id) > CLIENT_MESSAGE_ID_MAX:
+                api.abort(400, f'client_message_id must be at most {CLIENT_MESSAGE_ID_MAX} characters')
             
-            # ========== SEND PUSH NOTIFICATIONS ==========
-            if NOTIFICATIONS_ENABLED:
-                try:
-                    # Get OTHER participants in the conversation
-                    other_participants = ConversationParticipant.query.filter(
-                        ConversationParticipant.conversation_id == conversation.id,
-                        db.or_(
-                            ConversationParticipant.participant_id != sender_id,
-                            ConversationParticipant.participant_type != sender_type
-                        )
-                    ).all()
-                    
-                    # Get sender info for notification
-                    sender_name = current_user.name if hasattr(current_user, 'name') else 'Someone'
-                    sender_avatar = getattr(current_user, 'profile_image_url', None)
-                    
-                    # Determine notification content based on message type
-                    if message_type == 'text':
-                        notification_content = content
-                    elif message_type == 'image':
-                        notification_content = '📷 Sent a photo'
-                    elif message_type == 'video':
-                        notification_content = '🎥 Sent a video'
-                    elif message_type == 'audio':
-                        notification_content = '🎤 Sent a voice message'
-                    else:
-                        notification_content = 'Sent a message'
-                    
-                    # Send notification to each recipient
-                    for participant in other_participants:
-                        try:
-                            if participant.participant_type == 'user':
-                                recipient = User.find_by_id(participant.participant_id)
-                            else:
-                                recipient = Advertiser.find_by_id(participant.participant_id)
-                            
-                            if not recipient:
-                                continue
-                            
-                            fcm_token = getattr(recipient, 'fcm_token', None)
-                            
-                            if fcm_token:
-                                print(f'[MessageAPI] Sending notification to {participant.participant_type}:{participant.participant_id}')
-                                
-                                send_message_notification(
-                                    fcm_token=fcm_token,
-                                    sender_name=sender_name,
-                                    message_content=notification_content,
-                                    conversation_id=conversation.id,
-                                    sender_id=sender_id,
-                                    sender_type=sender_type,
-                                    sender_avatar=sender_avatar
-                                )
-                            else:
-                                print(f'[MessageAPI] No FCM token for {participant.participant_type}:{participant.participant_id}')
-                        
-                        except Exception as notif_error:
-                            print(f'[MessageAPI] Error sending notification: {notif_error}')
-                            continue
-                
-                except Exception as notif_error:
-                    print(f'[MessageAPI] Error in notification process: {notif_error}')
-            
-            # ========== END PUSH NOTIFICATIONS ==========
-            
-            # Emit via WebSocket
-            try:
-                socketio = current_app.extensions.get('socketio')
-                if socketio:
-                    room = f"conv_{message.conversation_id}"
-                    socketio.emit('new_message', payload, room=room)
-                    print(f'[MessageAPI] WebSocket emitted for message {message.id}')
-            except Exception as ws_error:
-                print(f'[MessageAPI] WebSocket emit error: {ws_error}')
+            message, payload, created = _create_message(
+                conversation, current_user, sender_type, content,
+                message_type=message_type,
+                media_url=media_url,
+                thumbnail_url=thumbnail_url,
+                media_metadata=media_metadata,
+                saved_media=saved_media,
+                client_message_id=client_message_id
+            )
+            if not created:
+                return payload, 200
 
             return payload, 201
             
+        except MediaQueueFull:
+            api.abort(503, 'Media processing is busy, please retry shortly')
         except Exception as e:
             db.session.rollback()
             print(f'[MessageAPI] Error creating message: {str(e)}')
@@ -344,6 +459,200 @@ class MediaUpload(Resource):
             print(f'[MessageAPI] Error in media upload: {str(e)}')
             api.abort(500, f'Failed to upload media: {str(e)}')
 
+# ========== RESUMABLE UPLOADS ==========
+# create session -> PUT chunks at Upload-Offset -> GET progress to resume -> POST complete
+# -> create the message with {"upload_id": ...}, which queues the usual thumbnail/metadata work.
+
+RESUMABLE_UPLOAD_TTL = timedelta(hours=int(os.environ.get('RESUMABLE_UPLOAD_TTL_HOURS', 24)))
+RESUMABLE_CHUNK_SIZE = 5 * 1024 * 1024  # suggested; any size up to MAX_CONTENT_LENGTH is accepted
+
+upload_session_create_model = api.model('UploadSessionCreate', {
+    'filename': fields.String(required=True, description='Original filename (its extension is validated)'),
+    'media_type': fields.String(required=True, description='image, video or audio'),
+    'total_size': fields.Integer(required=True, description='Size of the whole file in bytes')
+})
+
+
+def _initial_media_fields(saved_media):
+    """(thumbnail_url, media_metadata) for a new message: reused from an already processed blob, else pending."""
+    if saved_media['processed']:
+        return saved_media['thumbnail_url'], saved_media['metadata']
+    return None, {**saved_media['metadata'], 'processing': True}
+
+
+def _owned_upload_session(upload_id, current_user):
+    """The caller's upload session, or None if it does not exist, is someone else's, or expired."""
+    upload = UploadSession.query.get(upload_id)
+    if not upload:
+        return None
+    if (upload.owner_type, upload.owner_id) != (participant_type_of(current_user), current_user.id):
+        return None
+    if upload.status == 'open' and upload.expires_at < datetime.utcnow():
+        return None
+    return upload
+
+
+def _chunk_offset():
+    """Start offset of a chunk: Upload-Offset header, ?offset=, or the start of Content-Range."""
+    offset = request.headers.get('Upload-Offset', request.args.get('offset'))
+    if offset is None and request.headers.get('Content-Range', '').startswith('bytes '):
+        offset = request.headers['Content-Range'][6:].split('-', 1)[0]
+    try:
+        return int(offset)
+    except (TypeError, ValueError):
+        return None
+
+
+@api.route('/uploads')
+class UploadSessions(Resource):
+    @api.doc('create_upload_session')
+    @api.expect(upload_session_create_model)
+    @token_required
+    def post(self, current_user):
+        """Start a resumable upload for a large video/audio (or image) message"""
+        if not MEDIA_UPLOAD_ENABLED:
+            api.abort(501, 'Media upload is not configured. Please set up media_utils.py')
+        
+        data = request.get_json() or {}
+        media_type = data.get('media_type')
+        if media_type not in ['image', 'video', 'audio']:
+            api.abort(400, 'media_type must be image, video, or audio')
+        try:
+            extension = check_media_extension(data.get('filename'), media_type)
+        except ValueError as ve:
+            api.abort(400, str(ve))
+        total_size = data.get('total_size')
+        if not isinstance(total_size, int) or total_size <= 0:
+            api.abort(400, 'total_size must be a positive integer')
+        if total_size > MAX_RESUMABLE_UPLOAD_MB * 1024 * 1024:
+            api.abort(413, f'File exceeds {MAX_RESUMABLE_UPLOAD_MB} MB limit')
+        
+        try:
+            upload = UploadSession(
+                id=uuid.uuid4().hex,
+                owner_type=participant_type_of(current_user),
+                owner_id=current_user.id,
+                media_type=media_type,
+                filename=secure_filename(data.get('filename')),
+                extension=extension,
+                total_size=total_size,
+                expires_at=datetime.utcnow() + RESUMABLE_UPLOAD_TTL
+            )
+            create_partial_upload(upload.id)
+            db.session.add(upload)
+            db.session.commit()
+            
+            return {**upload.to_dict(), 'chunk_size': RESUMABLE_CHUNK_SIZE}, 201
+        
+        except Exception as e:
+            db.session.rollback()
+            api.abort(500, f'Failed to create upload session: {str(e)}')
+
+
+@api.route('/uploads/<string:upload_id>')
+class UploadSessionResource(Resource):
+    @api.doc('get_upload_session')
+    @token_required
+    def get(self, current_user, upload_id):
+        """Upload progress; resume by sending the next chunk at received_bytes"""
+        upload = _owned_upload_session(upload_id, current_user)
+        if not upload:
+            api.abort(404, 'Upload session not found')
+        return upload.to_dict(), 200, {'Upload-Offset': str(upload.received_bytes)}
+    
+    @api.doc('put_upload_chunk')
+    @token_required
+    def put(self, current_user, upload_id):
+        """Append a raw chunk (request body) at the offset given by Upload-Offset / Content-Range"""
+        upload = _owned_upload_session(upload_id, current_user)
+        if not upload:
+            api.abort(404, 'Upload session not found')
+        if upload.status != 'open':
+            api.abort(409, 'Upload is already complete')
+        
+        offset = _chunk_offset()
+        if offset is None:
+            api.abort(400, 'Upload-Offset header (or Content-Range) is required')
+        if offset != upload.received_bytes:
+            # Client and server disagree (e.g. after a dropped connection): tell it where to resume
+            return {
+                'message': 'Offset does not match received bytes',
+                'received_bytes': upload.received_bytes
+            }, 409, {'Upload-Offset': str(upload.received_bytes)}
+        
+        try:
+            written = append_upload_chunk(upload.id, offset, request.stream, upload.total_size)
+        except ValueError as ve:
+            api.abort(413, str(ve))
+        
+        try:
+            if not UploadSession.advance(upload.id, offset, written):
+                db.session.rollback()
+                db.session.refresh(upload)
+                return {
+                    'message': 'A concurrent chunk was accepted first',
+                    'received_bytes': upload.received_bytes
+                }, 409, {'Upload-Offset': str(upload.received_bytes)}
+            db.session.commit()
+            db.session.refresh(upload)
+            
+            return upload.to_dict(), 200, {'Upload-Offset': str(upload.received_bytes)}
+        
+        except Exception as e:
+            db.session.rollback()
+            api.abort(500, f'Failed to store chunk: {str(e)}')
+    
+    @api.doc('abort_upload_session')
+    @token_required
+    def delete(self, current_user, upload_id):
+        """Abandon an upload and discard what was received"""
+        upload = _owned_upload_session(upload_id, current_user)
+        if not upload:
+            api.abort(404, 'Upload session not found')
+        try:
+            if upload.status == 'open':
+                discard_partial_upload(upload.id)
+            db.session.delete(upload)
+            db.session.commit()
+            return {'message': 'Upload discarded'}
+        except Exception as e:
+            db.session.rollback()
+            api.abort(500, f'Failed to discard upload: {str(e)}')
+
+
+@api.route('/uploads/<string:upload_id>/complete')
+class UploadSessionComplete(Resource):
+    @api.doc('complete_upload_session')
+    @token_required
+    def post(self, current_user, upload_id):
+        """Finish an upload once every byte has arrived; the file moves into media storage"""
+        upload = _owned_upload_session(upload_id, current_user)
+        if not upload:
+            api.abort(404, 'Upload session not found')
+        if upload.status != 'open':
+            return upload.to_dict(), 200
+        if upload.received_bytes != upload.total_size:
+            return {
+                'message': 'Upload is incomplete',
+                'received_bytes': upload.received_bytes,
+                'total_size': upload.total_size
+            }, 409, {'Upload-Offset': str(upload.received_bytes)}
+        
+        try:
+            # Hash the assembled file into the content-addressed store (deduplicates re-sent media)
+            saved = store_file(partial_upload_path(upload.id), upload.extension)
+            upload.status = 'complete'
+            upload.media_url = saved['url']
+            upload.media_path = saved['key']
+            db.session.commit()
+            
+            return upload.to_dict(), 200
+        
+        except Exception as e:
+            db.session.rollback()
+            api.abort(500, f'Failed to complete upload: {str(e)}')
+
+
 @api.route('/<int:message_id>')
 class MessageDetail(Resource):
     @api.doc('get_message')
@@ -355,7 +664,11 @@ class MessageDetail(Resource):
             if not message:
                 api.abort(404, 'Message not found')
             
-            return _build_message_dict(message, include_sender=True)
+            return _build_message_dict(
+                message,
+                include_sender=True,
+                read_marks=read_marks_for(message.conversation_id, current_user)
+            )
             
         except Exception as e:
             api.abort(500, f'Failed to retrieve message: {str(e)}')
@@ -382,6 +695,9 @@ class MessageDetail(Resource):
                 message.is_read = data['is_read']
             
             message.updated_at = datetime.utcnow()
+            conversation = Conversation.query.get(message.conversation_id)
+            if conversation and conversation.last_message_id == message.id:
+                conversation.set_last_message(message, at=conversation.last_message_at)
             db.session.commit()
             
             # Broadcast update via WebSocket
@@ -410,7 +726,18 @@ class MessageDetail(Resource):
                 api.abort(403, 'Can only delete your own messages')
             
             conversation_id = message.conversation_id
+            message_id = message.id
+            MediaBlob.add_ref(message.media_blob_id, -1)
+            ConversationParticipant.record_message_deleted(
+                conversation_id, message_id, normalize_sender_type(message.sender_type), message.sender_id
+            )
             db.session.delete(message)
+            db.session.flush()
+            
+            # Keep the inbox preview pointing at a message that still exists
+            conversation = Conversation.query.get(conversation_id)
+            if conversation and conversation.last_message_id in (None, message_id):
+                conversation.refresh_last_message()
             db.session.commit()
             
             # Broadcast deletion via WebSocket
@@ -418,7 +745,7 @@ class MessageDetail(Resource):
                 socketio = current_app.extensions.get('socketio')
                 if socketio:
                     socketio.emit('message_deleted', {
-                        'message_id': message.id,
+                        'message_id': message_id,
                         'conversation_id': conversation_id
                     }, room=f"conv_{conversation_id}")
             except Exception as ws_error:
@@ -429,16 +756,69 @@ class MessageDetail(Resource):
         except Exception as e:
             api.abort(500, f'Failed to delete message: {str(e)}')
 
+HISTORY_ORDER_DESC = [(Message.created_at, 'desc'), (Message.id, 'desc')]
+HISTORY_ORDER_ASC = [(Message.created_at, 'asc'), (Message.id, 'asc')]
+MAX_HISTORY_WINDOW = 200
+
+
+def _history_slice(conversation_id, order, anchor=None, limit=50, include_anchor=False):
+    """
+    Up to ``limit`` messages walking away from ``anchor`` in ``order``, plus a has-more flag.
+    Served from idx_message_conversation (conversation_id, created_at[, id]).
+    """
+    query = Message.query.filter(Message.conversation_id == conversation_id)
+    if anchor is not None:
+        predicate = keyset_after(order, (anchor.created_at, anchor.id))
+        if include_anchor:
+            predicate = db.or_(predicate, Message.id == anchor.id)
+        query = query.filter(predicate)
+    rows = query.order_by(*[col.desc() if d == 'desc' else col.asc() for col, d in order]).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def _message_window(conversation_id, limit):
+    """
+    Resolve before_id / after_id / around_id (or the latest messages) into a
+    chronologically ordered window. Returns (messages, has_more_before, has_more_after).
+    """
+    def anchor_for(param):
+        message_id = request.args.get(param, type=int)
+        if not message_id:
+            return None
+        anchor = Message.query.filter_by(id=message_id, conversation_id=conversation_id).first()
+        if not anchor:
+            api.abort(404, f'Message {message_id} not found in this conversation')
+        return anchor
+
+    around = anchor_for('around_id')
+    if around is not None:
+        older, more_before = _history_slice(conversation_id, HISTORY_ORDER_DESC, around, max(1, limit // 2), include_anchor=True)
+        newer, more_after = _history_slice(conversation_id, HISTORY_ORDER_ASC, around, limit - len(older))
+        return list(reversed(older)) + newer, more_before, more_after
+
+    after = anchor_for('after_id')
+    if after is not None:
+        newer, more_after = _history_slice(conversation_id, HISTORY_ORDER_ASC, after, limit)
+        return newer, True, more_after
+
+    before = anchor_for('before_id')
+    older, more_before = _history_slice(conversation_id, HISTORY_ORDER_DESC, before, limit)
+    return list(reversed(older)), more_before, before is not None
+
+
 @api.route('/conversation/<int:conversation_id>')
 class ConversationMessages(Resource):
-    @api.doc('get_conversation_messages')
+    @api.doc('get_conversation_messages', params={
+        'before_id': 'Messages older than this message id (default: the latest messages)',
+        'after_id': 'Messages newer than this message id',
+        'around_id': 'A window centred on this message id',
+        'limit': 'Window size (default 50, max 200)',
+        'page': 'Legacy offset paging, oldest first',
+    })
     @token_required
     def get(self, current_user, conversation_id):
-        """Get all messages in a conversation with full sender info"""
+        """Get messages in a conversation with full sender info"""
         try:
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 50, type=int)
-            
             # Verify conversation exists
             conversation = Conversation.query.get(conversation_id)
             if not conversation:
@@ -457,41 +837,53 @@ class ConversationMessages(Resource):
             if not is_participant:
                 api.abort(403, 'Not a participant in this conversation')
             
-            # CRITICAL FIX: Auto-mark messages as read when fetching
-            unread_messages = Message.query.filter(
-                Message.conversation_id == conversation_id,
-                Message.is_read == False,
-                db.not_(
-                    db.and_(
-                        Message.sender_id == current_user.id,
-                        Message.sender_type == current_user_type
-                    )
-                )
-            ).all()
-            
-            for msg in unread_messages:
-                msg.is_read = True
-            
-            if unread_messages:
+            # Auto-mark as read when fetching: one row update on the participant's read mark
+            if ConversationParticipant.mark_read(conversation_id, current_user_type, current_user.id):
                 db.session.commit()
-                print(f'[MessageAPI] Marked {len(unread_messages)} messages as read in conversation {conversation_id}')
-            
-            # Get messages ordered chronologically
-            messages = Message.query.filter_by(
-                conversation_id=conversation_id
-            ).order_by(Message.created_at.asc()).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
+                print(f'[MessageAPI] Advanced read mark in conversation {conversation_id}')
+            read_marks = read_marks_for(conversation_id, current_user)
+            
+            legacy_paging = 'page' in request.args and not any(
+                key in request.args for key in ('before_id', 'after_id', 'around_id')
             )
+            if legacy_paging:
+                # Old clients: oldest-first OFFSET pages with the previous response keys
+                page = max(1, request.args.get('page', 1, type=int))
+                per_page = min(request.args.get('per_page', 50, type=int), MAX_HISTORY_WINDOW)
+                messages = Message.query.filter_by(
+                    conversation_id=conversation_id
+                ).order_by(*[col.asc() for col, _ in HISTORY_ORDER_ASC]).offset(
+                    (page - 1) * per_page
+                ).limit(per_page).all()
+                total = cached_count(Message.query.filter_by(conversation_id=conversation_id))
+                extra = {
+                    'total': total,
+                    'pages': (total + per_page - 1) // per_page if total else 0,
+                    'current_page': page,
+                }
+            else:
+                limit = request.args.get('limit', None, type=int) or request.args.get('per_page', 50, type=int)
+                limit = max(1, min(limit, MAX_HISTORY_WINDOW))
+                messages, has_more_before, has_more_after = _message_window(conversation_id, limit)
+                extra = {
+                    'has_more_before': has_more_before,
+                    'has_more_after': has_more_after,
+                    'oldest_id': messages[0].id if messages else None,
+                    'newest_id': messages[-1].id if messages else None,
+                }
             
-            result = [_build_message_dict(msg, include_sender=True) for msg in messages.items]
+            # Senders for the whole window in at most two IN queries
+            get_identity_loader().want((m.sender_type, m.sender_id) for m in messages)
+            result = [
+                _build_message_dict(msg, include_sender=True, read_marks=read_marks)
+                for msg in messages
+            ]
             
             return {
                 'messages': result,
-                'total': messages.total,
-                'pages': messages.pages,
-                'current_page': messages.page,
+                # The other side's read mark, for rendering "seen" receipts
+                'read_receipt': {'last_read_message_id': read_marks[2]},
+                **extra,
             }
             
         except Exception as e:
@@ -506,105 +898,41 @@ class RecentConversations(Resource):
     def get(self, current_user):
         """Get recent conversations for the current user with last message and sender info"""
         try:
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 20, type=int)
-
-            # Determine participant type and ID
-            if isinstance(current_user, User):
-                participant_type = 'user'
-                participant_id = current_user.id
-            elif isinstance(current_user, Advertiser):
-                participant_type = 'advertiser'
-                participant_id = current_user.id
-            else:
+            if not isinstance(current_user, (User, Advertiser)):
                 return {'conversations': [], 'total': 0}, 200
 
-            # MySQL-compatible NULL handling
-            query = db.session.query(Conversation).join(
-                ConversationParticipant,
-                ConversationParticipant.conversation_id == Conversation.id
-            ).filter(
-                ConversationParticipant.participant_type == participant_type,
-                ConversationParticipant.participant_id == participant_id
-            ).order_by(
-                case(
-                    (Conversation.last_message_at.is_(None), datetime(9999, 12, 31)),
-                    else_=Conversation.last_message_at
-                ).desc()
-            )
-            
-            pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+            # Whole page in a fixed number of queries (see services/inbox_service.py)
+            entries, meta = load_inbox(current_user)
 
             items = []
-            for conv in pagination.items:
-                # Get last message with sender info
-                last_msg = Message.query.filter_by(
-                    conversation_id=conv.id
-                ).order_by(Message.created_at.desc()).first()
-                last_msg_dict = _build_message_dict(last_msg, include_sender=True) if last_msg else None
-                
-                # Calculate unread count
-                unread_count = Message.query.filter(
-                    Message.conversation_id == conv.id,
-                    Message.is_read == False,
-                    db.not_(
-                        db.and_(
-                            Message.sender_id == participant_id,
-                            Message.sender_type == participant_type
-                        )
-                    )
-                ).count()
-                
-                # Get all participants
-                all_participants = ConversationParticipant.query.filter_by(
-                    conversation_id=conv.id
-                ).all()
-                
-                # Find the OTHER participant (not current user)
-                participant_info = None
-                for p in all_participants:
-                    if p.participant_type == participant_type and p.participant_id == participant_id:
-                        continue
-                        
-                    if p.participant_type == 'user':
-                        u = User.find_by_id(p.participant_id)
-                        if u:
-                            participant_info = {
-                                'type': 'user',
-                                'id': u.id,
-                                'name': u.name,
-                                'username': u.username,
-                                'profile_image_url': getattr(u, 'profile_image_url', None),
-                            }
-                            break
-                    elif p.participant_type == 'advertiser':
-                        a = Advertiser.find_by_id(p.participant_id)
-                        if a:
-                            participant_info = {
-                                'type': 'advertiser',
-                                'id': a.id,
-                                'name': a.name,
-                                'username': a.username,
-                                'profile_image_url': getattr(a, 'profile_image_url', None),
-                            }
-                            break
+            for entry in entries:
+                conv = entry['conversation']
+                last_msg = entry['last_message']
+                participant = entry['participant']
+                participant_info = {
+                    'type': entry['participant_type'],
+                    'id': participant.id,
+                    'name': participant.name,
+                    'username': participant.username,
+                    'profile_image_url': getattr(participant, 'profile_image_url', None),
+                } if participant else None
 
                 items.append({
                     'conversation_id': conv.id,
                     'participant': participant_info,
-                    'last_message': last_msg_dict,
+                    'last_message': _build_message_dict(
+                        last_msg, include_sender=True, read_marks=entry['read_marks']
+                    ) if last_msg else None,
+                    'last_message_preview': conv.preview_dict(),
                     'last_message_at': conv.last_message_at.isoformat() if conv.last_message_at else None,
-                    'unread_count': unread_count,
+                    'unread_count': entry['unread_count'],
                 })
 
             print(f'[MessageAPI] Returning {len(items)} conversations, sorted by last_message_at')
             
-            return {
-                'conversations': items,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'current_page': pagination.page,
-            }
+            return {'conversations': items, **meta}
+        except InvalidCursor as e:
+            api.abort(400, str(e))
         except Exception as e:
             print(f'[MessageAPI] Error in /recent: {str(e)}')
             import traceback
@@ -629,35 +957,32 @@ class MarkConversationRead(Resource):
             if not is_participant:
                 api.abort(403, 'Not a participant in this conversation')
             
-            updated_count = Message.query.filter(
-                Message.conversation_id == conversation_id,
-                Message.is_read == False,
-                db.not_(
-                    db.and_(
-                        Message.sender_id == current_user.id,
-                        Message.sender_type == current_user_type
-                    )
-                )
-            ).update({'is_read': True}, synchronize_session=False)
-            
+            data = request.get_json(silent=True) or {}
+            up_to = data.get('up_to_message_id')
+            last_read_id = ConversationParticipant.mark_read(
+                conversation_id, current_user_type, current_user.id,
+                up_to_message_id=int(up_to) if up_to else None
+            )
             db.session.commit()
             
-            print(f'[MessageAPI] Marked {updated_count} messages as read in conversation {conversation_id}')
+            print(f'[MessageAPI] Read mark for conversation {conversation_id} now {last_read_id}')
             
-            try:
-                socketio = current_app.extensions.get('socketio')
-                if socketio:
-                    socketio.emit('conversation_marked_read', {
-                        'conversation_id': conversation_id,
-                        'user_id': current_user.id,
-                        'marked_count': updated_count
-                    }, room=f"conv_{conversation_id}")
-            except Exception as ws_error:
-                print(f'WebSocket emit error: {ws_error}')
+            if last_read_id:
+                try:
+                    socketio = current_app.extensions.get('socketio')
+                    if socketio:
+                        socketio.emit('conversation_marked_read', {
+                            'conversation_id': conversation_id,
+                            'user_id': current_user.id,
+                            'user_type': current_user_type,
+                            'last_read_message_id': last_read_id
+                        }, room=f"conv_{conversation_id}")
+                except Exception as ws_error:
+                    print(f'WebSocket emit error: {ws_error}')
             
             return {
                 'message': 'Messages marked as read successfully',
-                'count': updated_count
+                'last_read_message_id': last_read_id
             }
             
         except Exception as e:
@@ -665,28 +990,82 @@ class MarkConversationRead(Resource):
             print(f'[MessageAPI] Error marking as read: {str(e)}')
             api.abort(500, f'Failed to mark messages as read: {str(e)}')
 
+@api.route('/conversation/<int:conversation_id>/delivered')
+class MarkConversationDelivered(Resource):
+    @api.doc('mark_conversation_delivered')
+    @token_required
+    def post(self, current_user, conversation_id):
+        """Record that messages up to message_id reached the current user's device"""
+        try:
+            current_user_type = 'advertiser' if isinstance(current_user, Advertiser) else 'user'
+            data = request.get_json(silent=True) or {}
+            message_id = data.get('message_id')
+            if not message_id:
+                api.abort(400, 'message_id is required')
+            
+            updated = ConversationParticipant.mark_delivered(
+                conversation_id, current_user_type, current_user.id, int(message_id)
+            )
+            db.session.commit()
+            
+            if updated:
+                try:
+                    socketio = current_app.extensions.get('socketio')
+                    if socketio:
+                        socketio.emit('conversation_marked_delivered', {
+                            'conversation_id': conversation_id,
+                            'user_id': current_user.id,
+                            'user_type': current_user_type,
+                            'last_delivered_message_id': int(message_id)
+                        }, room=f"conv_{conversation_id}")
+                except Exception as ws_error:
+                    print(f'WebSocket emit error: {ws_error}')
+            
+            return {'last_delivered_message_id': int(message_id), 'updated': bool(updated)}
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f'[MessageAPI] Error marking as delivered: {str(e)}')
+            api.abort(500, f'Failed to mark messages as delivered: {str(e)}')
+
+@api.route('/mark-all-read')
+class MarkAllConversationsRead(Resource):
+    @api.doc('mark_all_conversations_read')
+    @token_required
+    def post(self, current_user):
+        """Mark every conversation of the current user as read"""
+        try:
+            current_user_type = 'advertiser' if isinstance(current_user, Advertiser) else 'user'
+            updated_count = ConversationParticipant.mark_all_read(current_user_type, current_user.id)
+            db.session.commit()
+            
+            print(f'[MessageAPI] Marked {updated_count} conversations as read for {current_user_type}:{current_user.id}')
+            
+            return {
+                'message': 'All conversations marked as read',
+                'count': updated_count
+            }
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f'[MessageAPI] Error marking all as read: {str(e)}')
+            api.abort(500, f'Failed to mark conversations as read: {str(e)}')
+
 @api.route('/unread/<int:user_id>')
 class UnreadMessages(Resource):
     @api.doc('get_unread_messages')
     def get(self, user_id):
         """Get count of unread messages for a user across all conversations"""
         try:
-            user_conversations = db.session.query(Conversation.id).join(
-                ConversationParticipant,
-                ConversationParticipant.conversation_id == Conversation.id
-            ).filter(
+            # Sum of the maintained per-conversation badges; ?type=user|advertiser narrows it down
+            query = db.session.query(db.func.coalesce(db.func.sum(ConversationParticipant.unread_count), 0)).filter(
                 ConversationParticipant.participant_id == user_id
-            ).all()
-            
-            conversation_ids = [c[0] for c in user_conversations]
-            
-            unread_count = Message.query.filter(
-                Message.conversation_id.in_(conversation_ids),
-                Message.sender_id != user_id,
-                Message.is_read == False
-            ).count()
+            )
+            participant_type = request.args.get('type')
+            if participant_type:
+                query = query.filter(ConversationParticipant.participant_type == participant_type)
             
-            return {'unread_count': unread_count}
+            return {'unread_count': int(query.scalar() or 0)}
             
         except Exception as e:
-            api.abort(500, f'Failed to get unread count: {str(e)}')
\ No newline at end of file
+            api.abort(500, f'Failed to get unread count: {str(e)}')
@@ -7,6 +7,9 @@ from firebase_admin import credentials, messaging
 from typing import Optional, List
 import os
 
+# FCM accepts at most this many tokens in one multicast request
+MULTICAST_MAX_TOKENS = 500
+
 # Initialize Firebase Admin SDK (do this once in your app initialization)
 def initialize_firebase():
     """
@@ -143,16 +146,25 @@ def send_notification_to_multiple(
     message_content: str,
     conversation_id: int,
     sender_id: int,
-    sender_type: str = 'user'
+    sender_type: str = 'user',
+    sender_avatar: Optional[str] = None,
+    message_count: int = 1
 ) -> dict:
     """
-    Send notification to multiple devices (for multi-device users)
+    Send one notification to many devices in a single multicast call
+    (at most MULTICAST_MAX_TOKENS tokens per call).
+    
+    Notifications are tagged per conversation, so a newer one replaces the
+    previous one on the device instead of stacking.
     
     Returns:
-        Dictionary with success_count and failure_count
+        Dictionary with success_count, failure_count and invalid_tokens
+        (tokens FCM reports as unregistered, which should be deleted)
     """
     if not fcm_tokens:
-        return {'success_count': 0, 'failure_count': 0}
+        return {'success_count': 0, 'failure_count': 0, 'invalid_tokens': []}
+    if len(fcm_tokens) > MULTICAST_MAX_TOKENS:
+        raise ValueError(f'At most {MULTICAST_MAX_TOKENS} tokens per multicast')
     
     try:
         preview = message_content[:100] + '...' if len(message_content) > 100 else message_content
@@ -169,39 +181,56 @@ def send_notification_to_multiple(
             'sender_id': str(sender_id),
             'sender_type': sender_type,
             'sender_name': sender_name,
+            'message_content': message_content,
+            'message_count': str(message_count),
         }
         
+        if sender_avatar:
+            data['sender_avatar'] = sender_avatar
+        
         multicast_message = messaging.MulticastMessage(
             notification=notification,
             data=data,
             tokens=fcm_tokens,
             android=messaging.AndroidConfig(
                 priority='high',
+                collapse_key=f'conv_{conversation_id}',
                 notification=messaging.AndroidNotification(
                     sound='default',
                     channel_id='messages_channel',
+                    tag=f'conv_{conversation_id}',
+                    click_action='FLUTTER_NOTIFICATION_CLICK',
                 )
             ),
             apns=messaging.APNSConfig(
+                headers={'apns-collapse-id': f'conv_{conversation_id}'},
                 payload=messaging.APNSPayload(
-                    aps=messaging.Aps(sound='default', badge=1)
+                    aps=messaging.Aps(sound='default', badge=1, thread_id=f'conv_{conversation_id}')
                 )
             )
         )
         
-        # Send to multiple devices
-        response = messaging.send_multicast(multicast_message)
+        # Send to multiple devices (send_multicast's batch endpoint is retired in newer SDKs)
+        send = getattr(messaging, 'send_each_for_multicast', None) or messaging.send_multicast
+        response = send(multicast_message)
         print(f'[FCM] Successfully sent {response.success_count} messages')
         print(f'[FCM] Failed to send {response.failure_count} messages')
         
+        # Responses are in token order; uninstalled apps / rotated tokens will never succeed again
+        invalid_tokens = [
+            token for token, result in zip(fcm_tokens, response.responses)
+            if not result.success and isinstance(result.exception, (messaging.UnregisteredError, messaging.SenderIdMismatchError))
+        ]
+        
         return {
             'success_count': response.success_count,
-            'failure_count': response.failure_count
+            'failure_count': response.failure_count,
+            'invalid_tokens': invalid_tokens
         }
         
     except Exception as e:
         print(f'[FCM] Error sending multicast notification: {e}')
-        return {'success_count': 0, 'failure_count': len(fcm_tokens)}
+        return {'success_count': 0, 'failure_count': len(fcm_tokens), 'invalid_tokens': []}
 
 
 def send_typing_notification(
@@ -1,11 +1,25 @@
 from flask import request, jsonify
 from flask_restx import Namespace, Resource, fields
-from models import Post, Advertiser, Comment, PostLike, db
+from models import Post, Advertiser, Comment, PostLike, MediaBlob, db
 from .decorators import token_required, advertiser_required
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from utils.pagination import paginate, created_desc, InvalidCursor
+from utils.identity_loader import get_identity_loader
+from services.image_ingest import image_ingest, IngestQueueFull
+from models.posts import STATUS_PROCESSING, STATUS_READY
+from utils.media_utils import stream_multipart_upload
 
+import logging
+import os
+import re
 import time
 import base64
-from cloudinary_service import get_service as get_cloudinary_service 
+import secrets
+from datetime import datetime
+from cloudinary_service import get_service as get_cloudinary_service, responsive_srcset
+
+logger = logging.getLogger(__name__)
 
 api = Namespace('posts', description='Post management operations')
 
@@ -13,7 +27,19 @@ api = Namespace('posts', description='Post management operations')
 image_upload_model = api.model('ImageUpload', {
     'image': fields.String(required=True, description='Base64 encoded image or image data'),
     'caption': fields.String(description='Post caption'),
-    'folder': fields.String(description='Cloudinary folder (optional)')
+    'folder': fields.String(description='Cloudinary folder (optional)'),
+    'async': fields.Boolean(description='Return 202 immediately and deliver the URL via image_upload_complete')
+})
+
+upload_signature_model = api.model('UploadSignatureRequest', {
+    'purpose': fields.String(description="What the image is for: 'post' (default) or 'avatar'")
+})
+
+finalize_upload_model = api.model('FinalizeUpload', {
+    'public_id': fields.String(required=True, description='public_id returned by Cloudinary for the direct upload'),
+    'purpose': fields.String(description="'post' (default) or 'avatar'"),
+    'caption': fields.String(description='Caption for a new post'),
+    'post_id': fields.Integer(description='Existing post whose image should be replaced')
 })
 
 post_model = api.model('Post', {
@@ -21,6 +47,8 @@ post_model = api.model('Post', {
     'advertiser_id': fields.Integer(description='Advertiser ID who created the post'),
     'image_url': fields.String(description='Image URL from Cloudinary'),
     'caption': fields.String(description='Post caption'),
+    'status': fields.String(description='Image processing status: processing, ready or failed'),
+    'processing_error': fields.String(description='Why the image upload failed, if it did'),
     'created_at': fields.String(description='Creation timestamp'),
     'updated_at': fields.String(description='Last update timestamp')
 })
@@ -49,16 +77,114 @@ post_with_advertiser_model = api.model('PostWithAdvertiser', {
     }))
 })
 
+
+def _feed_query(include_pending=False):
+    """
+    Base query for post cards: each post joined to its advertiser in one round trip.
+
+    Posts whose first image is still uploading (or failed) have no image_url
+    and are left out unless include_pending is set (the owner's own views).
+    """
+    query = db.session.query(Post, Advertiser).join(
+        Advertiser, Advertiser.id == Post.advertiser_id
+    )
+    if not include_pending:
+        query = query.filter(Post.image_url.isnot(None))
+    return query
+
+
+def _build_post_dicts(rows, current_user):
+    """
+    Serialize (Post, Advertiser) rows into feed cards.
+
+    Like and comment counts come from the denormalized counters on the post
+    row; the caller's liked_by_me flag is resolved for the whole page with a
+    single IN lookup, so the number of queries does not grow with the page size.
+    """
+    post_ids = [post.id for post, _ in rows]
+    liked_ids = set()
+
+    viewer_id = getattr(current_user, 'id', None)
+    if post_ids and viewer_id is not None:
+        liked_ids = {
+            post_id for (post_id,) in db.session.query(PostLike.post_id).filter(
+                PostLike.post_id.in_(post_ids),
+                PostLike.user_id == viewer_id
+            )
+        }
+
+    result = []
+    for post, advertiser in rows:
+        result.append({
+            'id': post.id,
+            'advertiser_id': post.advertiser_id,
+            'image_url': post.image_url,
+            'srcset': responsive_srcset(post.image_url),
+            'caption': post.caption,
+            'status': post.status,
+            'created_at': post.created_at.isoformat() if post.created_at else None,
+            'updated_at': post.updated_at.isoformat() if post.updated_at else None,
+            'likes_count': post.likes_count or 0,
+            'comments_count': post.comments_count or 0,
+            'liked_by_me': post.id in liked_ids,
+            'advertiser': {
+                'id': advertiser.id if advertiser else None,
+                'name': advertiser.name if advertiser else 'Unknown Advertiser',
+                'username': advertiser.username if advertiser else 'unknown'
+            }
+        })
+    return result
+
+
+def _read_json_body():
+    """Be lenient with JSON parsing to avoid BadRequest from Werkzeug on large payloads"""
+    data = request.get_json(silent=True)
+    if not data:
+        try:
+            import json as _json
+            raw = request.get_data(cache=False, as_text=True)
+            data = _json.loads(raw) if raw else {}
+        except Exception as _e:
+            logger.debug(f"Fallback JSON parse failed: {_e}")
+            data = None
+    return data
+
+
+def _feed_key(row):
+    post = row[0]
+    return post.created_at, post.id
+
+
+def _current_likes_count(post_id):
+    return db.session.query(Post.likes_count).filter(Post.id == post_id).scalar() or 0
+
+
 @api.route('/upload-image')
 class ImageUpload(Resource):
     @api.doc('upload_image')
     @api.expect(image_upload_model)
     @token_required
     def post(self, current_advertiser):
-        """Upload image to Cloudinary and return URL"""
-        try:
+        """Upload image to Cloudinary and return URL (or 202 and an upload_id when async is set)"""
+        upload = None
+        if request.mimetype == 'multipart/form-data':
+            try:
+                form, upload, _ = stream_multipart_upload(request.environ, field='image')
+            except ValueError as e:
+                api.abort(400, str(e))
+            data = {
+                'image': upload,
+                'folder': form.get('folder', 'vpg/posts'),
+                'async': form.get('async', '').lower() in ('1', 'true', 'yes')
+            }
+        else:
             data = request.get_json()
-            
+        if data and data.get('async') and not image_ingest.has_capacity():
+            if upload is not None:
+                upload.close()
+            api.abort(503, 'Image processing is busy, please retry shortly')
+
+        try:
             if not data or not data.get('image'):
                 api.abort(400, 'Image data is required')
             
@@ -66,13 +192,14 @@ class ImageUpload(Resource):
             public_id = f"post_{current_advertiser.id}_{int(time.time())}"
             folder = data.get('folder', 'vpg/posts')
             
-            # Upload to Cloudinary
-            cloudinary_service = get_cloudinary_service()
-            result = cloudinary_service.upload_base64_image(
-                data['image'],
-                folder=folder,
-                public_id=public_id
-            )
+            if data.get('async'):
+                # Hand off to the ingest worker; the URL arrives as image_upload_complete
+                upload_id = image_ingest.ingest_image(current_advertiser.id, data['image'], folder, public_id)
+                upload = None  # the worker owns (and closes) the spooled file now
+                return {'success': True, 'status': STATUS_PROCESSING, 'upload_id': upload_id}, 202
+            
+            # Synchronous path (kept for callers that need the URL in the response), with retries
+            result = image_ingest.upload(data['image'], folder, public_id)
             
             if not result['success']:
                 api.abort(400, f'Image upload failed: {result["error"]}')
@@ -88,6 +215,134 @@ class ImageUpload(Resource):
             
         except Exception as e:
             api.abort(500, f'Failed to upload image: {str(e)}')
+        
+        finally:
+            if upload is not None:
+                upload.close()
+
+# Direct uploads: public_ids are issued as <purpose>_<a|u><principal id>_<issued at>_<nonce>
+DIRECT_UPLOAD_FOLDERS = {
+    'post': 'vpg/posts',
+    'avatar': 'vpg/avatars',
+}
+DIRECT_UPLOAD_ID = re.compile(r'^(post|avatar)_([au])(\d+)_(\d+)_[0-9a-f]+$')
+
+
+def _direct_upload_ttl():
+    return int(os.environ.get('DIRECT_UPLOAD_TTL', 600))
+
+
+def _principal_tag(principal):
+    return f"{'a' if isinstance(principal, Advertiser) else 'u'}{principal.id}"
+
+
+def _verify_direct_upload(principal, public_id, purpose):
+    """
+    Check that a client-reported public_id is one we issued to this principal,
+    for this purpose, uploaded within the signature's lifetime. Returns the
+    Cloudinary image details; aborts otherwise.
+    """
+    match = DIRECT_UPLOAD_ID.match((public_id or '').rsplit('/', 1)[-1])
+    if not match or match.group(1) != purpose or f"{match.group(2)}{match.group(3)}" != _principal_tag(principal):
+        api.abort(403, 'public_id was not issued to you for this upload')
+
+    image = get_cloudinary_service().get_image(public_id)
+    if not image['success']:
+        api.abort(404, 'Uploaded image not found on Cloudinary')
+
+    issued_at = int(match.group(4))
+    if image.get('created_at'):
+        uploaded_at = datetime.fromisoformat(image['created_at'].replace('Z', '+00:00'))
+        if uploaded_at.timestamp() > issued_at + _direct_upload_ttl():
+            api.abort(410, 'Upload signature expired before the image was uploaded')
+    return image
+
+
+@api.route('/upload-signature')
+class UploadSignature(Resource):
+    @api.doc('upload_signature')
+    @api.expect(upload_signature_model)
+    @token_required
+    def post(self, current_user):
+        """Short-lived signed parameters for uploading an image straight to Cloudinary"""
+        data = request.get_json(silent=True) or {}
+        purpose = data.get('purpose', 'post')
+        if purpose not in DIRECT_UPLOAD_FOLDERS:
+            api.abort(400, f"purpose must be one of: {', '.join(DIRECT_UPLOAD_FOLDERS)}")
+        if purpose == 'post' and not isinstance(current_user, Advertiser):
+            api.abort(403, 'Only advertisers can create posts')
+
+        try:
+            public_id = f"{purpose}_{_principal_tag(current_user)}_{int(time.time())}_{secrets.token_hex(6)}"
+            result = get_cloudinary_service().signed_upload_params(
+                DIRECT_UPLOAD_FOLDERS[purpose],
+                public_id,
+                ttl=_direct_upload_ttl()
+            )
+        except Exception as e:
+            api.abort(500, f'Failed to sign upload: {str(e)}')
+
+        if not result['success']:
+            api.abort(502, f'Could not sign upload: {result["error"]}')
+        return result, 201
+
+
+@api.route('/finalize-upload')
+class FinalizeUpload(Resource):
+    @api.doc('finalize_upload')
+    @api.expect(finalize_upload_model)
+    @token_required
+    def post(self, current_user):
+        """Attach a directly uploaded image to a new post, an existing post or the caller's avatar"""
+        data = request.get_json(silent=True) or {}
+        purpose = data.get('purpose', 'post')
+        if purpose not in DIRECT_UPLOAD_FOLDERS:
+            api.abort(400, f"purpose must be one of: {', '.join(DIRECT_UPLOAD_FOLDERS)}")
+        if not data.get('public_id'):
+            api.abort(400, 'public_id is required')
+
+        post_id = data.get('post_id') if purpose == 'post' else None
+        if post_id:
+            post = Post.query.get(post_id)
+            if not post:
+                api.abort(404, 'Post not found')
+            if post.advertiser_id != current_user.id:
+                api.abort(403, 'Can only update your own posts')
+
+        image = _verify_direct_upload(current_user, data['public_id'], purpose)
+
+        try:
+            if purpose == 'avatar':
+                current_user.profile_image_url = image['secure_url']
+                db.session.commit()
+                return {
+                    'success': True,
+                    'image_url': image['secure_url'],
+                    'public_id': image['public_id']
+                }
+
+            if post_id:
+                if 'caption' in data:
+                    post.caption = data['caption']
+            else:
+                post = Post(advertiser_id=current_user.id, caption=data.get('caption', ''))
+                db.session.add(post)
+
+            post.image_url = image['secure_url']
+            post.status = STATUS_READY
+            post.processing_error = None
+            # Direct uploads never pass through the API, so they are not content-addressed
+            MediaBlob.add_ref(post.media_blob_id, -1)
+            post.media_blob_id = None
+            db.session.commit()
+            db.session.refresh(post)
+
+            return post.to_dict(), 200 if post_id else 201
+
+        except Exception as e:
+            db.session.rollback()
+            api.abort(500, f'Failed to finalize upload: {str(e)}')
+
 
 @api.route('/')
 class PostList(Resource):
@@ -97,51 +352,13 @@ class PostList(Resource):
         """Get all posts (feed)"""
         print(f"DEBUG: GET posts - current_user: {current_user}")
         try:
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
-            posts = db.session.query(Post).join(Advertiser).order_by(
-                Post.created_at.desc()
-            ).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
-            
-            result = []
-            for post in posts.items:
-                advertiser = Advertiser.find_by_id(post.advertiser_id)
-                # Likes info
-                likes_count = PostLike.query.filter_by(post_id=post.id).count()
-                liked_by_me = False
-                try:
-                    liked_by_me = PostLike.query.filter_by(post_id=post.id, user_id=getattr(current_user, 'id', None)).first() is not None
-                except Exception:
-                    liked_by_me = False
-                post_dict = {
-                    'id': post.id,
-                    'advertiser_id': post.advertiser_id,
-                    'image_url': post.image_url,
-                    'caption': post.caption,
-                    'created_at': post.created_at.isoformat() if post.created_at else None,
-                    'updated_at': post.updated_at.isoformat() if post.updated_at else None,
-                    'likes_count': likes_count,
-                    'liked_by_me': liked_by_me,
-                    'advertiser': {
-                        'id': advertiser.id if advertiser else None,
-                        'name': advertiser.name if advertiser else 'Unknown Advertiser',
-                        'username': advertiser.username if advertiser else 'unknown'
-                    }
-                }
-                result.append(post_dict)
-            return {
-                'items': result,
-                'total': posts.total,
-                'pages': posts.pages,
-                'current_page': posts.page,
-                'per_page': posts.per_page,
-            }
+            rows, meta = paginate(_feed_query(), created_desc(Post), key=_feed_key)
+
+            result = _build_post_dicts(rows, current_user)
+            return {'items': result, **meta}
             
+        except InvalidCursor as e:
+            api.abort(400, str(e))
         except Exception as e:
             api.abort(500, f'Failed to retrieve posts: {str(e)}')
     
@@ -150,7 +367,10 @@ class PostList(Resource):
     @api.marshal_with(post_model)
     @advertiser_required
     def post(self, current_advertiser):
-        """Create a new post with image upload to Cloudinary"""
+        """Create a new post; the image is uploaded to Cloudinary in the background"""
+        if not image_ingest.has_capacity():
+            api.abort(503, 'Image processing is busy, please retry shortly')
+
         print("=== POST CREATION DEBUG START ===")
         print(f"DEBUG: current_advertiser parameter: {current_advertiser}")
         print(f"DEBUG: current_advertiser type: {type(current_advertiser)}")
@@ -160,18 +380,15 @@ class PostList(Resource):
             print("ERROR: current_advertiser is actually the PostList object! Decorator parameter order issue.")
             api.abort(500, 'Internal authentication error - decorator parameter mismatch')
         
+        upload = None
         try:
-            # Be lenient with JSON parsing to avoid BadRequest from Werkzeug on large payloads
-            data = request.get_json(silent=True)
-            if not data:
-                try:
-                    import json as _json
-                    raw = request.get_data(cache=False, as_text=True)
-                    data = _json.loads(raw) if raw else {}
-                except Exception as _e:
-                    print(f"DEBUG: Fallback JSON parse failed: {_e}")
-                    data = None
-            print(f"DEBUG: Received JSON data: {data}")
+            if request.mimetype == 'multipart/form-data':
+                # Stream the file part to a validated spooled temp file instead of base64-in-JSON
+                form, upload, meta = stream_multipart_upload(request.environ, field='image')
+                data = {'caption': form.get('caption', ''), 'image': upload}
+                logger.debug(f"Received multipart image: {meta['extension']}, {meta['size_bytes']} bytes")
+            else:
+                data = _read_json_body()
             
             if not data:
                 print("DEBUG: No JSON data received")
@@ -189,50 +406,40 @@ class PostList(Resource):
             advertiser_id = current_advertiser.id
             print(f"DEBUG: Using advertiser_id: {advertiser_id}")
             
-            # Upload image to Cloudinary first
-            public_id = f"post_{advertiser_id}_{int(time.time())}"
-            cloudinary_service = get_cloudinary_service()
-            upload_result = cloudinary_service.upload_base64_image(
-                data['image'],
-                folder='vpg/posts',
-                public_id=public_id
-            )
-            
-            if not upload_result['success']:
-                print(f"DEBUG: Image upload failed: {upload_result['error']}")
-                api.abort(400, f'Image upload failed: {upload_result["error"]}')
-            
-            image_url = upload_result['secure_url']
-            print(f"DEBUG: Image uploaded successfully: {image_url}")
-            
-            # Create post with the Cloudinary URL
+            # Persist the post first; image_url is filled in by the ingest worker
             post = Post(
                 advertiser_id=advertiser_id,
-                image_url=image_url,
-                caption=data.get('caption', '')
+                caption=data.get('caption', ''),
+                status=STATUS_PROCESSING
             )
             
-            print(f"DEBUG: Created post object: advertiser_id={post.advertiser_id}, image_url={post.image_url}")
-            
             db.session.add(post)
             db.session.commit()
             
             # Refresh to get the generated ID and timestamps
             db.session.refresh(post)
             
-            result = {
-                'id': post.id,
-                'advertiser_id': post.advertiser_id,
-                'image_url': post.image_url,
-                'caption': post.caption,
-                'created_at': post.created_at.isoformat() if post.created_at else None,
-                'updated_at': post.updated_at.isoformat() if post.updated_at else None
-            }
+            public_id = f"post_{advertiser_id}_{post.id}_{int(time.time())}"
+            try:
+                image_ingest.ingest_post_image(post.id, data['image'], public_id)
+                upload = None  # the worker owns (and closes) the spooled file now
+            except IngestQueueFull:
+                db.session.delete(post)
+                db.session.commit()
+                raise
             
-            print(f"DEBUG: Post created successfully: {result}")
+            result = post.to_dict()
+            
+            logger.debug(f"Post {post.id} created, image queued for upload")
             print("=== POST CREATION DEBUG END ===")
             
-            return result, 201
+            return result, 202
+            
+        except IngestQueueFull:
+            api.abort(503, 'Image processing is busy, please retry shortly')
+            
+        except ValueError as e:
+            api.abort(400, str(e))
             
         except Exception as e:
             print(f"DEBUG: Exception in post creation: {type(e).__name__}: {str(e)}")
@@ -240,6 +447,10 @@ class PostList(Resource):
             traceback.print_exc()
             db.session.rollback()
             api.abort(500, f'Failed to create post: {str(e)}')
+        
+        finally:
+            if upload is not None:
+                upload.close()
 
 
 # Updated AdvertiserPosts endpoint with correct table references
@@ -258,8 +469,8 @@ class AdvertiserPosts(Resource):
             page = request.args.get('page', 1, type=int)
             per_page = request.args.get('per_page', 20, type=int)
             
-            posts = Post.query.filter_by(
-                advertiser_id=advertiser_id
+            posts = _feed_query().filter(
+                Post.advertiser_id == advertiser_id
             ).order_by(
                 Post.created_at.desc()
             ).paginate(
@@ -267,221 +478,8 @@ class AdvertiserPosts(Resource):
                 per_page=per_page,
                 error_out=False
             )
-            
-            result = []
-            for post in posts.items:
-                # Fix: Use correct table name 'post_like' instead of 'post_likes'
-                likes_count = PostLike.query.filter_by(post_id=post.id).count()
-                
-                # Check if current user liked this post
-                liked_by_me = False
-                try:
-                    if hasattr(current_advertiser, 'id') and current_advertiser.id:
-                        liked_by_me = PostLike.query.filter_by(
-                            post_id=post.id, 
-                            user_id=current_advertiser.id
-                        ).first() is not None
-                except Exception as e:
-                    print(f"Error checking if post {post.id} is liked: {e}")
-                    liked_by_me = False
-                
-                post_dict = {
-                    'id': post.id,
-                    'advertiser_id': post.advertiser_id,
-                    'image_url': post.image_url,
-                    'caption': post.caption,
-                    'created_at': post.created_at.isoformat() if post.created_at else None,
-                    'updated_at': post.updated_at.isoformat() if post.updated_at else None,
-                    'likes_count': likes_count,
-                    'liked_by_me': liked_by_me,
-                    'advertiser': {
-                        'id': advertiser.id,
-                        'name': advertiser.name,
-                        'username': advertiser.username
-                    }
-                }
-                result.append(post_dict)
-            
-            return {
-                'posts': result,
-                'total': posts.total,
-                'pages': posts.pages,
-                'current_page': posts.page,
-                'per_page': posts.per_page,
-                'advertiser_info': {
-                    'id': advertiser.id,
-                    'name': advertiser.name,
-                    'username': advertiser.username
-                }
-            }
-            
-        except Exception as e:
-            print(f"Error fetching posts for advertiser {advertiser_id}: {str(e)}")
-            api.abort(500, f'Failed to retrieve posts for advertiser: {str(e)}')
 
-# Also update your existing PostList endpoint's GET method
-@api.route('/')
-class PostList(Resource):
-    @api.doc('list_posts')
-    @token_required
-    def get(self, current_user):
-        """Get all posts (feed)"""
-        print(f"DEBUG: GET posts - current_user: {current_user}")
-        try:
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
-            posts = db.session.query(Post).join(Advertiser).order_by(
-                Post.created_at.desc()
-            ).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
-            
-            result = []
-            for post in posts.items:
-                advertiser = Advertiser.find_by_id(post.advertiser_id)
-                # Fix: Use correct table name 'post_like' instead of 'post_likes'
-                likes_count = PostLike.query.filter_by(post_id=post.id).count()
-                liked_by_me = False
-                try:
-                    liked_by_me = PostLike.query.filter_by(
-                        post_id=post.id, 
-                        user_id=getattr(current_user, 'id', None)
-                    ).first() is not None
-                except Exception as e:
-                    print(f"Error checking if post {post.id} is liked: {e}")
-                    liked_by_me = False
-                    
-                post_dict = {
-                    'id': post.id,
-                    'advertiser_id': post.advertiser_id,
-                    'image_url': post.image_url,
-                    'caption': post.caption,
-                    'created_at': post.created_at.isoformat() if post.created_at else None,
-                    'updated_at': post.updated_at.isoformat() if post.updated_at else None,
-                    'likes_count': likes_count,
-                    'liked_by_me': liked_by_me,
-                    'advertiser': {
-                        'id': advertiser.id if advertiser else None,
-                        'name': advertiser.name if advertiser else 'Unknown Advertiser',
-                        'username': advertiser.username if advertiser else 'unknown'
-                    }
-                }
-                result.append(post_dict)
-            return {
-                'items': result,
-                'total': posts.total,
-                'pages': posts.pages,
-                'current_page': posts.page,
-                'per_page': posts.per_page,
-            }
-            
-        except Exception as e:
-            print(f"Error in PostList GET: {e}")
-            api.abort(500, f'Failed to retrieve posts: {str(e)}')
-
-# Update MyPosts endpoint as well
-@api.route('/my-posts')
-class MyPosts(Resource):
-    @api.doc('get_my_posts')
-    @token_required
-    def get(self, current_advertiser):
-        """Get current advertiser's posts"""
-        try:
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
-            posts = Post.query.filter_by(
-                advertiser_id=current_advertiser.id
-            ).order_by(
-                Post.created_at.desc()
-            ).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
-            
-            result = []
-            for post in posts.items:
-                # Fix: Use correct table name 'post_like' instead of 'post_likes'
-                likes_count = PostLike.query.filter_by(post_id=post.id).count()
-                post_dict = {
-                    'id': post.id,
-                    'advertiser_id': post.advertiser_id,
-                    'image_url': post.image_url,
-                    'caption': post.caption,
-                    'created_at': post.created_at.isoformat() if post.created_at else None,
-                    'updated_at': post.updated_at.isoformat() if post.updated_at else None,
-                    'likes_count': likes_count
-                }
-                result.append(post_dict)
-            
-            return result
-            
-        except Exception as e:
-            print(f"Error in MyPosts GET: {e}")
-            api.abort(500, f'Failed to retrieve your posts: {str(e)}')
-# Updated AdvertiserPosts endpoint with correct table references
-@api.route('/advertiser/<int:advertiser_id>')
-class AdvertiserPosts(Resource):
-    @api.doc('get_advertiser_posts')
-    @token_required
-    def get(self, current_advertiser, advertiser_id):
-        """Get all posts by a specific advertiser ID"""
-        try:
-            # Verify the advertiser exists
-            advertiser = Advertiser.find_by_id(advertiser_id)
-            if not advertiser:
-                api.abort(404, f'Advertiser with ID {advertiser_id} not found')
-            
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 20, type=int)
-            
-            posts = Post.query.filter_by(
-                advertiser_id=advertiser_id
-            ).order_by(
-                Post.created_at.desc()
-            ).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
-            
-            result = []
-            for post in posts.items:
-                # Fix: Use correct table name 'post_like' instead of 'post_likes'
-                likes_count = PostLike.query.filter_by(post_id=post.id).count()
-                
-                # Check if current user liked this post
-                liked_by_me = False
-                try:
-                    if hasattr(current_advertiser, 'id') and current_advertiser.id:
-                        liked_by_me = PostLike.query.filter_by(
-                            post_id=post.id, 
-                            user_id=current_advertiser.id
-                        ).first() is not None
-                except Exception as e:
-                    print(f"Error checking if post {post.id} is liked: {e}")
-                    liked_by_me = False
-                
-                post_dict = {
-                    'id': post.id,
-                    'advertiser_id': post.advertiser_id,
-                    'image_url': post.image_url,
-                    'caption': post.caption,
-                    'created_at': post.created_at.isoformat() if post.created_at else None,
-                    'updated_at': post.updated_at.isoformat() if post.updated_at else None,
-                    'likes_count': likes_count,
-                    'liked_by_me': liked_by_me,
-                    'advertiser': {
-                        'id': advertiser.id,
-                        'name': advertiser.name,
-                        'username': advertiser.username
-                    }
-                }
-                result.append(post_dict)
+            result = _build_post_dicts(posts.items, current_advertiser)
             
             return {
                 'posts': result,
@@ -500,69 +498,6 @@ class AdvertiserPosts(Resource):
             print(f"Error fetching posts for advertiser {advertiser_id}: {str(e)}")
             api.abort(500, f'Failed to retrieve posts for advertiser: {str(e)}')
 
-# Also update your existing PostList endpoint's GET method
-@api.route('/')
-class PostList(Resource):
-    @api.doc('list_posts')
-    @token_required
-    def get(self, current_user):
-        """Get all posts (feed)"""
-        print(f"DEBUG: GET posts - current_user: {current_user}")
-        try:
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
-            posts = db.session.query(Post).join(Advertiser).order_by(
-                Post.created_at.desc()
-            ).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
-            
-            result = []
-            for post in posts.items:
-                advertiser = Advertiser.find_by_id(post.advertiser_id)
-                # Fix: Use correct table name 'post_like' instead of 'post_likes'
-                likes_count = PostLike.query.filter_by(post_id=post.id).count()
-                liked_by_me = False
-                try:
-                    liked_by_me = PostLike.query.filter_by(
-                        post_id=post.id, 
-                        user_id=getattr(current_user, 'id', None)
-                    ).first() is not None
-                except Exception as e:
-                    print(f"Error checking if post {post.id} is liked: {e}")
-                    liked_by_me = False
-                    
-                post_dict = {
-                    'id': post.id,
-                    'advertiser_id': post.advertiser_id,
-                    'image_url': post.image_url,
-                    'caption': post.caption,
-                    'created_at': post.created_at.isoformat() if post.created_at else None,
-                    'updated_at': post.updated_at.isoformat() if post.updated_at else None,
-                    'likes_count': likes_count,
-                    'liked_by_me': liked_by_me,
-                    'advertiser': {
-                        'id': advertiser.id if advertiser else None,
-                        'name': advertiser.name if advertiser else 'Unknown Advertiser',
-                        'username': advertiser.username if advertiser else 'unknown'
-                    }
-                }
-                result.append(post_dict)
-            return {
-                'items': result,
-                'total': posts.total,
-                'pages': posts.pages,
-                'current_page': posts.page,
-                'per_page': posts.per_page,
-            }
-            
-        except Exception as e:
-            print(f"Error in PostList GET: {e}")
-            api.abort(500, f'Failed to retrieve posts: {str(e)}')
-
 # Update MyPosts endpoint as well
 @api.route('/my-posts')
 class MyPosts(Resource):
@@ -574,8 +509,8 @@ class MyPosts(Resource):
             page = request.args.get('page', 1, type=int)
             per_page = request.args.get('per_page', 10, type=int)
             
-            posts = Post.query.filter_by(
-                advertiser_id=current_advertiser.id
+            posts = _feed_query(include_pending=True).filter(
+                Post.advertiser_id == current_advertiser.id
             ).order_by(
                 Post.created_at.desc()
             ).paginate(
@@ -584,22 +519,7 @@ class MyPosts(Resource):
                 error_out=False
             )
             
-            result = []
-            for post in posts.items:
-                # Fix: Use correct table name 'post_like' instead of 'post_likes'
-                likes_count = PostLike.query.filter_by(post_id=post.id).count()
-                post_dict = {
-                    'id': post.id,
-                    'advertiser_id': post.advertiser_id,
-                    'image_url': post.image_url,
-                    'caption': post.caption,
-                    'created_at': post.created_at.isoformat() if post.created_at else None,
-                    'updated_at': post.updated_at.isoformat() if post.updated_at else None,
-                    'likes_count': likes_count
-                }
-                result.append(post_dict)
-            
-            return result
+            return _build_post_dicts(posts.items, current_advertiser)
             
         except Exception as e:
             print(f"Error in MyPosts GET: {e}")
@@ -613,75 +533,21 @@ class PostDetail(Resource):
     def get(self, current_advertiser, post_id):
         """Get post by ID"""
         try:
-            post = Post.query.get(post_id)
-            if not post:
+            row = _feed_query(include_pending=True).filter(Post.id == post_id).first()
+            if not row:
                 api.abort(404, 'Post not found')
             
-            advertiser = Advertiser.find_by_id(post.advertiser_id)
-            likes_count = PostLike.query.filter_by(post_id=post.id).count()
-            return {
-                'id': post.id,
-                'advertiser_id': post.advertiser_id,
-                'image_url': post.image_url,
-                'caption': post.caption,
-                'created_at': post.created_at.isoformat() if post.created_at else None,
-                'updated_at': post.updated_at.isoformat() if post.updated_at else None,
-                'likes_count': likes_count,
-                'advertiser': {
-                    'id': advertiser.id if advertiser else None,
-                    'name': advertiser.name if advertiser else 'Unknown Advertiser',
-                    'username': advertiser.username if advertiser else 'unknown'
-                }
-            }
+            return _build_post_dicts([row], current_advertiser)[0]
             
         except Exception as e:
             api.abort(500, f'Failed to retrieve post: {str(e)}')
-
-@api.route('/<int:post_id>/like')
-class PostLikeResource(Resource):
-    @api.doc('like_post')
-    @token_required
-    def post(self, current_user, post_id):
-        """Like a post (idempotent)."""
-        try:
-            post = Post.query.get(post_id)
-            if not post:
-                api.abort(404, 'Post not found')
-            # Idempotent like
-            existing = PostLike.query.filter_by(post_id=post_id, user_id=current_user.id).first()
-            if existing:
-                return {'message': 'Already liked'}, 200
-            like = PostLike(post_id=post_id, user_id=current_user.id)
-            db.session.add(like)
-            db.session.commit()
-            count = PostLike.query.filter_by(post_id=post_id).count()
-            return {'message': 'Liked', 'likes_count': count}
-        except Exception as e:
-            db.session.rollback()
-            api.abort(500, f'Failed to like post: {str(e)}')
-
-    @api.doc('unlike_post')
-    @token_required
-    def delete(self, current_user, post_id):
-        """Unlike a post (idempotent)."""
-        try:
-            like = PostLike.query.filter_by(post_id=post_id, user_id=current_user.id).first()
-            if not like:
-                return {'message': 'Not liked'}, 200
-            db.session.delete(like)
-            db.session.commit()
-            count = PostLike.query.filter_by(post_id=post_id).count()
-            return {'message': 'Unliked', 'likes_count': count}
-        except Exception as e:
-            db.session.rollback()
-            api.abort(500, f'Failed to unlike post: {str(e)}')
     
     @api.doc('update_post')
     @api.expect(post_update_model)
     @api.marshal_with(post_model)
     @advertiser_required
     def put(self, current_advertiser, post_id):
-        """Update post (only by owner) - can update caption and/or image"""
+        """Update post (only by owner) - can update caption and/or image (image is replaced in the background)"""
         print("=== POST UPDATE DEBUG START ===")
         print(f"DEBUG: post_id: {post_id}")
         print(f"DEBUG: current_advertiser: {current_advertiser}, id: {getattr(current_advertiser, 'id', 'NO_ID')}")
@@ -708,7 +574,7 @@ class PostLikeResource(Resource):
             
             # Track if any changes were made
             changes_made = False
-            old_image_url = post.image_url
+            new_image = None
             
             # Update caption if provided
             if 'caption' in data:
@@ -723,26 +589,15 @@ class PostLikeResource(Resource):
                     print("DEBUG: Empty image data provided")
                     api.abort(400, 'image data cannot be empty')
                 
-                # Upload new image to Cloudinary
-                public_id = f"post_{current_advertiser.id}_{post_id}_{int(time.time())}"
-                cloudinary_service = get_cloudinary_service()
-                upload_result = cloudinary_service.upload_base64_image(
-                    data['image'],
-                    folder='vpg/posts',
-                    public_id=public_id
-                )
-                
-                if not upload_result['success']:
-                    print(f"DEBUG: Image upload failed: {upload_result['error']}")
-                    api.abort(400, f'Image upload failed: {upload_result["error"]}')
+                if not image_ingest.has_capacity():
+                    raise IngestQueueFull('Image processing queue is full')
                 
-                # Update with new image URL
-                post.image_url = upload_result['secure_url']
-                print(f"DEBUG: Image update - old: '{old_image_url}' -> new: '{post.image_url}'")
+                # The current image stays up until the worker swaps in the new one
+                new_image = data['image']
+                post.status = STATUS_PROCESSING
+                post.processing_error = None
+                logger.debug(f"Post {post_id} image update queued")
                 changes_made = True
-                
-                # Optionally delete old image from Cloudinary if you want to clean up
-                # You'd need to extract the public_id from the old URL to do this
             
             if not changes_made:
                 print("DEBUG: No changes made")
@@ -756,20 +611,26 @@ class PostLikeResource(Resource):
             db.session.refresh(post)
             print(f"DEBUG: Post after refresh - image_url: {post.image_url}, caption: {post.caption}")
             
-            result = {
-                'id': post.id,
-                'advertiser_id': post.advertiser_id,
-                'image_url': post.image_url,
-                'caption': post.caption,
-                'created_at': post.created_at.isoformat() if post.created_at else None,
-                'updated_at': post.updated_at.isoformat() if post.updated_at else None
-            }
+            if new_image is not None:
+                public_id = f"post_{current_advertiser.id}_{post_id}_{int(time.time())}"
+                try:
+                    image_ingest.ingest_post_image(post.id, new_image, public_id)
+                except IngestQueueFull:
+                    # Lost the race for the last slot after committing; the old image is still valid
+                    post.status = STATUS_READY
+                    db.session.commit()
+                    raise
+            
+            result = post.to_dict()
             
             print(f"DEBUG: Final result: {result}")
             print("=== POST UPDATE DEBUG END ===")
             
             return result
             
+        except IngestQueueFull:
+            db.session.rollback()
+            api.abort(503, 'Image processing is busy, please retry shortly')
         except Exception as e:
             print(f"DEBUG: Exception occurred: {type(e).__name__}: {str(e)}")
             import traceback
@@ -789,9 +650,8 @@ class PostLikeResource(Resource):
             if post.advertiser_id != current_advertiser.id:
                 api.abort(403, 'Can only delete your own posts')
             
-            # Optionally delete image from Cloudinary
-            # You'd need to extract public_id from image_url to do this
-            # Example: cloudinary_service.delete_image(public_id)
+            # The Cloudinary image is removed by the blob cleanup once nothing references it
+            MediaBlob.add_ref(post.media_blob_id, -1)
             
             db.session.delete(post)
             db.session.commit()
@@ -802,6 +662,52 @@ class PostLikeResource(Resource):
             db.session.rollback()
             api.abort(500, f'Failed to delete post: {str(e)}')
 
+@api.route('/<int:post_id>/like')
+class PostLikeResource(Resource):
+    @api.doc('like_post')
+    @token_required
+    def post(self, current_user, post_id):
+        """Like a post (idempotent)."""
+        try:
+            post = Post.query.get(post_id)
+            if not post:
+                api.abort(404, 'Post not found')
+            # Idempotent like
+            existing = PostLike.query.filter_by(post_id=post_id, user_id=current_user.id).first()
+            if existing:
+                return {'message': 'Already liked', 'likes_count': post.likes_count}, 200
+            like = PostLike(post_id=post_id, user_id=current_user.id)
+            db.session.add(like)
+            try:
+                db.session.flush()
+            except IntegrityError:
+                # A concurrent request inserted the same like first
+                db.session.rollback()
+                return {'message': 'Already liked', 'likes_count': _current_likes_count(post_id)}, 200
+            Post.increment_counter(post_id, 'likes_count', 1)
+            db.session.commit()
+            return {'message': 'Liked', 'likes_count': _current_likes_count(post_id)}
+        except Exception as e:
+            db.session.rollback()
+            api.abort(500, f'Failed to like post: {str(e)}')
+
+    @api.doc('unlike_post')
+    @token_required
+    def delete(self, current_user, post_id):
+        """Unlike a post (idempotent)."""
+        try:
+            deleted = PostLike.query.filter_by(
+                post_id=post_id, user_id=current_user.id
+            ).delete(synchronize_session=False)
+            if not deleted:
+                return {'message': 'Not liked'}, 200
+            Post.increment_counter(post_id, 'likes_count', -1)
+            db.session.commit()
+            return {'message': 'Unliked', 'likes_count': _current_likes_count(post_id)}
+        except Exception as e:
+            db.session.rollback()
+            api.abort(500, f'Failed to unlike post: {str(e)}')
+
 
 @api.route('/<int:post_id>/comments')
 class PostComments(Resource):
@@ -827,9 +733,12 @@ class PostComments(Resource):
                 error_out=False
             )
             
+            loader = get_identity_loader()
+            loader.want(('advertiser', c.user_id) for c in comments.items)
+            
             result = []
             for comment in comments.items:
-                advertiser = Advertiser.find_by_id(comment.user_id)
+                advertiser = loader.get('advertiser', comment.user_id)
                 comment_dict = {
                     'id': comment.id,
                     'advertiser_id': comment.user_id,
@@ -854,44 +763,6 @@ class PostComments(Resource):
         except Exception as e:
             api.abort(500, f'Failed to retrieve comments: {str(e)}')
 
-@api.route('/my-posts')
-class MyPosts(Resource):
-    @api.doc('get_my_posts')
-    @api.marshal_list_with(post_model)
-    @token_required
-    def get(self, current_advertiser):
-        """Get current advertiser's posts"""
-        try:
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
-            posts = Post.query.filter_by(
-                advertiser_id=current_advertiser.id
-            ).order_by(
-                Post.created_at.desc()
-            ).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
-            
-            result = []
-            for post in posts.items:
-                post_dict = {
-                    'id': post.id,
-                    'advertiser_id': post.advertiser_id,
-                    'image_url': post.image_url,
-                    'caption': post.caption,
-                    'created_at': post.created_at.isoformat() if post.created_at else None,
-                    'updated_at': post.updated_at.isoformat() if post.updated_at else None,
-                    'likes_count': PostLike.query.filter_by(post_id=post.id).count()
-                }
-                result.append(post_dict)
-            
-            return result
-            
-        except Exception as e:
-            api.abort(500, f'Failed to retrieve your posts: {str(e)}')
 # Add this new endpoint to your posts.py file
 
 @api.route('/<int:post_id>/likes')
@@ -905,25 +776,23 @@ class PostLikesResource(Resource):
             if not post:
                 api.abort(404, 'Post not found')
             
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 20, type=int)
-            
             # Get likes with advertiser information
-            likes = db.session.query(PostLike).join(
-                Advertiser, PostLike.user_id == Advertiser.id
-            ).filter(
-                PostLike.post_id == post_id
-            ).order_by(
-                PostLike.created_at.desc()
-            ).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
+            likes, meta = paginate(
+                db.session.query(PostLike).join(
+                    Advertiser, PostLike.user_id == Advertiser.id
+                ).filter(
+                    PostLike.post_id == post_id
+                ),
+                created_desc(PostLike),
+                default_per_page=20
             )
             
+            loader = get_identity_loader()
+            loader.want(('advertiser', like.user_id) for like in likes)
+            
             result = []
-            for like in likes.items:
-                advertiser = Advertiser.find_by_id(like.user_id)
+            for like in likes:
+                advertiser = loader.get('advertiser', like.user_id)
                 if advertiser:
                     like_dict = {
                         'id': like.id,
@@ -938,18 +807,10 @@ class PostLikesResource(Resource):
                     }
                     result.append(like_dict)
             
-            return {
-                'likes': result,
-                'total': likes.total,
-                'pages': likes.pages,
-                'current_page': likes.page,
-                'per_page': likes.per_page,
-            }
-            
-        except Exception as e:
-            print(f"Error fetching likes for post {post_id}: {str(e)}")
-            
+            return {'likes': result, **meta}
             
+        except InvalidCursor as e:
+            api.abort(400, str(e))
         except Exception as e:
             print(f"Error fetching likes for post {post_id}: {str(e)}")
             api.abort(500, f'Failed to retrieve post likes: {str(e)}')
@@ -991,13 +852,14 @@ class PostComments(Resource):
             )
             
             db.session.add(comment)
+            Post.increment_counter(post_id, 'comments_count', 1)
             db.session.commit()
             
             # Refresh to get timestamps
             db.session.refresh(comment)
             
             # Get advertiser info for response
-            advertiser = Advertiser.find_by_id(current_advertiser.id)
+            advertiser = get_identity_loader().get('advertiser', current_advertiser.id)
             
             result = {
                 'id': comment.id,
@@ -1030,46 +892,18 @@ class SearchPosts(Resource):
             if not query:
                 api.abort(400, 'Search query is required')
             
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
-            posts = Post.query.filter(
-                Post.caption.ilike(f'%{query}%')
-            ).order_by(
-                Post.created_at.desc()
-            ).paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
+            rows, meta = paginate(
+                _feed_query().filter(Post.caption.ilike(f'%{query}%')),
+                created_desc(Post),
+                key=_feed_key
             )
             
-            result = []
-            for post in posts.items:
-                advertiser = Advertiser.find_by_id(post.advertiser_id)
-                likes_count = PostLike.query.filter_by(post_id=post.id).count()
-                post_dict = {
-                    'id': post.id,
-                    'advertiser_id': post.advertiser_id,
-                    'image_url': post.image_url,
-                    'caption': post.caption,
-                    'created_at': post.created_at.isoformat() if post.created_at else None,
-                    'updated_at': post.updated_at.isoformat() if post.updated_at else None,
-                    'likes_count': likes_count,
-                    'advertiser': {
-                        'id': advertiser.id if advertiser else None,
-                        'name': advertiser.name if advertiser else 'Unknown Advertiser',
-                        'username': advertiser.username if advertiser else 'unknown'
-                    }
-                }
-                result.append(post_dict)
+            result = _build_post_dicts(rows, current_advertiser)
             
-            return {
-                'posts': result,
-                'total': posts.total,
-                'pages': posts.pages,
-                'current_page': posts.page
-            }
+            return {'posts': result, **meta}
             
+        except InvalidCursor as e:
+            api.abort(400, str(e))
         except Exception as e:
             api.abort(500, f'Failed to search posts: {str(e)}')
 
@@ -1083,9 +917,8 @@ class TopAdvertisersByLikes(Resource):
         try:
             limit = request.args.get('limit', 10, type=int)
             
-            # Query to get advertisers with total likes count
-            # Join Post -> PostLike, group by advertiser, order by total likes
-            from sqlalchemy import func
+            # Sum the per-post like counters instead of aggregating post_likes
+            total_likes = func.sum(Post.likes_count)
             
             top_advertisers = db.session.query(
                 Advertiser.id,
@@ -1094,15 +927,15 @@ class TopAdvertisersByLikes(Resource):
                 Advertiser.profile_image_url,
                 Advertiser.is_verified,
                 Advertiser.is_online,
-                func.count(PostLike.id).label('total_likes')
+                total_likes.label('total_likes')
             ).join(
                 Post, Post.advertiser_id == Advertiser.id
-            ).join(
-                PostLike, PostLike.post_id == Post.id
             ).group_by(
                 Advertiser.id
+            ).having(
+                total_likes > 0
             ).order_by(
-                func.count(PostLike.id).desc()
+                total_likes.desc()
             ).limit(limit).all()
             
             result = []
@@ -1114,7 +947,7 @@ class TopAdvertisersByLikes(Resource):
                     'profile_image_url': adv.profile_image_url,
                     'is_verified': adv.is_verified,
                     'is_online': adv.is_online,
-                    'total_likes': adv.total_likes
+                    'total_likes': int(adv.total_likes or 0)
                 })
             
             return {
@@ -1,23 +1,34 @@
-from flask_socketio import emit, join_room, leave_room, disconnect
-from models import User, Advertiser
+from flask import request
+from flask_socketio import emit, join_room, leave_room
+from services.socket_sessions import socket_sessions
+from utils.principal_cache import load_principal
+
+def _conversation_member(data, event):
+    """
+    (principal key, conversation_id) for a conversation event from a socket
+    whose principal participates in it; otherwise emits 'error' and returns None.
+    The principal is the one bound at connect, never an id from the payload.
+    """
+    key = socket_sessions.principal(request.sid)
+    if key is None:
+        emit('error', {'message': f'{event}: not authenticated'})
+        return None
+    try:
+        conversation_id = int((data or {}).get('conversation_id'))
+    except (TypeError, ValueError, AttributeError):
+        emit('error', {'message': f'{event}: conversation_id is required'})
+        return None
+    if not socket_sessions.is_member(key, conversation_id):
+        emit('error', {'message': f'{event}: not a participant in this conversation'})
+        return None
+    return key, conversation_id
 
 def register_socket_handlers(socketio):
-    """Register all Socket.IO event handlers"""
-    
-    @socketio.on('connect')
-    def handle_connect():
-        """Handle client connection"""
-        print(f'Client connected: {request.sid}')
-        emit('connect_response', {
-            'message': 'Connected to server',
-            'data': 'Connected'
-        })
-    
-    @socketio.on('disconnect')
-    def handle_disconnect():
-        """Handle client disconnection"""
-        print(f'Client disconnected: {request.sid}')
-    
+    """
+    Register the conversation room events (join/leave, typing, read receipts).
+    Connection lifecycle, presence and send_message live in app.py.
+    """
+
     @socketio.on('join_conversation')
     def handle_join_conversation(data):
         """
@@ -25,32 +36,27 @@ def register_socket_handlers(socketio):
         Client emits: {'conversation_id': 123}
         """
         try:
-            conversation_id = data.get('conversation_id')
-            if not conversation_id:
-                emit('error', {'message': 'conversation_id is required'})
+            member = _conversation_member(data, 'join_conversation')
+            if not member:
                 return
-            
+            key, conversation_id = member
+
             room = f"conv_{conversation_id}"
             join_room(room)
-            
-            print(f'Client {request.sid} joined conversation {conversation_id}')
-            
+
+            print(f'Client {request.sid} ({key[0]} {key[1]}) joined conversation {conversation_id}')
+
+            emit('joined', {'room': room})
             emit('joined_conversation', {
                 'conversation_id': conversation_id,
                 'status': 'success',
                 'message': 'Successfully joined conversation'
             })
-            
-            # Optionally notify others in the room
-            emit('user_joined_conversation', {
-                'conversation_id': conversation_id,
-                'user_count': len(socketio.server.rooms.get(room, []))
-            }, room=room, skip_sid=True)
-            
+
         except Exception as e:
             print(f'Error in join_conversation: {str(e)}')
-            emit('error', {'message': f'Failed to join conversation: {str(e)}'})
-    
+            emit('error', {'message': 'Failed to join conversation'})
+
     @socketio.on('leave_conversation')
     def handle_leave_conversation(data):
         """
@@ -58,106 +64,94 @@ def register_socket_handlers(socketio):
         Client emits: {'conversation_id': 123}
         """
         try:
-            conversation_id = data.get('conversation_id')
+            conversation_id = (data or {}).get('conversation_id')
             if not conversation_id:
                 emit('error', {'message': 'conversation_id is required'})
                 return
-            
-            room = f"conv_{conversation_id}"
-            leave_room(room)
-            
-            print(f'Client {request.sid} left conversation {conversation_id}')
-            
+
+            # Leaving needs no authorization: a socket can only leave rooms it is in
+            leave_room(f"conv_{conversation_id}")
+
             emit('left_conversation', {
                 'conversation_id': conversation_id,
                 'status': 'success',
                 'message': 'Successfully left conversation'
             })
-            
-            # Notify others in the room
-            emit('user_left_conversation', {
-                'conversation_id': conversation_id
-            }, room=room)
-            
+
         except Exception as e:
             print(f'Error in leave_conversation: {str(e)}')
-            emit('error', {'message': f'Failed to leave conversation: {str(e)}'})
-    
+            emit('error', {'message': 'Failed to leave conversation'})
+
     @socketio.on('typing')
     def handle_typing(data):
         """
         Handle typing indicator.
-        Client emits: {'conversation_id': 123, 'user_id': 456, 'username': 'john'}
+        Client emits: {'conversation_id': 123}; user_id/username in the payload are ignored.
         """
         try:
-            conversation_id = data.get('conversation_id')
-            user_id = data.get('user_id')
-            username = data.get('username', 'Unknown')
-            
-            if not conversation_id or not user_id:
-                emit('error', {'message': 'conversation_id and user_id are required'})
+            member = _conversation_member(data, 'typing')
+            if not member:
                 return
-            
-            room = f"conv_{conversation_id}"
-            
+            (participant_type, participant_id), conversation_id = member
+            principal = load_principal(participant_type, participant_id)
+
             # Broadcast typing indicator to others in the conversation
             emit('user_typing', {
                 'conversation_id': conversation_id,
-                'user_id': user_id,
-                'username': username
-            }, room=room, skip_sid=True)  # Don't send back to sender
-            
+                'user_id': participant_id,
+                'user_type': participant_type,
+                'username': getattr(principal, 'username', None) or 'Unknown'
+            }, room=f"conv_{conversation_id}", include_self=False)  # Don't send back to sender
+
         except Exception as e:
             print(f'Error in typing: {str(e)}')
-    
+
     @socketio.on('stop_typing')
     def handle_stop_typing(data):
         """
         Handle stop typing indicator.
-        Client emits: {'conversation_id': 123, 'user_id': 456}
+        Client emits: {'conversation_id': 123}
         """
         try:
-            conversation_id = data.get('conversation_id')
-            user_id = data.get('user_id')
-            
-            if not conversation_id or not user_id:
-                emit('error', {'message': 'conversation_id and user_id are required'})
+            member = _conversation_member(data, 'stop_typing')
+            if not member:
                 return
-            
-            room = f"conv_{conversation_id}"
-            
+            (participant_type, participant_id), conversation_id = member
+
             # Broadcast stop typing to others
             emit('user_stopped_typing', {
                 'conversation_id': conversation_id,
-                'user_id': user_id
-            }, room=room, skip_sid=True)
-            
+                'user_id': participant_id,
+                'user_type': participant_type
+            }, room=f"conv_{conversation_id}", include_self=False)
+
         except Exception as e:
             print(f'Error in stop_typing: {str(e)}')
-    
+
     @socketio.on('message_read')
     def handle_message_read(data):
         """
         Handle message read receipt.
-        Client emits: {'conversation_id': 123, 'message_id': 789, 'user_id': 456}
+        Client emits: {'conversation_id': 123, 'message_id': 789}
         """
         try:
-            conversation_id = data.get('conversation_id')
+            member = _conversation_member(data, 'message_read')
+            if not member:
+                return
+            (participant_type, participant_id), conversation_id = member
+
             message_id = data.get('message_id')
-            user_id = data.get('user_id')
-            
-            if not all([conversation_id, message_id, user_id]):
-                emit('error', {'message': 'conversation_id, message_id, and user_id are required'})
+            if not message_id:
+                emit('error', {'message': 'message_id is required'})
                 return
-            
-            room = f"conv_{conversation_id}"
-            
+
             # Broadcast read receipt to others
             emit('message_read_receipt', {
                 'conversation_id': conversation_id,
                 'message_id': message_id,
-                'user_id': user_id
-            }, room=room)
-            
+                'user_id': participant_id,
+                'user_type': participant_type
+            }, room=f"conv_{conversation_id}")
+
         except Exception as e:
-            print(f'Error in message_read: {str(e)}')
\ No newline at end of file
+            print(f'Error in message_read: {str(e)}')
@@ -1,8 +1,11 @@
 from flask import request, jsonify
 from flask_restx import Namespace, Resource, fields
-from models import User, Post, UserBlock, db
+from models import User, Post, UserBlock, DeviceToken, db
 from .decorators import token_required
 from cloudinary_service import get_service as get_cloudinary_service
+from utils.pagination import paginate, created_desc, InvalidCursor
+from utils.media_utils import stream_multipart_upload
+from services.inbox_service import participant_type_of
 from flask_restx import fields
 
 api = Namespace('users', description='User management operations')
@@ -247,9 +250,6 @@ class SearchUsers(Resource):
             gender = request.args.get('gender', '').strip()
             location = request.args.get('location', '').strip()
             
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
             # Start with base query
             user_query = User.query
             
@@ -271,17 +271,11 @@ class SearchUsers(Resource):
                 user_query = user_query.filter(User.location.ilike(f'%{location}%'))
             
             # Execute query with pagination
-            users = user_query.paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
+            users, meta = paginate(user_query, created_desc(User))
             
             return {
-                'users': [user.to_dict_safe() for user in users.items],
-                'total': users.total,
-                'pages': users.pages,
-                'current_page': users.page,
+                'users': [user.to_dict_safe() for user in users],
+                **meta,
                 'filters_applied': {
                     'query': query,
                     'gender': gender,
@@ -289,6 +283,8 @@ class SearchUsers(Resource):
                 }
             }
             
+        except InvalidCursor as e:
+            api.abort(400, str(e))
         except Exception as e:
             api.abort(500, f'Failed to search users: {str(e)}')
 
@@ -302,15 +298,21 @@ class UserAvatar(Resource):
         try:
             if current_user.id != user_id:
                 api.abort(403, 'Can only update your own profile')
-            data = request.get_json()
-            if not data or not data.get('image'):
-                api.abort(400, 'image is required')
             cloudinary_service = get_cloudinary_service()
-            result = cloudinary_service.upload_base64_image(
-                data['image'],
-                folder='vpg/users',
-                public_id=f'user_{user_id}'
-            )
+            if request.mimetype == 'multipart/form-data':
+                # Streamed file part: Cloudinary reads straight from the spooled temp file
+                _, upload, _ = stream_multipart_upload(request.environ, field='image')
+                with upload:
+                    result = cloudinary_service.upload_image(upload, folder='vpg/users', public_id=f'user_{user_id}')
+            else:
+                data = request.get_json()
+                if not data or not data.get('image'):
+                    api.abort(400, 'image is required')
+                result = cloudinary_service.upload_base64_image(
+                    data['image'],
+                    folder='vpg/users',
+                    public_id=f'user_{user_id}'
+                )
             if not result['success']:
                 api.abort(400, f"Image upload failed: {result['error']}")
             current_user.profile_image_url = result['secure_url']
@@ -319,6 +321,8 @@ class UserAvatar(Resource):
                 'message': 'Avatar updated',
                 'profile_image_url': current_user.profile_image_url
             }, 201
+        except ValueError as e:
+            api.abort(400, str(e))
         except Exception as e:
             db.session.rollback()
             api.abort(500, f'Failed to upload avatar: {str(e)}')
@@ -329,25 +333,25 @@ class FCMToken(Resource):
     @token_required
     def post(self, current_user):
         """
-        Update user's FCM token for push notifications
+        Register this device's FCM token for push notifications. Each device
+        registers its own token; all of them are notified.
         
         Request body:
         {
-            "fcm_token": "firebase_token_here"
+            "fcm_token": "firebase_token_here",
+            "platform": "android"   // optional: android, ios, web
         }
         """
+        data = request.get_json(silent=True) or {}
+        fcm_token = data.get('fcm_token')
+        if not fcm_token:
+            api.abort(400, 'fcm_token is required')
+        
         try:
-            data = request.get_json()
-            fcm_token = data.get('fcm_token')
-            
-            if not fcm_token:
-                api.abort(400, 'fcm_token is required')
-            
-            # Update user's FCM token
-            current_user.fcm_token = fcm_token
+            DeviceToken.register(participant_type_of(current_user), current_user.id, fcm_token, data.get('platform'))
             db.session.commit()
             
-            print(f'[FCMToken] Updated token for {current_user.__class__.__name__}:{current_user.id}')
+            print(f'[FCMToken] Registered device token for {current_user.__class__.__name__}:{current_user.id}')
             
             return {
                 'message': 'FCM token updated successfully',
@@ -363,10 +367,12 @@ class FCMToken(Resource):
     @token_required
     def delete(self, current_user):
         """
-        Delete user's FCM token (for logout)
+        Unregister a device token (for logout). Send {"fcm_token": ...} to
+        remove only this device; without it every device is removed.
         """
+        data = request.get_json(silent=True) or {}
         try:
-            current_user.fcm_token = None
+            DeviceToken.unregister(participant_type_of(current_user), current_user.id, data.get('fcm_token'))
             db.session.commit()
             
             print(f'[FCMToken] Deleted token for {current_user.__class__.__name__}:{current_user.id}')
@@ -2,15 +2,16 @@
 # app.py - UPDATED with JWT Support & PostgreSQL
 # ============================================
 
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, jsonify, send_file, request, make_response, redirect
 from flask_restful import Api
 from flasgger import Swagger
 import os
+import mimetypes
 from flask_restx import Api as RestxApi
 from database import db, migrate
 from dotenv import load_dotenv
 from flask_cors import CORS
-from flask_socketio import SocketIO, join_room, leave_room, emit
+from flask_socketio import SocketIO, join_room, emit
 from flask_jwt_extended import JWTManager
 from datetime import timedelta
 import logging
@@ -82,8 +83,18 @@ def create_app(config_name=None):
     logger.info(f"  - Refresh Token Expires: {app.config['JWT_REFRESH_TOKEN_EXPIRES']}")
     
     # ========== FILE UPLOAD CONFIG ==========
-    app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'uploads')
+    app.config['UPLOAD_FOLDER'] = os.environ.get('MEDIA_ROOT', os.path.join(os.getcwd(), 'uploads'))
     app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+    # Media filenames are random and never rewritten, so responses can be cached for a year
+    app.config['MEDIA_CACHE_MAX_AGE'] = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 365 * 24 * 3600))
+    # 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd) hands the bytes to the front proxy
+    app.config['MEDIA_SENDFILE_MODE'] = os.environ.get('MEDIA_SENDFILE_MODE', '').lower() or None
+    app.config['MEDIA_ACCEL_PREFIX'] = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media')
+    app.config['USE_X_SENDFILE'] = app.config['MEDIA_SENDFILE_MODE'] == 'x-sendfile'
+    # Where media lives ('local' or 's3') and the URL it is published under are read from
+    # the environment by utils.storage, so media worker processes share them
+    app.config['MEDIA_STORAGE'] = os.environ.get('MEDIA_STORAGE', 'local').lower()
+    app.config['MEDIA_PRESIGN_TTL'] = int(os.environ.get('MEDIA_PRESIGN_TTL', 3600))
     
     # ========== CLOUDINARY CONFIG ==========
     app.config['CLOUDINARY_CLOUD_NAME'] = os.environ.get('CLOUDINARY_CLOUD_NAME')
@@ -176,9 +187,20 @@ def create_app(config_name=None):
         raise
     
     # Initialize Socket.IO
+    # With a message queue (redis://..., any Redis-protocol server) emits from one worker
+    # reach sockets connected to every other worker; without one they stay in-process.
+    app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+    app.config['SOCKETIO_CHANNEL'] = os.environ.get('SOCKETIO_CHANNEL', 'vpg-socketio')
     socketio = SocketIO(cors_allowed_origins='*')
-    socketio.init_app(app, cors_allowed_origins='*')
+    socketio.init_app(
+        app,
+        cors_allowed_origins='*',
+        message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'],
+        channel=app.config['SOCKETIO_CHANNEL']
+    )
     app.extensions['socketio'] = socketio
+    if app.config['SOCKETIO_MESSAGE_QUEUE']:
+        logger.info(f"✓ Socket.IO message queue: {app.config['SOCKETIO_MESSAGE_QUEUE'].split('@')[-1]} (channel {app.config['SOCKETIO_CHANNEL']})")
 
     # ========== IMPORT MODELS ==========
     with app.app_context():
@@ -233,6 +255,42 @@ def create_app(config_name=None):
         raise
 
     # ========== INITIALIZE SERVICES ==========
+    try:
+        from utils.principal_cache import principal_cache
+        principal_cache.init_app(app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning initializing principal cache: {e}")
+
+    try:
+        from services.image_ingest import image_ingest
+        image_ingest.init_app(app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning initializing image ingest worker: {e}")
+
+    try:
+        from services.media_worker import media_pool
+        media_pool.init_app(app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning initializing media processing pool: {e}")
+
+    try:
+        from services.presence import presence
+        presence.init_app(app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning initializing presence tracker: {e}")
+
+    try:
+        from services.socket_sessions import socket_sessions
+        socket_sessions.init_app(app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning initializing socket sessions: {e}")
+
+    try:
+        from services.push_dispatcher import push_dispatcher
+        push_dispatcher.init_app(app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning initializing push dispatcher: {e}")
+
     try:
         from services.email_service import email_service
         email_service.init_app(app)
@@ -248,60 +306,183 @@ def create_app(config_name=None):
     except Exception as e:
         logger.warning(f"⚠ Warning initializing scheduler: {e}")
 
+    try:
+        from tasks.engagement_counters import register_counter_jobs
+        if app.extensions.get('scheduler'):
+            register_counter_jobs(app.extensions['scheduler'], app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning scheduling counter reconciliation: {e}")
+
+    try:
+        from tasks.upload_sessions import register_upload_session_jobs
+        if app.extensions.get('scheduler'):
+            register_upload_session_jobs(app.extensions['scheduler'], app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning scheduling upload session purge: {e}")
+
+    try:
+        from tasks.media_blobs import register_media_blob_jobs
+        if app.extensions.get('scheduler'):
+            register_media_blob_jobs(app.extensions['scheduler'], app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning scheduling media blob purge: {e}")
+
+    try:
+        from tasks.device_tokens import register_device_token_jobs
+        if app.extensions.get('scheduler'):
+            register_device_token_jobs(app.extensions['scheduler'], app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning scheduling device token prune: {e}")
+
+    try:
+        from tasks.presence import register_presence_jobs
+        if app.extensions.get('scheduler'):
+            register_presence_jobs(app.extensions['scheduler'], app)
+    except Exception as e:
+        logger.warning(f"⚠ Warning scheduling presence flush: {e}")
+
     # ========== MEDIA FILE SERVING ==========
-    @app.route('/media/<category>/<filename>')
-    def serve_media(category, filename):
-        """Serve media files (images, videos, audio) from uploads directory"""
+    from utils.storage import get_storage
+
+    def _send_media(key):
+        """
+        Serve an upload with long-lived caching. Range requests (206), strong
+        ETags and If-None-Match / If-Range / If-Modified-Since are handled by
+        send_file's conditional mode; with MEDIA_SENDFILE_MODE set, the front
+        proxy streams the file instead of this worker. Object-store media is
+        a redirect to a short-lived presigned URL (normally a CDN sits in
+        front via MEDIA_PUBLIC_URL and this route is not hit at all).
+        """
+        storage = get_storage()
+        if storage.name != 'local':
+            if not storage.exists(key):
+                raise FileNotFoundError(key)
+            ttl = app.config['MEDIA_PRESIGN_TTL']
+            response = redirect(storage.presigned_url(key, expires=ttl), code=302)
+            response.headers['Cache-Control'] = f'private, max-age={max(ttl - 60, 0)}'
+            return response
+
+        path = storage.local_path(key)
+        if path is None or not os.path.isfile(path):
+            raise FileNotFoundError(key)
+
+        stat = os.stat(path)
+        # Filenames are UUIDs/content hashes and files are never modified in place, so name + size is a strong validator
+        filename = os.path.basename(path)
+        etag = f"{os.path.splitext(filename)[0]}-{stat.st_size:x}"
+        max_age = app.config['MEDIA_CACHE_MAX_AGE']
+
+        if app.config['MEDIA_SENDFILE_MODE'] == 'x-accel':
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response('')
+                response.headers['X-Accel-Redirect'] = f"{app.config['MEDIA_ACCEL_PREFIX']}/{key}"
+                response.content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response.set_etag(etag)
+        else:
+            response = send_file(path, conditional=True, etag=etag, max_age=max_age, last_modified=stat.st_mtime)
+
+        response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+
+    @app.route('/media/<path:key>')
+    def serve_media(key):
+        """Serve media files (images, videos, audio, thumbnails, variants) by storage key"""
         try:
-            media_path = os.path.join(app.config['UPLOAD_FOLDER'], category)
-            return send_from_directory(media_path, filename, as_attachment=False)
+            return _send_media(key)
         except FileNotFoundError:
             return {'error': 'File not found'}, 404
         except Exception as e:
             logger.error(f'Error serving media: {e}')
             return {'error': 'Error retrieving file'}, 500
 
-    @app.route('/media/thumbnails/<filename>')
-    def serve_thumbnail(filename):
-        """Serve thumbnail files from uploads directory"""
-        try:
-            thumbnail_path = os.path.join(app.config['UPLOAD_FOLDER'], 'thumbnails')
-            return send_from_directory(thumbnail_path, filename, as_attachment=False)
-        except FileNotFoundError:
-            return {'error': 'Thumbnail not found'}, 404
-        except Exception as e:
-            logger.error(f'Error serving thumbnail: {e}')
-            return {'error': 'Error retrieving thumbnail'}, 500
-
     # ========== HEALTH CHECK ==========
     @app.route('/health')
     def health():
         """Health check endpoint"""
+        principal_cache = app.extensions.get('principal_cache')
+        image_ingest = app.extensions.get('image_ingest')
+        media_pool = app.extensions.get('media_pool')
+        push_dispatcher = app.extensions.get('push_dispatcher')
+        presence = app.extensions.get('presence')
+        socket_sessions = app.extensions.get('socket_sessions')
         return jsonify({
             "status": "ok",
             "jwt_enabled": True,
-            "database": "connected"
+            "database": "connected",
+            "socketio_message_queue": bool(app.config.get('SOCKETIO_MESSAGE_QUEUE')),
+            "principal_cache": principal_cache.stats() if principal_cache else None,
+            "image_ingest": image_ingest.stats() if image_ingest else None,
+            "media_pool": media_pool.stats() if media_pool else None,
+            "push": push_dispatcher.stats() if push_dispatcher else None,
+            "presence": presence.stats() if presence else None,
+            "socket_sessions": socket_sessions.stats() if socket_sessions else None
         }), 200
 
     # ========== SOCKET.IO EVENTS ==========
-    @socketio.on('join_conversation')
-    def on_join(data):
+    @socketio.on('connect')
+    def on_connect(auth=None):
+        """
+        Sockets carrying an access token (auth={'token': ...}) are bound to
+        their principal for send_message and count towards presence
+        """
         try:
-            conv_id = data.get('conversation_id')
-            if conv_id:
-                join_room(f"conv_{conv_id}")
-                emit('joined', {'room': f"conv_{conv_id}"})
+            from apis.decorators import decode_access_token
+            token = (auth or {}).get('token') if isinstance(auth, dict) else None
+            payload, err = decode_access_token(token or request.args.get('token'))
+            if payload:
+                participant_type = 'advertiser' if payload.get('user_type') == 'advertiser' else 'user'
+                if app.extensions.get('socket_sessions'):
+                    app.extensions['socket_sessions'].bind(request.sid, participant_type, payload.get('user_id'))
+                if app.extensions.get('presence'):
+                    app.extensions['presence'].connect(request.sid, participant_type, payload.get('user_id'))
         except Exception as e:
-            logger.error(f"Error in join_conversation: {e}")
+            logger.error(f"Error in connect: {e}")
+
+    @socketio.on('disconnect')
+    def on_disconnect(*args):
+        if app.extensions.get('socket_sessions'):
+            app.extensions['socket_sessions'].unbind(request.sid)
+        if app.extensions.get('presence'):
+            app.extensions['presence'].disconnect(request.sid)
+
+    @socketio.on('send_message')
+    def on_send_message(data):
+        """
+        Text message over the socket: {'conversation_id', 'content', 'client_message_id'}.
+        The return value is the ack; resending the same client_message_id is safe.
+        """
+        from apis.message_api import send_socket_message
+        socket_sessions = app.extensions.get('socket_sessions')
+        principal_key = socket_sessions.principal(request.sid) if socket_sessions else None
+        return send_socket_message(principal_key, data)
 
-    @socketio.on('leave_conversation')
-    def on_leave(data):
+    @socketio.on('heartbeat')
+    def on_heartbeat(data=None):
+        """Clients send this every ~30s so presence survives connections that die silently"""
+        if app.extensions.get('presence'):
+            app.extensions['presence'].heartbeat(request.sid)
+
+    @socketio.on('join_advertiser')
+    def on_join_advertiser(data):
+        """Owner room for background job events (post_ready, post_failed, image_upload_complete)"""
         try:
-            conv_id = data.get('conversation_id')
-            if conv_id:
-                leave_room(f"conv_{conv_id}")
+            advertiser_id = data.get('advertiser_id')
+            socket_sessions = app.extensions.get('socket_sessions')
+            principal_key = socket_sessions.principal(request.sid) if socket_sessions else None
+            if not advertiser_id or principal_key != ('advertiser', int(advertiser_id)):
+                emit('error', {'message': 'join_advertiser: only the advertiser can join their room'})
+                return
+            join_room(f"advertiser_{advertiser_id}")
+            emit('joined', {'room': f"advertiser_{advertiser_id}"})
         except Exception as e:
-            logger.error(f"Error in leave_conversation: {e}")
+            logger.error(f"Error in join_advertiser: {e}")
+
+    # Conversation rooms, typing and read receipts (authorized against the socket's principal)
+    from apis.socket_handlers import register_socket_handlers
+    register_socket_handlers(socketio)
 
     return app
 
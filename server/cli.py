@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import click
 from app import create_app
 from database import db
 from flask_migrate import upgrade, migrate, init, stamp
@@ -13,6 +14,17 @@ if __name__ == '__main__':
         # You can run migrations here or use Flask CLI
         pass
 
+@app.cli.command('reconcile-counters')
+@click.option('--chunk-size', default=500, show_default=True, help='Rows recomputed per batch')
+def reconcile_counters(chunk_size):
+    """Recompute drifted post/comment like and comment counters."""
+    from tasks.engagement_counters import reconcile_all_counters
+    result = reconcile_all_counters(chunk_size)
+    if result is None:
+        raise click.ClickException('Counter reconciliation failed, see logs')
+    click.echo(f"posts: {result['posts']}")
+    click.echo(f"comments: {result['comments']}")
+
 def seed_advertiser_coords():
     """Seed a few advertisers with sample coordinates (NYC area)."""
     samples = [
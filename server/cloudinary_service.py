@@ -2,10 +2,38 @@
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
+import cloudinary.utils
 from flask import current_app
 import time
 import os
 
+# Width-bounded renditions derived for every image (chat bubble, feed tile, full screen)
+RESPONSIVE_WIDTHS = (160, 480, 1080)
+UPLOAD_PATH = '/image/upload/'
+
+
+def _variant_transformation(width, fmt):
+    return f"c_limit,w_{width},f_{fmt},q_auto"
+
+
+def responsive_srcset(image_url, widths=RESPONSIVE_WIDTHS):
+    """
+    Srcset-style map {"<width>": {"webp", "jpeg"}} for a Cloudinary delivery URL,
+    or None for URLs that are not Cloudinary uploads. The renditions are
+    generated eagerly at upload time (see upload_image), so the first client
+    to ask for one does not pay for the transformation.
+    """
+    if not image_url or 'res.cloudinary.com' not in image_url or UPLOAD_PATH not in image_url:
+        return None
+    prefix, rest = image_url.split(UPLOAD_PATH, 1)
+    return {
+        str(width): {
+            'webp': f"{prefix}{UPLOAD_PATH}{_variant_transformation(width, 'webp')}/{rest}",
+            'jpeg': f"{prefix}{UPLOAD_PATH}{_variant_transformation(width, 'jpg')}/{rest}"
+        }
+        for width in widths
+    }
+
 class CloudinaryService:
     def __init__(self):
         self._configured = False
@@ -69,7 +97,12 @@ class CloudinaryService:
                 'folder': folder,
                 'resource_type': 'image',
                 'quality': 'auto',
-                'fetch_format': 'auto'
+                'fetch_format': 'auto',
+                # Pre-generate the responsive_srcset renditions in the background
+                'eager': '|'.join(
+                    _variant_transformation(width, fmt) for width in RESPONSIVE_WIDTHS for fmt in ('webp', 'jpg')
+                ),
+                'eager_async': True
             }
             
             # Try to get upload preset from config
@@ -132,6 +165,85 @@ class CloudinaryService:
                 'error': f"Base64 upload failed: {str(e)}"
             }
     
+    def signed_upload_params(self, folder, public_id, ttl=600):
+        """
+        Signed parameters for a direct browser/app -> Cloudinary upload, so the
+        image bytes never pass through the API
+        
+        Args:
+            folder: Cloudinary folder the upload must land in
+            public_id: Public ID the upload must use
+            ttl: Seconds the client has to complete the upload (enforced on finalize)
+        
+        Returns:
+            dict: Upload URL plus the form fields to post alongside the file
+        """
+        try:
+            self._ensure_configured()
+            config = cloudinary.config()
+            timestamp = int(time.time())
+            
+            params = {
+                'folder': folder,
+                'public_id': public_id,
+                'timestamp': timestamp,
+                'eager': '|'.join(
+                    _variant_transformation(width, fmt) for width in RESPONSIVE_WIDTHS for fmt in ('webp', 'jpg')
+                ),
+                'eager_async': 'true'
+            }
+            try:
+                upload_preset = current_app.config.get('CLOUDINARY_UPLOAD_PRESET')
+                if upload_preset:
+                    params['upload_preset'] = upload_preset
+            except RuntimeError:
+                pass
+            
+            signature = cloudinary.utils.api_sign_request(params, config.api_secret)
+            return {
+                'success': True,
+                'upload_url': f"https://api.cloudinary.com/v1_1/{config.cloud_name}/image/upload",
+                'cloud_name': config.cloud_name,
+                'api_key': config.api_key,
+                'signature': signature,
+                'expires_at': timestamp + ttl,
+                **params
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def get_image(self, public_id):
+        """
+        Look up an uploaded image (used to verify direct uploads before attaching them)
+        
+        Args:
+            public_id: Cloudinary public ID of the image
+        
+        Returns:
+            dict: Image details, or success=False if it does not exist
+        """
+        try:
+            self._ensure_configured()
+            result = cloudinary.api.resource(public_id, resource_type='image')
+            return {
+                'success': True,
+                'public_id': result['public_id'],
+                'secure_url': result['secure_url'],
+                'format': result.get('format'),
+                'width': result.get('width'),
+                'height': result.get('height'),
+                'bytes': result.get('bytes'),
+                'created_at': result.get('created_at')
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
     def delete_image(self, public_id):
         """
         Delete image from Cloudinary
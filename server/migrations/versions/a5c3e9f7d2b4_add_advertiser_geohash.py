@@ -0,0 +1,42 @@
+"""add geohash column and spatial indexes to advertisers
+
+Revision ID: a5c3e9f7d2b4
+Revises: f2b6d8e4c1a7
+Create Date: 2026-10-18 13:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+from utils.geo import encode_geohash
+
+revision = 'a5c3e9f7d2b4'
+down_revision = 'f2b6d8e4c1a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('advertisers') as batch_op:
+        batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+        batch_op.create_index('idx_advertiser_geohash', ['geohash'])
+        batch_op.create_index('idx_advertiser_lat_lon', ['latitude', 'longitude'])
+
+    # Geohash is computed in Python, so backfill row by row from the existing coordinates
+    bind = op.get_bind()
+    rows = bind.execute(sa.text(
+        "SELECT id, latitude, longitude FROM advertisers "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+    )).fetchall()
+    for advertiser_id, lat, lon in rows:
+        bind.execute(
+            sa.text("UPDATE advertisers SET geohash = :geohash WHERE id = :id"),
+            {'geohash': encode_geohash(float(lat), float(lon)), 'id': advertiser_id}
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('advertisers') as batch_op:
+        batch_op.drop_index('idx_advertiser_lat_lon')
+        batch_op.drop_index('idx_advertiser_geohash')
+        batch_op.drop_column('geohash')
@@ -0,0 +1,27 @@
+"""add processing status to posts for background image ingestion
+
+Revision ID: b6d2f8a4c9e1
+Revises: a5c3e9f7d2b4
+Create Date: 2026-10-18 14:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'b6d2f8a4c9e1'
+down_revision = 'a5c3e9f7d2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing posts already have their Cloudinary URL, so they start out ready
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=20), nullable=False, server_default='ready'))
+        batch_op.add_column(sa.Column('processing_error', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('processing_error')
+        batch_op.drop_column('status')
@@ -0,0 +1,41 @@
+"""add likes_count and comments_count counters to posts
+
+Revision ID: c3d9e2a7f4b1
+Revises: 13ced6775356
+Create Date: 2026-10-18 09:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'c3d9e2a7f4b1'
+down_revision = '13ced6775356'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.add_column(sa.Column('likes_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('comments_count', sa.Integer(), nullable=False, server_default='0'))
+
+    # Backfill from the source tables; later drift is repaired by tasks/engagement_counters.py
+    op.execute(
+        "UPDATE posts SET likes_count = "
+        "(SELECT COUNT(*) FROM post_likes WHERE post_likes.post_id = posts.id)"
+    )
+    op.execute(
+        "UPDATE posts SET comments_count = "
+        "(SELECT COUNT(*) FROM comments WHERE comments.target_type = 'post' "
+        "AND comments.target_id = posts.id AND comments.is_deleted = false)"
+    )
+    op.execute(
+        "UPDATE comments SET likes_count = "
+        "(SELECT COUNT(*) FROM comment_likes WHERE comment_likes.comment_id = comments.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('comments_count')
+        batch_op.drop_column('likes_count')
@@ -0,0 +1,44 @@
+"""add upload_sessions for resumable chunked media uploads
+
+Revision ID: c8e4a1d6f3b7
+Revises: b6d2f8a4c9e1
+Create Date: 2026-10-18 15:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'c8e4a1d6f3b7'
+down_revision = 'b6d2f8a4c9e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'upload_sessions',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('owner_type', sa.String(length=20), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('media_type', sa.String(length=20), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=True),
+        sa.Column('extension', sa.String(length=10), nullable=False),
+        sa.Column('total_size', sa.BigInteger(), nullable=False),
+        sa.Column('received_bytes', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='open'),
+        sa.Column('media_url', sa.String(length=500), nullable=True),
+        sa.Column('media_path', sa.String(length=500), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('upload_sessions') as batch_op:
+        batch_op.create_index('idx_upload_session_owner', ['owner_type', 'owner_id'])
+        batch_op.create_index('idx_upload_session_expires', ['expires_at'])
+
+
+def downgrade():
+    with op.batch_alter_table('upload_sessions') as batch_op:
+        batch_op.drop_index('idx_upload_session_expires')
+        batch_op.drop_index('idx_upload_session_owner')
+    op.drop_table('upload_sessions')
@@ -0,0 +1,65 @@
+"""add content-addressed media_blobs and blob references on messages/posts
+
+Revision ID: d2f7b5e9a3c6
+Revises: c8e4a1d6f3b7
+Create Date: 2026-10-18 16:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'd2f7b5e9a3c6'
+down_revision = 'c8e4a1d6f3b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'media_blobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('storage', sa.String(length=20), nullable=False),
+        sa.Column('category', sa.String(length=20), nullable=True),
+        sa.Column('extension', sa.String(length=10), nullable=True),
+        sa.Column('path', sa.String(length=500), nullable=True),
+        sa.Column('url', sa.String(length=500), nullable=False),
+        sa.Column('thumbnail_url', sa.String(length=500), nullable=True),
+        sa.Column('media_metadata', sa.JSON(), nullable=True),
+        sa.Column('size_bytes', sa.BigInteger(), nullable=True),
+        sa.Column('processed', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('last_referenced_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('storage', 'sha256', name='uq_media_blob_hash')
+    )
+    with op.batch_alter_table('media_blobs') as batch_op:
+        batch_op.create_index('idx_media_blob_unreferenced', ['ref_count', 'last_referenced_at'])
+
+    # Existing media predates hashing and keeps media_blob_id NULL (never garbage collected)
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.add_column(sa.Column('media_blob_id', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_messages_media_blob_id', ['media_blob_id'])
+        batch_op.create_foreign_key('fk_messages_media_blob', 'media_blobs', ['media_blob_id'], ['id'], ondelete='SET NULL')
+
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.add_column(sa.Column('media_blob_id', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_posts_media_blob_id', ['media_blob_id'])
+        batch_op.create_foreign_key('fk_posts_media_blob', 'media_blobs', ['media_blob_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_constraint('fk_posts_media_blob', type_='foreignkey')
+        batch_op.drop_index('ix_posts_media_blob_id')
+        batch_op.drop_column('media_blob_id')
+
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_constraint('fk_messages_media_blob', type_='foreignkey')
+        batch_op.drop_index('ix_messages_media_blob_id')
+        batch_op.drop_column('media_blob_id')
+
+    with op.batch_alter_table('media_blobs') as batch_op:
+        batch_op.drop_index('idx_media_blob_unreferenced')
+    op.drop_table('media_blobs')
@@ -0,0 +1,49 @@
+"""add composite (created_at, id) indexes for keyset pagination
+
+Revision ID: d4e8f1b2a6c3
+Revises: c3d9e2a7f4b1
+Create Date: 2026-10-18 10:00:00.000000
+"""
+
+from alembic import op
+
+revision = 'd4e8f1b2a6c3'
+down_revision = 'c3d9e2a7f4b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.create_index('idx_post_created', ['created_at', 'id'])
+        batch_op.create_index('idx_post_advertiser_created', ['advertiser_id', 'created_at', 'id'])
+
+    with op.batch_alter_table('post_likes') as batch_op:
+        batch_op.create_index('idx_post_like_post_created', ['post_id', 'created_at', 'id'])
+
+    with op.batch_alter_table('comments') as batch_op:
+        batch_op.create_index('idx_comment_target_created', ['target_type', 'target_id', 'created_at', 'id'])
+
+    with op.batch_alter_table('advertisers') as batch_op:
+        batch_op.create_index('idx_advertiser_created', ['created_at', 'id'])
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.create_index('idx_user_created', ['created_at', 'id'])
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_index('idx_user_created')
+
+    with op.batch_alter_table('advertisers') as batch_op:
+        batch_op.drop_index('idx_advertiser_created')
+
+    with op.batch_alter_table('comments') as batch_op:
+        batch_op.drop_index('idx_comment_target_created')
+
+    with op.batch_alter_table('post_likes') as batch_op:
+        batch_op.drop_index('idx_post_like_post_created')
+
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_index('idx_post_advertiser_created')
+        batch_op.drop_index('idx_post_created')
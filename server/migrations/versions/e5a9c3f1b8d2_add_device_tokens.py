@@ -0,0 +1,39 @@
+"""add device_tokens registry for multi-device push
+
+Revision ID: e5a9c3f1b8d2
+Revises: d2f7b5e9a3c6
+Create Date: 2026-10-18 18:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'e5a9c3f1b8d2'
+down_revision = 'd2f7b5e9a3c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'device_tokens',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('owner_type', sa.String(length=20), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('token', sa.String(length=512), nullable=False),
+        sa.Column('platform', sa.String(length=20), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('last_seen_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('token')
+    )
+    with op.batch_alter_table('device_tokens') as batch_op:
+        batch_op.create_index('idx_device_token_owner', ['owner_type', 'owner_id'])
+        batch_op.create_index('idx_device_token_last_seen', ['last_seen_at'])
+
+
+def downgrade():
+    with op.batch_alter_table('device_tokens') as batch_op:
+        batch_op.drop_index('idx_device_token_last_seen')
+        batch_op.drop_index('idx_device_token_owner')
+    op.drop_table('device_tokens')
@@ -0,0 +1,53 @@
+"""add denormalized last message preview to conversations
+
+Revision ID: e7a1c5d9b3f2
+Revises: d4e8f1b2a6c3
+Create Date: 2026-10-18 11:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'e7a1c5d9b3f2'
+down_revision = 'd4e8f1b2a6c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('last_message_preview', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('last_message_type', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('last_message_sender_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('last_message_sender_type', sa.String(length=20), nullable=True))
+
+    # Older rows may never have had last_message_id set; point them at their newest message
+    op.execute(
+        "UPDATE conversations SET last_message_id = "
+        "(SELECT MAX(messages.id) FROM messages WHERE messages.conversation_id = conversations.id) "
+        "WHERE last_message_id IS NULL"
+    )
+
+    # Copy the preview fields from the referenced message
+    op.execute(
+        "UPDATE conversations SET "
+        "last_message_type = (SELECT COALESCE(m.message_type, 'text') FROM messages m WHERE m.id = conversations.last_message_id), "
+        "last_message_sender_id = (SELECT m.sender_id FROM messages m WHERE m.id = conversations.last_message_id), "
+        "last_message_sender_type = (SELECT COALESCE(m.sender_type, 'user') FROM messages m WHERE m.id = conversations.last_message_id), "
+        "last_message_preview = (SELECT CASE COALESCE(m.message_type, 'text') "
+        "WHEN 'text' THEN SUBSTRING(COALESCE(m.content, ''), 1, 255) "
+        "WHEN 'image' THEN '📷 Sent a photo' "
+        "WHEN 'video' THEN '🎥 Sent a video' "
+        "WHEN 'audio' THEN '🎤 Sent a voice message' "
+        "ELSE 'Sent a message' END "
+        "FROM messages m WHERE m.id = conversations.last_message_id) "
+        "WHERE last_message_id IS NOT NULL"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.drop_column('last_message_sender_type')
+        batch_op.drop_column('last_message_sender_id')
+        batch_op.drop_column('last_message_type')
+        batch_op.drop_column('last_message_preview')
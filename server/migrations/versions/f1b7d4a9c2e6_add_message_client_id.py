@@ -0,0 +1,28 @@
+"""add client_message_id to messages for idempotent sends
+
+Revision ID: f1b7d4a9c2e6
+Revises: e5a9c3f1b8d2
+Create Date: 2026-10-18 20:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'f1b7d4a9c2e6'
+down_revision = 'e5a9c3f1b8d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.add_column(sa.Column('client_message_id', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint(
+            'uq_message_client_id', ['conversation_id', 'sender_type', 'sender_id', 'client_message_id']
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_constraint('uq_message_client_id', type_='unique')
+        batch_op.drop_column('client_message_id')
@@ -0,0 +1,50 @@
+"""add read/delivered high-water marks and unread_count to conversation participants
+
+Revision ID: f2b6d8e4c1a7
+Revises: e7a1c5d9b3f2
+Create Date: 2026-10-18 12:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'f2b6d8e4c1a7'
+down_revision = 'e7a1c5d9b3f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversation_participants') as batch_op:
+        batch_op.add_column(sa.Column('last_read_message_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('last_delivered_message_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('unread_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_index('idx_participant_inbox', ['participant_type', 'participant_id', 'unread_count'])
+
+    # Seed the marks from the legacy per-message is_read flags:
+    # unread = messages from others still flagged unread, read mark = newest message
+    # that is either our own or already read.
+    op.execute(
+        "UPDATE conversation_participants SET unread_count = ("
+        "SELECT COUNT(*) FROM messages m "
+        "WHERE m.conversation_id = conversation_participants.conversation_id "
+        "AND m.is_read = false "
+        "AND NOT (m.sender_id = conversation_participants.participant_id "
+        "AND m.sender_type = conversation_participants.participant_type))"
+    )
+    op.execute(
+        "UPDATE conversation_participants SET last_read_message_id = ("
+        "SELECT MAX(m.id) FROM messages m "
+        "WHERE m.conversation_id = conversation_participants.conversation_id "
+        "AND (m.is_read = true OR (m.sender_id = conversation_participants.participant_id "
+        "AND m.sender_type = conversation_participants.participant_type)))"
+    )
+    op.execute("UPDATE conversation_participants SET last_delivered_message_id = last_read_message_id")
+
+
+def downgrade():
+    with op.batch_alter_table('conversation_participants') as batch_op:
+        batch_op.drop_index('idx_participant_inbox')
+        batch_op.drop_column('unread_count')
+        batch_op.drop_column('last_delivered_message_id')
+        batch_op.drop_column('last_read_message_id')
@@ -13,7 +13,10 @@ from .user_settings import UserSetting
 from .userblock import UserBlock
 from .subsricption import Subscription
 from .authtoken import AuthToken
+from .upload_session import UploadSession
+from .media_blob import MediaBlob
+from .device_token import DeviceToken
 
 
 # Make them available when importing from models
-__all__ = ['db', 'User', 'Advertiser','AuthToken','UserSetting','Comment','CommentLike','Conversation','ConversationParticipant','Message','Post','PostLike','Subscription','UserBlock']
+__all__ = ['db', 'User', 'Advertiser','AuthToken','UserSetting','Comment','CommentLike','Conversation','ConversationParticipant','Message','Post','PostLike','Subscription','UserBlock','UploadSession','MediaBlob','DeviceToken']
@@ -1,5 +1,7 @@
 from datetime import datetime
+from sqlalchemy import event
 from database import db
+from utils.geo import encode_geohash
 
 class Advertiser(db.Model):
     __tablename__ = 'advertisers'
@@ -13,10 +15,11 @@ class Advertiser(db.Model):
     gender = db.Column(db.Enum('Male', 'Female', 'other', name='advertiser_gender_enum'), nullable=False)
     profile_image_url = db.Column(db.String(500), nullable=True)
     is_verified = db.Column(db.Boolean, default=False)
-    is_online = db.Column(db.Boolean, default=True)
+    is_online = db.Column(db.Boolean, default=False)  # maintained by services/presence.py
     is_active = db.Column(db.Boolean, default=True)  # Added missing field
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True)  # Derived from latitude/longitude on save
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     last_active = db.Column(db.TIMESTAMP)
@@ -33,6 +36,9 @@ class Advertiser(db.Model):
         db.Index('idx_advertiser_password', 'password_hash'),
         db.Index('idx_advertiser_online', 'is_online'),
         db.Index('idx_advertiser_active', 'last_active'),
+        db.Index('idx_advertiser_created', 'created_at', 'id'),
+        db.Index('idx_advertiser_geohash', 'geohash'),
+        db.Index('idx_advertiser_lat_lon', 'latitude', 'longitude'),
     )
     
     def to_dict(self):
@@ -120,3 +126,13 @@ class Advertiser(db.Model):
         self.is_verified = False
         self.updated_at = datetime.utcnow()
         db.session.commit()
+
+
+@event.listens_for(Advertiser, 'before_insert')
+@event.listens_for(Advertiser, 'before_update')
+def _sync_geohash(mapper, connection, target):
+    """Keep the persisted geohash in step with the coordinates."""
+    if target.latitude is None or target.longitude is None:
+        target.geohash = None
+    else:
+        target.geohash = encode_geohash(float(target.latitude), float(target.longitude))
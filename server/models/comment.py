@@ -13,4 +13,20 @@ class Comment(db.Model):
     is_deleted = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp())
     updated_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
-    replies = db.relationship('Comment', backref=db.backref('parent', remote_side=[id]), lazy=True)
\ No newline at end of file
+    replies = db.relationship('Comment', backref=db.backref('parent', remote_side=[id]), lazy=True)
+
+    __table_args__ = (
+        db.Index('idx_comment_target_created', 'target_type', 'target_id', 'created_at', 'id'),
+    )
+
+    @classmethod
+    def increment_likes(cls, comment_id, delta=1):
+        """Atomically add delta to likes_count without a read-modify-write (never below zero)."""
+        current = db.func.coalesce(cls.likes_count, 0)
+        query = cls.query.filter(cls.id == comment_id)
+        if delta < 0:
+            query = query.filter(current >= -delta)
+        return query.update(
+            {cls.likes_count: current + delta, cls.updated_at: cls.updated_at},
+            synchronize_session=False
+        )
@@ -8,8 +8,135 @@ class ConversationParticipant(db.Model):
     participant_type = db.Column(db.String(20), nullable=False)  # 'user' or 'advertiser'
     participant_id = db.Column(db.Integer, nullable=False)
 
+    # Read/delivery high-water marks: every message with id <= the mark counts as read/delivered
+    last_read_message_id = db.Column(db.Integer, nullable=True)
+    last_delivered_message_id = db.Column(db.Integer, nullable=True)
+    # Messages from others after last_read_message_id, maintained on send/read
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     __table_args__ = (
         db.UniqueConstraint('conversation_id', 'participant_type', 'participant_id', name='uq_conv_participant'),
         db.Index('idx_conv_participant', 'conversation_id', 'participant_type', 'participant_id'),
+        db.Index('idx_participant_inbox', 'participant_type', 'participant_id', 'unread_count'),
     )
 
+    @classmethod
+    def _is(cls, participant_type, participant_id):
+        return db.and_(cls.participant_type == participant_type, cls.participant_id == participant_id)
+
+    @classmethod
+    def record_message(cls, conversation_id, message_id, sender_type, sender_id):
+        """
+        Account for a new message with two single-statement updates: bump everyone
+        else's unread_count and move the sender's own read/delivered marks forward.
+        """
+        cls.query.filter(
+            cls.conversation_id == conversation_id,
+            db.not_(cls._is(sender_type, sender_id))
+        ).update({cls.unread_count: cls.unread_count + 1}, synchronize_session=False)
+        cls.query.filter(
+            cls.conversation_id == conversation_id,
+            cls._is(sender_type, sender_id)
+        ).update({
+            cls.last_read_message_id: message_id,
+            cls.last_delivered_message_id: message_id,
+        }, synchronize_session=False)
+
+    @classmethod
+    def record_message_deleted(cls, conversation_id, message_id, sender_type, sender_id):
+        """Take a deleted message back out of the badges of everyone who had not read it yet."""
+        cls.query.filter(
+            cls.conversation_id == conversation_id,
+            db.not_(cls._is(sender_type, sender_id)),
+            db.func.coalesce(cls.last_read_message_id, 0) < message_id,
+            cls.unread_count > 0
+        ).update({cls.unread_count: cls.unread_count - 1}, synchronize_session=False)
+
+    @classmethod
+    def mark_read(cls, conversation_id, participant_type, participant_id, up_to_message_id=None):
+        """
+        Move the participant's read mark to ``up_to_message_id`` (default: the
+        conversation's last message). Returns the new mark, or None if nothing changed.
+
+        unread_count drops by the messages from others between the old and the
+        new mark, counted inside the UPDATE. It is never overwritten, so a message
+        whose record_message lands concurrently keeps its +1 on the badge.
+        """
+        from .conversations import Conversation
+        from .message import Message
+
+        last_message_id = db.session.query(Conversation.last_message_id).filter(
+            Conversation.id == conversation_id
+        ).scalar()
+        if up_to_message_id is None or (last_message_id and up_to_message_id >= last_message_id):
+            up_to_message_id = last_message_id
+        if not up_to_message_id:
+            return None
+
+        current = db.func.coalesce(cls.last_read_message_id, 0)
+        delivered = db.func.coalesce(cls.last_delivered_message_id, 0)
+        # Deleted messages are gone from the table and were already taken off by record_message_deleted
+        acknowledged = db.select(db.func.count(Message.id)).where(
+            Message.conversation_id == conversation_id,
+            Message.id > current,
+            Message.id <= up_to_message_id,
+            db.not_(db.and_(Message.sender_id == cls.participant_id, Message.sender_type == cls.participant_type))
+        ).scalar_subquery()
+        remaining = cls.unread_count - acknowledged
+        # Ordered: MySQL evaluates SET left to right, so the count must read the old mark
+        updated = db.session.execute(
+            db.update(cls).where(
+                cls.conversation_id == conversation_id,
+                cls._is(participant_type, participant_id),
+                current < up_to_message_id
+            ).ordered_values(
+                (cls.unread_count, db.case((remaining > 0, remaining), else_=0)),
+                (cls.last_delivered_message_id, db.case(
+                    (delivered < up_to_message_id, up_to_message_id), else_=cls.last_delivered_message_id
+                )),
+                (cls.last_read_message_id, up_to_message_id),
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        return up_to_message_id if updated else None
+
+    @classmethod
+    def mark_delivered(cls, conversation_id, participant_type, participant_id, up_to_message_id):
+        """Move the delivered mark forward (never backwards)."""
+        if not up_to_message_id:
+            return 0
+        return cls.query.filter(
+            cls.conversation_id == conversation_id,
+            cls._is(participant_type, participant_id),
+            db.func.coalesce(cls.last_delivered_message_id, 0) < up_to_message_id
+        ).update({cls.last_delivered_message_id: up_to_message_id}, synchronize_session=False)
+
+    @classmethod
+    def mark_all_read(cls, participant_type, participant_id):
+        """Zero every unread badge for a participant in one UPDATE. Returns rows touched."""
+        from .conversations import Conversation
+
+        last_message = db.select(Conversation.last_message_id).where(
+            Conversation.id == cls.conversation_id
+        ).scalar_subquery()
+        return cls.query.filter(
+            cls._is(participant_type, participant_id),
+            cls.unread_count > 0
+        ).update({
+            cls.last_read_message_id: last_message,
+            cls.last_delivered_message_id: last_message,
+            cls.unread_count: 0,
+        }, synchronize_session=False)
+
+    @classmethod
+    def total_unread(cls, participant_type, participant_id):
+        return db.session.query(db.func.coalesce(db.func.sum(cls.unread_count), 0)).filter(
+            cls._is(participant_type, participant_id)
+        ).scalar() or 0
+
+    @classmethod
+    def read_marks(cls, conversation_id):
+        """{(participant_type, participant_id): (last_read_message_id, last_delivered_message_id)}"""
+        rows = db.session.query(
+            cls.participant_type, cls.participant_id, cls.last_read_message_id, cls.last_delivered_message_id
+        ).filter(cls.conversation_id == conversation_id).all()
+        return {(r[0], r[1]): (r[2] or 0, r[3] or 0) for r in rows}
@@ -2,6 +2,22 @@ from datetime import datetime
 from uuid import UUID
 import uuid
 from database import db
+
+# Preview strings shown in the inbox (and in push notifications) for media messages
+MEDIA_PREVIEWS = {
+    'image': '📷 Sent a photo',
+    'video': '🎥 Sent a video',
+    'audio': '🎤 Sent a voice message',
+}
+
+
+def message_preview_text(message_type, content):
+    """Short human-readable text for a message, used for inbox rows and notifications."""
+    if not message_type or message_type == 'text':
+        return content or ''
+    return MEDIA_PREVIEWS.get(message_type, 'Sent a message')
+
+
 class Conversation(db.Model):
     __tablename__ = 'conversations'
 
@@ -15,5 +31,47 @@ class Conversation(db.Model):
         nullable=True
     )
 
+    # Denormalized copy of the last message so the inbox can render rows without reading messages
+    last_message_preview = db.Column(db.String(255), nullable=True)
+    last_message_type = db.Column(db.String(20), nullable=True)
+    last_message_sender_id = db.Column(db.Integer, nullable=True)
+    last_message_sender_type = db.Column(db.String(20), nullable=True)
+
     last_message_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp())
     updated_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    def set_last_message(self, message, at=None):
+        """Point the conversation at ``message`` and refresh the denormalized preview."""
+        if message is None:
+            self.last_message_id = None
+            self.last_message_preview = None
+            self.last_message_type = None
+            self.last_message_sender_id = None
+            self.last_message_sender_type = None
+            return
+        self.last_message_id = message.id
+        self.last_message_preview = message_preview_text(message.message_type, message.content)[:255]
+        self.last_message_type = message.message_type or 'text'
+        self.last_message_sender_id = message.sender_id
+        self.last_message_sender_type = message.sender_type or 'user'
+        self.last_message_at = at or datetime.utcnow()
+
+    def refresh_last_message(self):
+        """Re-point at the newest remaining message (after the last one was deleted)."""
+        from .message import Message
+        latest = Message.query.filter_by(conversation_id=self.id).order_by(
+            Message.created_at.desc(), Message.id.desc()
+        ).first()
+        self.set_last_message(latest, at=latest.created_at if latest else None)
+
+    def preview_dict(self):
+        """Inbox preview built from the denormalized columns only."""
+        if not self.last_message_id:
+            return None
+        return {
+            'id': self.last_message_id,
+            'text': self.last_message_preview,
+            'message_type': self.last_message_type or 'text',
+            'sender_id': self.last_message_sender_id,
+            'sender_type': self.last_message_sender_type or 'user',
+        }
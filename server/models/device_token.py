@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+from database import db
+
+class DeviceToken(db.Model):
+    """
+    An FCM registration token for one device of a user or advertiser. A
+    principal can have several (phone, tablet, web); a token belongs to
+    whoever registered it last, so signing in as someone else on the same
+    device moves it instead of notifying both accounts.
+    """
+    __tablename__ = 'device_tokens'
+
+    MAX_PER_OWNER = 10
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_type = db.Column(db.String(20), nullable=False)  # 'user' or 'advertiser'
+    owner_id = db.Column(db.Integer, nullable=False)
+    token = db.Column(db.String(512), nullable=False, unique=True)
+    platform = db.Column(db.String(20))  # android, ios, web
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_seen_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_device_token_owner', 'owner_type', 'owner_id'),
+        db.Index('idx_device_token_last_seen', 'last_seen_at'),
+    )
+
+    @classmethod
+    def register(cls, owner_type, owner_id, token, platform=None):
+        """Insert or refresh a token for this owner; keeps at most MAX_PER_OWNER, newest first."""
+        device = cls.query.filter_by(token=token).first()
+        if device is None:
+            device = cls(token=token)
+            db.session.add(device)
+        device.owner_type = owner_type
+        device.owner_id = owner_id
+        device.platform = platform or device.platform
+        device.last_seen_at = datetime.utcnow()
+        db.session.flush()
+
+        stale = cls.query.filter_by(owner_type=owner_type, owner_id=owner_id).order_by(
+            cls.last_seen_at.desc()
+        ).offset(cls.MAX_PER_OWNER).all()
+        for old in stale:
+            db.session.delete(old)
+        return device
+
+    @classmethod
+    def unregister(cls, owner_type, owner_id, token=None):
+        """Remove one of the owner's tokens (logout on a device), or all of them."""
+        query = cls.query.filter_by(owner_type=owner_type, owner_id=owner_id)
+        if token:
+            query = query.filter_by(token=token)
+        return query.delete(synchronize_session=False)
+
+    @classmethod
+    def tokens_for(cls, owners):
+        """{(owner_type, owner_id): [token, ...]} for many owners, one IN query per owner type."""
+        ids_by_type = {}
+        for owner_type, owner_id in owners:
+            ids_by_type.setdefault(owner_type, set()).add(owner_id)
+
+        tokens = {}
+        for owner_type, ids in ids_by_type.items():
+            rows = db.session.query(cls.owner_id, cls.token).filter(
+                cls.owner_type == owner_type,
+                cls.owner_id.in_(ids)
+            ).all()
+            for owner_id, token in rows:
+                tokens.setdefault((owner_type, owner_id), []).append(token)
+        return tokens
+
+    @classmethod
+    def prune(cls, tokens):
+        """Delete tokens FCM reported as no longer registered."""
+        if not tokens:
+            return 0
+        return cls.query.filter(cls.token.in_(list(tokens))).delete(synchronize_session=False)
+
+    @classmethod
+    def prune_stale(cls, days):
+        """Delete tokens whose device has not checked in for ``days`` (FCM expires idle tokens)."""
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        return cls.query.filter(cls.last_seen_at < cutoff).delete(synchronize_session=False)
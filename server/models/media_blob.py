@@ -0,0 +1,60 @@
+from datetime import datetime
+from sqlalchemy import case
+from database import db
+
+class MediaBlob(db.Model):
+    """
+    One stored copy of a piece of media, keyed by the SHA-256 of its bytes.
+    Messages and posts point at blobs via media_blob_id; ref_count tracks how
+    many do, so cleanup only removes blobs nothing references any more.
+    """
+    __tablename__ = 'media_blobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    storage = db.Column(db.String(20), nullable=False)  # 'local' (utils.storage backend) or 'cloudinary'
+    category = db.Column(db.String(20))
+    extension = db.Column(db.String(10))
+    path = db.Column(db.String(500))  # storage key, or Cloudinary public_id
+    url = db.Column(db.String(500), nullable=False)
+    thumbnail_url = db.Column(db.String(500))
+    media_metadata = db.Column(db.JSON)
+    size_bytes = db.Column(db.BigInteger)
+    processed = db.Column(db.Boolean, nullable=False, default=False, server_default='0')  # thumbnail/metadata done
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_referenced_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('storage', 'sha256', name='uq_media_blob_hash'),
+        db.Index('idx_media_blob_unreferenced', 'ref_count', 'last_referenced_at'),
+    )
+
+    @classmethod
+    def find(cls, storage, sha256):
+        return cls.query.filter_by(storage=storage, sha256=sha256).first()
+
+    @classmethod
+    def add_ref(cls, blob_id, delta=1):
+        """Atomically adjust ref_count (never below zero) without reading the row first."""
+        if not blob_id:
+            return 0
+        query = cls.query.filter(cls.id == blob_id)
+        if delta < 0:
+            query = query.filter(cls.ref_count >= -delta)
+        return query.update({
+            cls.ref_count: cls.ref_count + delta,
+            cls.last_referenced_at: datetime.utcnow(),
+        }, synchronize_session=False)
+
+    @classmethod
+    def release_refs(cls, counts):
+        """Drop several references per blob in one UPDATE; ``counts`` is {blob_id: n}, floored at zero like add_ref."""
+        counts = {blob_id: n for blob_id, n in counts.items() if blob_id and n}
+        if not counts:
+            return 0
+        delta = case(counts, value=cls.id, else_=0)
+        return cls.query.filter(cls.id.in_(counts)).update({
+            cls.ref_count: case((cls.ref_count > delta, cls.ref_count - delta), else_=0),
+            cls.last_referenced_at: datetime.utcnow(),
+        }, synchronize_session=False)
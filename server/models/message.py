@@ -38,6 +38,12 @@ class Message(db.Model):
     # NEW: Media metadata (duration for audio/video, dimensions for images, file size, etc.)
     media_metadata = db.Column(db.JSON, nullable=True)
     
+    # Content-addressed copy of the media (see models/media_blob.py)
+    media_blob_id = db.Column(db.ForeignKey('media_blobs.id', ondelete='SET NULL'), nullable=True, index=True)
+    
+    # Sender-generated id; a retried send with the same id returns the stored message
+    client_message_id = db.Column(db.String(64), nullable=True)
+    
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(
         db.TIMESTAMP, 
@@ -54,4 +60,5 @@ class Message(db.Model):
         db.Index('idx_message_sender', 'conversation_id', 'sender_id', 'sender_type'),
         db.Index('idx_message_conversation', 'conversation_id', 'created_at'),
         db.Index('idx_message_type', 'message_type'),  # NEW: Index for filtering by type
+        db.UniqueConstraint('conversation_id', 'sender_type', 'sender_id', 'client_message_id', name='uq_message_client_id'),
     )
\ No newline at end of file
@@ -11,5 +11,6 @@ class PostLike(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('post_id', 'user_id', name='uq_post_like_post_user'),
+        db.Index('idx_post_like_post_created', 'post_id', 'created_at', 'id'),
     )
 
@@ -3,11 +3,56 @@ from uuid import UUID
 import uuid
 from database import db
 
+STATUS_PROCESSING = 'processing'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+
+
 class Post(db.Model):
     __tablename__ = 'posts'
     id = db.Column(db.Integer,primary_key=True)
     advertiser_id = db.Column(db.ForeignKey('advertisers.id', ondelete='CASCADE'), nullable=False)
     image_url = db.Column(db.Text)  # Changed from image_id to image_url
     caption = db.Column(db.Text)
+    # Image ingestion state: 'processing' until the background upload lands, then 'ready' or 'failed'
+    status = db.Column(db.String(20), nullable=False, default=STATUS_READY, server_default=STATUS_READY)
+    processing_error = db.Column(db.Text, nullable=True)
+    # Content-addressed Cloudinary upload backing image_url (see models/media_blob.py)
+    media_blob_id = db.Column(db.ForeignKey('media_blobs.id', ondelete='SET NULL'), nullable=True, index=True)
+    # Denormalized engagement counters, kept current with atomic SQL increments
+    # and repaired by tasks/engagement_counters.py
+    likes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comments_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp())
-    updated_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
\ No newline at end of file
+    updated_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    # Keyset pagination indexes for the feed and per-advertiser listings
+    __table_args__ = (
+        db.Index('idx_post_created', 'created_at', 'id'),
+        db.Index('idx_post_advertiser_created', 'advertiser_id', 'created_at', 'id'),
+    )
+
+    @classmethod
+    def increment_counter(cls, post_id, column, delta=1):
+        """Atomically add delta to a counter column without reading it first (never below zero)."""
+        counter = getattr(cls, column)
+        query = cls.query.filter(cls.id == post_id)
+        if delta < 0:
+            query = query.filter(counter >= -delta)
+        # updated_at is passed through so engagement does not look like an edit
+        return query.update(
+            {counter: counter + delta, cls.updated_at: cls.updated_at},
+            synchronize_session=False
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'advertiser_id': self.advertiser_id,
+            'image_url': self.image_url,
+            'caption': self.caption,
+            'status': self.status,
+            'processing_error': self.processing_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
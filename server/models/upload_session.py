@@ -0,0 +1,50 @@
+from datetime import datetime
+from database import db
+
+class UploadSession(db.Model):
+    """
+    A resumable (chunked) media upload. Bytes are appended to a .part file under
+    uploads/partial; received_bytes is the committed offset the next chunk must
+    start at. Once complete, media_url/media_path point at the assembled file.
+    """
+    __tablename__ = 'upload_sessions'
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, also the .part filename
+    owner_type = db.Column(db.String(20), nullable=False)  # 'user' or 'advertiser'
+    owner_id = db.Column(db.Integer, nullable=False)
+    media_type = db.Column(db.String(20), nullable=False)  # image, video, audio
+    filename = db.Column(db.String(255))
+    extension = db.Column(db.String(10), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    status = db.Column(db.String(20), nullable=False, default='open', server_default='open')  # open, complete, consumed
+    media_url = db.Column(db.String(500))
+    media_path = db.Column(db.String(500))  # storage key
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_upload_session_owner', 'owner_type', 'owner_id'),
+        db.Index('idx_upload_session_expires', 'expires_at'),
+    )
+
+    @classmethod
+    def advance(cls, session_id, offset, written):
+        """Move received_bytes from offset to offset + written, only if nobody else moved it first."""
+        return cls.query.filter(
+            cls.id == session_id,
+            cls.status == 'open',
+            cls.received_bytes == offset
+        ).update({cls.received_bytes: offset + written}, synchronize_session=False)
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'media_type': self.media_type,
+            'filename': self.filename,
+            'total_size': self.total_size,
+            'received_bytes': self.received_bytes,
+            'status': self.status,
+            'media_url': self.media_url,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
@@ -26,6 +26,7 @@ class User(db.Model):
         db.Index('idx_user_gender', 'gender'),
         db.Index('idx_user_active', 'last_active'),
         db.Index('idx_user_password', 'password_hash'),  # Fixed index name
+        db.Index('idx_user_created', 'created_at', 'id'),
     )
     
     def to_dict(self):
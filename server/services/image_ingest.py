@@ -0,0 +1,221 @@
+"""
+Background ingestion of uploaded images (base64 or streamed files) into Cloudinary.
+
+Post creation/update used to upload the image inside the request, so a slow
+or failing Cloudinary call held a worker thread for seconds and surfaced as a
+500. Handlers now persist the post in the ``processing`` state, commit, and
+hand the bytes to this worker. A bounded thread pool performs the upload with
+retries and exponential backoff, then flips the post to ``ready`` (or
+``failed``) and emits a Socket.IO event to the owner's room
+(``advertiser_<id>``):
+
+    post_ready / post_failed      {'post': {...}}
+    image_upload_complete         {'upload_id': ..., 'success': ..., 'image_url': ...}
+
+Concurrency is ``IMAGE_INGEST_WORKERS`` threads with at most
+``IMAGE_INGEST_QUEUE_SIZE`` jobs waiting; beyond that ``submit`` raises
+IngestQueueFull so callers can answer 503 instead of queueing without bound.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 1.0
+
+
+class IngestQueueFull(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class ImageIngestWorker:
+    def __init__(self):
+        self.app = None
+        self.workers = DEFAULT_WORKERS
+        self.queue_size = DEFAULT_QUEUE_SIZE
+        self.retries = DEFAULT_RETRIES
+        self.backoff = DEFAULT_BACKOFF_SECONDS
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.deduplicated = 0
+
+    def init_app(self, app):
+        def setting(name, default, cast=int):
+            return cast(app.config.get(name, os.environ.get(name, default)))
+
+        self.app = app
+        self.workers = max(1, setting('IMAGE_INGEST_WORKERS', DEFAULT_WORKERS))
+        self.queue_size = max(0, setting('IMAGE_INGEST_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+        self.retries = max(1, setting('IMAGE_INGEST_RETRIES', DEFAULT_RETRIES))
+        self.backoff = setting('IMAGE_INGEST_BACKOFF', DEFAULT_BACKOFF_SECONDS, float)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-ingest')
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        app.extensions['image_ingest'] = self
+        logger.info(f"✓ Image ingest worker ready ({self.workers} workers, queue {self.queue_size})")
+
+    # ---------- uploading ----------
+
+    def upload(self, image_data, folder, public_id):
+        """
+        Upload with retries and exponential backoff; returns the last Cloudinary result.
+        ``image_data`` is base64 text or a readable file (e.g. a streamed multipart spool).
+        """
+        from cloudinary_service import get_service as get_cloudinary_service
+
+        service = get_cloudinary_service()
+        is_file = hasattr(image_data, 'read')
+        result = {'success': False, 'error': 'Upload not attempted'}
+        for attempt in range(1, self.retries + 1):
+            if is_file:
+                image_data.seek(0)
+                result = service.upload_image(image_data, folder=folder, public_id=public_id)
+            else:
+                result = service.upload_base64_image(image_data, folder=folder, public_id=public_id)
+            if result['success']:
+                return result
+            if attempt < self.retries:
+                self.retried += 1
+                logger.warning(f"⚠ Image upload attempt {attempt} failed for {public_id}: {result['error']}")
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+        return result
+
+    # ---------- queueing ----------
+
+    def has_capacity(self):
+        return self._executor is None or self.in_flight < self.workers + self.queue_size
+
+    def _submit(self, job, *args):
+        if self._executor is None:
+            # Not initialised (CLI, scripts): run inline
+            try:
+                job(*args)
+            finally:
+                self._close_files(args)
+            return
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise IngestQueueFull('Image processing queue is full')
+        with self._lock:
+            self.in_flight += 1
+        self._executor.submit(self._run, job, args)
+
+    def _run(self, job, args):
+        try:
+            with self.app.app_context():
+                job(*args)
+        except Exception as e:
+            logger.exception(f"Image ingest job failed: {e}")
+        finally:
+            self._close_files(args)
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    @staticmethod
+    def _close_files(args):
+        # Spooled uploads handed over by the request are closed once the job is done
+        for arg in args:
+            if hasattr(arg, 'read') and hasattr(arg, 'close'):
+                arg.close()
+
+    def _emit(self, event, payload, advertiser_id):
+        socketio = self.app.extensions.get('socketio') if self.app else None
+        if socketio:
+            try:
+                socketio.emit(event, payload, room=f"advertiser_{advertiser_id}")
+            except Exception as e:
+                logger.warning(f"Failed to emit {event}: {e}")
+
+    # ---------- jobs ----------
+
+    def ingest_post_image(self, post_id, image_data, public_id):
+        """Queue the image for a post that was committed in the processing state."""
+        self._submit(self._process_post_image, post_id, image_data, public_id)
+
+    def _process_post_image(self, post_id, image_data, public_id):
+        from models.posts import Post, STATUS_READY, STATUS_FAILED
+        from services import media_store
+
+        # Identical bytes were uploaded before: reuse that Cloudinary image instead of re-sending it
+        sha256 = media_store.image_sha256(image_data)
+        blob = media_store.find_cloudinary_blob(sha256)
+        if blob is not None:
+            self.deduplicated += 1
+            result = {'success': True, 'secure_url': blob.url, 'public_id': blob.path}
+        else:
+            result = self.upload(image_data, 'vpg/posts', public_id)
+            if result['success']:
+                blob = media_store.record_cloudinary_upload(sha256, result)
+
+        post = db.session.get(Post, post_id)
+        if post is None:
+            logger.info(f"Post {post_id} was deleted before its image finished uploading")
+            db.session.commit()
+            return
+
+        if result['success']:
+            post.image_url = result['secure_url']
+            post.status = STATUS_READY
+            post.processing_error = None
+            media_store.swap_reference(post.media_blob_id, blob.id if blob else None)
+            post.media_blob_id = blob.id if blob else None
+            self.succeeded += 1
+        else:
+            # A failed replacement keeps the previous image_url, so the post stays visible
+            post.status = STATUS_FAILED
+            post.processing_error = str(result.get('error'))[:1000]
+            self.failed += 1
+        db.session.commit()
+
+        event = 'post_ready' if result['success'] else 'post_failed'
+        self._emit(event, {'post': post.to_dict()}, post.advertiser_id)
+
+    def ingest_image(self, advertiser_id, image_data, folder, public_id):
+        """Queue a standalone image upload; returns the upload_id echoed in image_upload_complete."""
+        upload_id = uuid.uuid4().hex
+        self._submit(self._process_image, upload_id, advertiser_id, image_data, folder, public_id)
+        return upload_id
+
+    def _process_image(self, upload_id, advertiser_id, image_data, folder, public_id):
+        result = self.upload(image_data, folder, public_id)
+        if result['success']:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self._emit('image_upload_complete', {
+            'upload_id': upload_id,
+            'success': result['success'],
+            'image_url': result.get('secure_url'),
+            'public_id': result.get('public_id'),
+            'error': result.get('error'),
+        }, advertiser_id)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'in_flight': self.in_flight,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'retried': self.retried,
+            'rejected': self.rejected,
+            'deduplicated': self.deduplicated,
+        }
+
+
+image_ingest = ImageIngestWorker()
@@ -0,0 +1,125 @@
+# services/inbox_service.py - Constant-query inbox loading
+"""
+Builds a page of a participant's inbox for /messages/recent and /conversations.
+
+A page is assembled in a fixed number of round trips regardless of its size:
+  1. the conversations, joined to their last message through last_message_id
+     (unread counts and read marks come from the caller's participant row)
+  2. the other participants of every conversation on the page
+  3. the users and advertisers those rows reference, through the request's
+     identity loader (one IN query per type, reused by the serializers)
+"""
+from datetime import datetime
+from sqlalchemy import case
+from database import db
+from models import Conversation, ConversationParticipant, Message, Advertiser
+from utils.pagination import paginate
+from utils.identity_loader import get_identity_loader, identity_key
+
+# Conversations without messages sort first, matching the previous MySQL NULL handling
+NULL_LAST_MESSAGE_AT = datetime(9999, 12, 31)
+
+
+def participant_type_of(principal):
+    return 'advertiser' if isinstance(principal, Advertiser) else 'user'
+
+
+def normalize_sender_type(sender_type):
+    return identity_key(sender_type, None)[0]
+
+
+def read_marks_for(conversation_id, principal):
+    """
+    (me, my_last_read_id, others_last_read_id) for deriving per-message is_read:
+    my messages are read once the other side's mark passes them, theirs once mine does.
+    """
+    me = (participant_type_of(principal), principal.id)
+    marks = ConversationParticipant.read_marks(conversation_id)
+    others_read = max((read for key, (read, _) in marks.items() if key != me), default=0)
+    return me, marks.get(me, (0, 0))[0], others_read
+
+
+def is_read_for(message, read_marks):
+    me, my_read, others_read = read_marks
+    sent_by_me = (normalize_sender_type(message.sender_type), message.sender_id) == me
+    return message.id <= (others_read if sent_by_me else my_read)
+
+
+def load_inbox(principal, default_per_page=20):
+    """
+    Load one page of the inbox for the authenticated user or advertiser.
+
+    Returns (entries, meta). Each entry is a dict with ``conversation``,
+    ``last_message`` (Message or None), ``participant`` (the other side, or
+    None), ``participant_type``, ``unread_count``, ``read_marks`` (see
+    read_marks_for). Every sender on the page is already in the request's
+    identity loader, so building sender blocks costs no further queries.
+    """
+    participant_type = participant_type_of(principal)
+    participant_id = principal.id
+
+    sort_key = case(
+        (Conversation.last_message_at.is_(None), NULL_LAST_MESSAGE_AT),
+        else_=Conversation.last_message_at
+    )
+    query = db.session.query(Conversation, Message, ConversationParticipant).join(
+        ConversationParticipant,
+        ConversationParticipant.conversation_id == Conversation.id
+    ).outerjoin(
+        Message, Message.id == Conversation.last_message_id
+    ).filter(
+        ConversationParticipant.participant_type == participant_type,
+        ConversationParticipant.participant_id == participant_id
+    )
+
+    rows, meta = paginate(
+        query,
+        [(sort_key, 'desc'), (Conversation.id, 'desc')],
+        key=lambda row: (row[0].last_message_at or NULL_LAST_MESSAGE_AT, row[0].id),
+        default_per_page=default_per_page
+    )
+
+    conversation_ids = [conv.id for conv, _, _ in rows]
+
+    others = {}
+    others_read = {}
+    if conversation_ids:
+        for p in ConversationParticipant.query.filter(
+            ConversationParticipant.conversation_id.in_(conversation_ids),
+            db.not_(
+                db.and_(
+                    ConversationParticipant.participant_type == participant_type,
+                    ConversationParticipant.participant_id == participant_id
+                )
+            )
+        ).order_by(ConversationParticipant.id.asc()).all():
+            others.setdefault(p.conversation_id, []).append((p.participant_type, p.participant_id))
+            others_read[p.conversation_id] = max(others_read.get(p.conversation_id, 0), p.last_read_message_id or 0)
+
+    wanted = {key for keys in others.values() for key in keys}
+    for _, message, _ in rows:
+        if message is not None:
+            wanted.add((normalize_sender_type(message.sender_type), message.sender_id))
+    loader = get_identity_loader()
+    loader.prime(principal)
+    senders = loader.get_many(wanted)
+
+    entries = []
+    me = (participant_type, participant_id)
+    for conv, message, mine in rows:
+        participant = None
+        other_type = None
+        for key in others.get(conv.id, []):
+            if key in senders:
+                other_type = key[0]
+                participant = senders[key]
+                break
+        entries.append({
+            'conversation': conv,
+            'last_message': message,
+            'participant': participant,
+            'participant_type': other_type,
+            'unread_count': mine.unread_count or 0,
+            'read_marks': (me, mine.last_read_message_id or 0, others_read.get(conv.id, 0)),
+        })
+    return entries, meta
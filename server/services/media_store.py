@@ -0,0 +1,174 @@
+"""
+Content-addressed media storage.
+
+Uploads are hashed (SHA-256) while they are streamed to staging and stored
+under the key ``<category>/<aa>/<bb>/<sha256>.<ext>`` in the media storage
+backend (utils.storage), with one MediaBlob row per distinct
+content. A forwarded or re-sent file therefore hits an existing blob: the
+write is skipped and, once the first copy has been processed, so are the
+thumbnail, variants and ffprobe run; its stored metadata is reused.
+
+Post images get the same treatment on the Cloudinary side: identical bytes
+reuse the existing upload instead of sending the image again.
+
+Referencing rows (messages, posts) hold media_blob_id and bump
+MediaBlob.ref_count; tasks/media_blobs.py removes blobs whose count has been
+zero for a grace period.
+"""
+import base64
+import hashlib
+import logging
+import os
+
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models.media_blob import MediaBlob
+from utils.media_utils import (
+    ensure_media_dirs, validate_file, get_media_category, hash_stream_to_file, hash_file
+)
+from utils.storage import get_storage, media_key, media_url, staging_path
+
+logger = logging.getLogger(__name__)
+
+LOCAL = 'local'
+CLOUDINARY = 'cloudinary'
+
+
+def _saved_from_blob(blob, deduplicated):
+    """Same shape as media_utils.save_media_file, plus blob details."""
+    saved = {
+        'url': blob.url,
+        'key': blob.path,
+        'category': blob.category,
+        'size_bytes': blob.size_bytes,
+        'metadata': {
+            'size_bytes': blob.size_bytes,
+            'size_mb': round((blob.size_bytes or 0) / (1024 * 1024), 2)
+        },
+        'blob_id': blob.id,
+        'processed': bool(blob.processed),
+        'thumbnail_url': blob.thumbnail_url,
+        'deduplicated': deduplicated,
+    }
+    if blob.processed and blob.media_metadata is not None:
+        saved['metadata'] = blob.media_metadata
+    return saved
+
+
+def _get_or_create(storage, sha256, **fields):
+    """Insert a blob, or return the row a concurrent request inserted first."""
+    try:
+        with db.session.begin_nested():
+            blob = MediaBlob(storage=storage, sha256=sha256, **fields)
+            db.session.add(blob)
+        return blob, True
+    except IntegrityError:
+        return MediaBlob.find(storage, sha256), False
+
+
+def _adopt_local_file(tmp_path, sha256, size, extension):
+    storage = get_storage()
+    blob = MediaBlob.find(LOCAL, sha256)
+    if blob and blob.path and storage.exists(blob.path):
+        os.remove(tmp_path)
+        print(f"[MediaStore] Reusing stored blob {sha256[:12]} ({blob.url})")
+        return _saved_from_blob(blob, deduplicated=True)
+
+    category = get_media_category(extension)
+    key = media_key(category, f"{sha256}.{extension}")
+    storage.put_file(tmp_path, key)
+    url = media_url(key)
+
+    if blob:
+        # Row survived but the file was lost: restore it and reprocess
+        blob.path, blob.url, blob.processed = key, url, False
+    else:
+        blob, _ = _get_or_create(
+            LOCAL, sha256, category=category, extension=extension,
+            path=key, url=url, size_bytes=size
+        )
+    # The file is in storage now: commit its row so that, whatever happens to the
+    # caller's transaction, tasks/media_blobs.py can still find and reclaim it
+    db.session.commit()
+    print(f"[MediaStore] Stored blob {sha256[:12]}: {key}")
+    return _saved_from_blob(blob, deduplicated=False)
+
+
+def store_upload(file_storage, message_type=None):
+    """
+    Validate, hash-while-writing and store an uploaded FileStorage.
+    Drop-in for media_utils.save_media_file that also returns blob_id and
+    whether the blob was already processed (thumbnail_url/metadata reusable).
+    """
+    ensure_media_dirs()
+    meta = validate_file(file_storage, expected_type=message_type)
+    tmp_path = staging_path()
+    try:
+        sha256, size = hash_stream_to_file(file_storage.stream, tmp_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return _adopt_local_file(tmp_path, sha256, size, meta['extension'])
+
+
+def store_file(path, extension):
+    """Adopt a file already on disk (e.g. an assembled resumable upload) into the store."""
+    sha256, size = hash_file(path)
+    return _adopt_local_file(path, sha256, size, extension)
+
+
+def stored_media_for_key(key):
+    """save_media_file-shaped dict for a file already in the store, or None."""
+    blob = MediaBlob.query.filter_by(storage=LOCAL, path=key).first()
+    return _saved_from_blob(blob, deduplicated=True) if blob else None
+
+
+def record_processed(blob_id, thumbnail_url, metadata):
+    """Remember a blob's thumbnail/metadata so later duplicates skip processing."""
+    if not blob_id:
+        return
+    MediaBlob.query.filter(MediaBlob.id == blob_id).update({
+        MediaBlob.thumbnail_url: thumbnail_url,
+        MediaBlob.media_metadata: metadata,
+        MediaBlob.processed: True,
+    }, synchronize_session=False)
+
+
+# ========== CLOUDINARY ==========
+
+def image_sha256(image_data):
+    """SHA-256 of an image given as base64 / data URL text or a readable file."""
+    digest = hashlib.sha256()
+    if hasattr(image_data, 'read'):
+        image_data.seek(0)
+        for block in iter(lambda: image_data.read(1024 * 1024), b''):
+            digest.update(block)
+        image_data.seek(0)
+    else:
+        encoded = image_data.split(',', 1)[1] if image_data.startswith('data:') else image_data
+        digest.update(base64.b64decode(encoded))
+    return digest.hexdigest()
+
+
+def find_cloudinary_blob(sha256):
+    return MediaBlob.find(CLOUDINARY, sha256)
+
+
+def record_cloudinary_upload(sha256, result):
+    blob, _ = _get_or_create(
+        CLOUDINARY, sha256, category='image', extension=result.get('format'),
+        path=result['public_id'], url=result['secure_url'], size_bytes=result.get('bytes'),
+        media_metadata={'width': result.get('width'), 'height': result.get('height'), 'format': result.get('format')},
+        processed=True
+    )
+    return blob
+
+
+def swap_reference(old_blob_id, new_blob_id):
+    """Move one reference from old_blob_id to new_blob_id (either may be None)."""
+    if old_blob_id == new_blob_id:
+        return
+    MediaBlob.add_ref(new_blob_id, 1)
+    MediaBlob.add_ref(old_blob_id, -1)
@@ -0,0 +1,131 @@
+"""
+Process-pool workers for message attachment processing.
+
+Pillow thumbnailing, ffprobe metadata and the ffmpeg frame grab (up to 15s)
+used to run inside MessageList.post. The request now only saves the file and
+creates the message with ``thumbnail_url = None``; utils.media_utils
+.process_media_file then runs in a separate process, and when it finishes the
+message's thumbnail_url / media_metadata are written back and
+``message_updated`` is broadcast to the ``conv_<id>`` room.
+
+The pool has ``MEDIA_WORKERS`` processes and accepts at most
+``MEDIA_QUEUE_SIZE`` waiting jobs; ``ensure_capacity`` raises MediaQueueFull
+beyond that so the API can answer 503 before accepting more uploads.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from database import db
+from utils.media_utils import process_media_file
+from services.media_store import record_processed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 32
+
+
+class MediaQueueFull(Exception):
+    """Raised when every media worker is busy and the wait queue is full."""
+
+
+class MediaProcessingPool:
+    def __init__(self):
+        self.app = None
+        self.workers = DEFAULT_WORKERS
+        self.queue_size = DEFAULT_QUEUE_SIZE
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = max(1, int(app.config.get('MEDIA_WORKERS', os.environ.get('MEDIA_WORKERS', DEFAULT_WORKERS))))
+        self.queue_size = max(0, int(app.config.get('MEDIA_QUEUE_SIZE', os.environ.get('MEDIA_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))))
+        # spawn: worker processes must not inherit the server's threads, sockets or DB connections
+        context = multiprocessing.get_context(os.environ.get('MEDIA_WORKER_START_METHOD', 'spawn'))
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        app.extensions['media_pool'] = self
+        logger.info(f"✓ Media processing pool ready ({self.workers} workers, queue {self.queue_size})")
+
+    def ensure_capacity(self):
+        if self._executor is not None and self.in_flight >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise MediaQueueFull('Media processing queue is full')
+
+    def process_message_media(self, message_id, saved):
+        """
+        Queue thumbnail/metadata work for a committed message. ``saved`` is the
+        dict returned by media_utils.save_media_file.
+        """
+        args = (saved['key'], saved['category'], saved['size_bytes'])
+        if self._executor is None:
+            # Not initialised (CLI, scripts): process inline
+            self._apply(message_id, process_media_file(*args))
+            return
+
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise MediaQueueFull('Media processing queue is full')
+        with self._lock:
+            self.in_flight += 1
+        future = self._executor.submit(process_media_file, *args)
+        future.add_done_callback(lambda f: self._on_done(message_id, f))
+
+    def _on_done(self, message_id, future):
+        try:
+            result = future.result()
+            with self.app.app_context():
+                self._apply(message_id, result)
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.exception(f"Media processing failed for message {message_id}: {e}")
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def _apply(self, message_id, result):
+        from models import Message
+        # Imported late: the API module imports this service
+        from apis.message_api import _build_message_dict
+
+        message = db.session.get(Message, message_id)
+        if message is None:
+            logger.info(f"Message {message_id} was deleted before its media finished processing")
+            return
+        message.thumbnail_url = result.get('thumbnail_url')
+        message.media_metadata = result.get('metadata')
+        # Later uploads of the same bytes reuse this instead of reprocessing
+        record_processed(message.media_blob_id, message.thumbnail_url, message.media_metadata)
+        db.session.commit()
+
+        socketio = self.app.extensions.get('socketio') if self.app else None
+        if socketio:
+            try:
+                socketio.emit('message_updated', _build_message_dict(message, include_sender=True),
+                              room=f"conv_{message.conversation_id}")
+            except Exception as e:
+                logger.warning(f"Failed to emit message_updated for {message_id}: {e}")
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
+
+
+media_pool = MediaProcessingPool()
@@ -0,0 +1,233 @@
+"""
+Presence tracking driven by Socket.IO connections.
+
+``Advertiser.is_online`` used to be whatever the client last PUT, so it went
+stale as soon as an app was killed. Presence is now derived from live
+sockets: a principal is online while it has at least one authenticated
+connection that connected or sent ``heartbeat`` within ``PRESENCE_TTL``
+seconds. Connections that die without a disconnect simply age out.
+
+State is held in memory per process. With ``PRESENCE_REDIS_URL`` (or
+``REDIS_URL``) set, each node also records its online principals in Redis,
+one hash per principal (``presence:<type>:<id>``, field = node id, value =
+last seen), so any node can answer for principals connected elsewhere. A
+node removes its field when the principal's last local socket closes, and
+the fields of a node that died stop counting after the TTL.
+
+``online_ids`` answers "which of these ids are online" in one call (one
+pipeline round trip with Redis). ``last_active`` / ``is_online`` in the
+database are written by ``flush`` in batched UPDATEs (tasks/presence.py
+runs it every ``PRESENCE_FLUSH_SECONDS``) rather than once per event.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 90
+REDIS_KEY_PREFIX = 'presence:'
+
+
+class PresenceTracker:
+    def __init__(self):
+        self.app = None
+        self.ttl = DEFAULT_TTL_SECONDS
+        self._redis = None
+        self.node_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._sids = {}          # sid -> (participant_type, id)
+        self._connections = {}   # (participant_type, id) -> {sid, ...}
+        self._last_seen = {}     # (participant_type, id) -> epoch seconds
+        self._dirty = {}         # (participant_type, id) -> online flag to write on the next flush
+        self.flushed = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = int(app.config.get('PRESENCE_TTL', os.environ.get('PRESENCE_TTL', DEFAULT_TTL_SECONDS)))
+        redis_url = app.config.get('PRESENCE_REDIS_URL') or os.environ.get('PRESENCE_REDIS_URL') or os.environ.get('REDIS_URL')
+        if redis_url and REDIS_AVAILABLE:
+            try:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=1)
+                self._redis.ping()
+            except Exception as e:
+                logger.warning(f"⚠ Presence falling back to in-process only, Redis unavailable: {e}")
+                self._redis = None
+        app.extensions['presence'] = self
+        logger.info(f"✓ Presence tracker ready (ttl {self.ttl}s, {'redis' if self._redis else 'in-process'})")
+
+    # ---------- socket events ----------
+
+    def connect(self, sid, participant_type, participant_id):
+        key = (participant_type, participant_id)
+        now = time.time()
+        with self._lock:
+            self._sids[sid] = key
+            sids = self._connections.setdefault(key, set())
+            if not sids:
+                self._dirty[key] = True
+            sids.add(sid)
+            self._last_seen[key] = now
+        self._publish({key: now})
+
+    def heartbeat(self, sid):
+        with self._lock:
+            key = self._sids.get(sid)
+            if key is None:
+                return False
+            self._last_seen[key] = time.time()
+            if key not in self._dirty:
+                # Refresh last_active on the next flush
+                self._dirty[key] = True
+        return True
+
+    def disconnect(self, sid):
+        with self._lock:
+            key = self._sids.pop(sid, None)
+            if key is None:
+                return
+            sids = self._connections.get(key, set())
+            sids.discard(sid)
+            if sids:
+                return
+            self._connections.pop(key, None)
+            self._last_seen.pop(key, None)
+            self._dirty[key] = False
+        self._retract([key])
+
+    # ---------- lookups ----------
+
+    def _locally_online(self, key, now):
+        return bool(self._connections.get(key)) and now - self._last_seen.get(key, 0) <= self.ttl
+
+    def online_ids(self, participant_type, ids):
+        """Subset of ``ids`` that are online, in one call."""
+        ids = list(dict.fromkeys(ids))
+        now = time.time()
+        with self._lock:
+            online = {i for i in ids if self._locally_online((participant_type, i), now)}
+        remaining = [i for i in ids if i not in online]
+        if self._redis is not None and remaining:
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                for i in remaining:
+                    pipe.hvals(self._redis_key((participant_type, i)))
+                for i, seen in zip(remaining, pipe.execute()):
+                    if any(now - float(v) <= self.ttl for v in seen):
+                        online.add(i)
+            except Exception as e:
+                logger.warning(f"⚠ Presence lookup in Redis failed: {e}")
+        return online
+
+    def is_online(self, participant_type, participant_id):
+        return participant_id in self.online_ids(participant_type, [participant_id])
+
+    # ---------- shared backend / database ----------
+
+    @staticmethod
+    def _redis_key(key):
+        return f"{REDIS_KEY_PREFIX}{key[0]}:{key[1]}"
+
+    def _publish(self, seen):
+        """Record {key: last seen} for this node."""
+        if self._redis is None or not seen:
+            return
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for key, last_seen in seen.items():
+                pipe.hset(self._redis_key(key), self.node_id, last_seen)
+                pipe.expire(self._redis_key(key), self.ttl * 2)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠ Presence publish to Redis failed: {e}")
+
+    def _retract(self, keys):
+        if self._redis is None or not keys:
+            return
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.hdel(self._redis_key(key), self.node_id)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠ Presence retract in Redis failed: {e}")
+
+    def flush(self):
+        """
+        Expire silent connections, refresh this node's entries in Redis, write
+        pending is_online / last_active changes in batched UPDATEs and clear
+        is_online flags nobody has refreshed for two TTLs.
+        Must run inside an app context.
+        """
+        from database import db
+        from models import Advertiser, User
+
+        now = time.time()
+        with self._lock:
+            expired = [k for k in self._connections if now - self._last_seen.get(k, 0) > self.ttl]
+            for key in expired:
+                for sid in self._connections.pop(key):
+                    self._sids.pop(sid, None)
+                self._last_seen.pop(key, None)
+                self._dirty[key] = False
+            live = {key: self._last_seen[key] for key in self._connections}
+            dirty, self._dirty = self._dirty, {}
+
+        self._retract(expired)
+        self._publish(live)
+
+        stamp = datetime.utcnow()
+        # Live connections refresh last_active on every flush, so a set flag with an old
+        # last_active is left over from a dead node (or from when clients could write it)
+        stale = Advertiser.query.filter(
+            Advertiser.is_online == True,
+            db.or_(Advertiser.last_active.is_(None), Advertiser.last_active < stamp - timedelta(seconds=self.ttl * 2))
+        ).update({Advertiser.is_online: False}, synchronize_session=False)
+        if not dirty:
+            if stale:
+                db.session.commit()
+            return 0
+
+        groups = {}
+        for (participant_type, participant_id), online in dirty.items():
+            groups.setdefault((participant_type, online), []).append(participant_id)
+        for (participant_type, online), ids in groups.items():
+            if participant_type == 'advertiser':
+                Advertiser.query.filter(Advertiser.id.in_(ids)).update(
+                    {Advertiser.last_active: stamp}, synchronize_session=False
+                )
+                if not online:
+                    # Still connected through another node: leave the flag alone
+                    ids = [i for i in ids if i not in self.online_ids('advertiser', ids)]
+                if ids:
+                    Advertiser.query.filter(Advertiser.id.in_(ids)).update(
+                        {Advertiser.is_online: online}, synchronize_session=False
+                    )
+            else:
+                User.query.filter(User.id.in_(ids)).update({User.last_active: stamp}, synchronize_session=False)
+        db.session.commit()
+
+        self.flushed += len(dirty)
+        return len(dirty)
+
+    def stats(self):
+        return {
+            'backend': 'redis' if self._redis else 'in-process',
+            'ttl': self.ttl,
+            'connections': len(self._sids),
+            'online': len(self._connections),
+            'pending_flush': len(self._dirty),
+            'flushed': self.flushed,
+        }
+
+
+presence = PresenceTracker()
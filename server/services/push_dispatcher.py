@@ -0,0 +1,213 @@
+"""
+Background dispatcher for new-message push notifications.
+
+MessageList.post used to load every recipient and call FCM once per device
+before returning, so a slow FCM round trip was added to every send. The
+request now only calls ``notify_new_message``; a single dispatcher thread
+does the rest:
+
+* Coalescing - messages from one sender in one conversation that arrive
+  within ``PUSH_COALESCE_SECONDS`` of the first are folded into a single
+  notification ("3 new messages"), sent when that window closes.
+* Batching - recipients' device tokens (models.DeviceToken, every device
+  of every recipient) are loaded with one IN query per owner type and sent
+  with ``send_notification_to_multiple`` in multicast chunks of up to 500.
+  Tokens FCM reports as unregistered are deleted, so fan-out only pays for
+  live devices.
+* Bounded - at most ``PUSH_QUEUE_SIZE`` notifications wait at once; beyond
+  that new ones are dropped (and counted) rather than queued without bound.
+
+``stats()`` (exposed on /health) records what was queued, coalesced, sent
+and delivered.
+"""
+import logging
+import os
+import threading
+import time
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COALESCE_SECONDS = 2.0
+DEFAULT_QUEUE_SIZE = 1000
+
+
+class PushDispatcher:
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.coalesce_seconds = DEFAULT_COALESCE_SECONDS
+        self.queue_size = DEFAULT_QUEUE_SIZE
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self.queued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.notifications = 0
+        self.multicasts = 0
+        self.tokens = 0
+        self.delivered = 0
+        self.undelivered = 0
+        self.pruned = 0
+        self.errors = 0
+        self.last_delay_ms = None
+
+    def init_app(self, app):
+        from apis.notification_utils import initialize_firebase
+
+        self.app = app
+        self.coalesce_seconds = float(app.config.get('PUSH_COALESCE_SECONDS', os.environ.get('PUSH_COALESCE_SECONDS', DEFAULT_COALESCE_SECONDS)))
+        self.queue_size = max(1, int(app.config.get('PUSH_QUEUE_SIZE', os.environ.get('PUSH_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))))
+        app.extensions['push_dispatcher'] = self
+
+        self.enabled = initialize_firebase()
+        if not self.enabled:
+            logger.warning("⚠ Push dispatcher disabled: Firebase is not configured")
+            return
+        self._thread = threading.Thread(target=self._loop, name='push-dispatcher', daemon=True)
+        self._thread.start()
+        logger.info(f"✓ Push dispatcher ready (coalesce {self.coalesce_seconds}s, queue {self.queue_size})")
+
+    # ---------- producer (request thread) ----------
+
+    def notify_new_message(self, conversation_id, sender_type, sender_id, sender_name, preview, sender_avatar=None):
+        """Queue a push for a committed message; returns immediately."""
+        if not self.enabled:
+            return
+        key = (conversation_id, sender_type, sender_id)
+        now = time.monotonic()
+        with self._cond:
+            entry = self._pending.get(key)
+            if entry is not None:
+                # Same sender, same conversation, still inside the window: fold it in
+                entry['count'] += 1
+                entry['preview'] = preview
+                entry['sender_name'] = sender_name
+                self.coalesced += 1
+                return
+            if len(self._pending) >= self.queue_size:
+                self.dropped += 1
+                return
+            self._pending[key] = {
+                'conversation_id': conversation_id,
+                'sender_type': sender_type,
+                'sender_id': sender_id,
+                'sender_name': sender_name,
+                'sender_avatar': sender_avatar,
+                'preview': preview,
+                'count': 1,
+                'queued_at': now,
+                'due': now + self.coalesce_seconds,
+            }
+            self.queued += 1
+            self._cond.notify()
+
+    # ---------- consumer (dispatcher thread) ----------
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                next_due = min(entry['due'] for entry in self._pending.values())
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                now = time.monotonic()
+                due = [key for key, entry in self._pending.items() if entry['due'] <= now]
+                batch = [self._pending.pop(key) for key in due]
+
+            try:
+                with self.app.app_context():
+                    self._dispatch(batch)
+            except Exception as e:
+                self.errors += 1
+                logger.exception(f"Push dispatch failed for {len(batch)} notifications: {e}")
+
+    def _recipient_tokens(self, batch):
+        """Participants of the batch's conversations ({conversation_id: [key, ...]}) and {key: [token, ...]}."""
+        from models import ConversationParticipant, DeviceToken
+        from utils.identity_loader import identity_key
+
+        conversation_ids = {entry['conversation_id'] for entry in batch}
+        participants = db.session.query(
+            ConversationParticipant.conversation_id,
+            ConversationParticipant.participant_type,
+            ConversationParticipant.participant_id
+        ).filter(ConversationParticipant.conversation_id.in_(conversation_ids)).all()
+
+        by_conversation = {}
+        for conversation_id, participant_type, participant_id in participants:
+            by_conversation.setdefault(conversation_id, []).append(identity_key(participant_type, participant_id))
+        owners = {key for keys in by_conversation.values() for key in keys}
+        return by_conversation, DeviceToken.tokens_for(owners)
+
+    def _dispatch(self, batch):
+        from apis.notification_utils import send_notification_to_multiple, MULTICAST_MAX_TOKENS
+        from models import DeviceToken
+        from utils.identity_loader import identity_key
+
+        by_conversation, tokens = self._recipient_tokens(batch)
+        invalid = set()
+        for entry in batch:
+            sender = identity_key(entry['sender_type'], entry['sender_id'])
+            recipient_tokens = [
+                token
+                for key in by_conversation.get(entry['conversation_id'], [])
+                if key != sender
+                for token in tokens.get(key, [])
+                if token not in invalid
+            ]
+            if not recipient_tokens:
+                continue
+
+            count = entry['count']
+            body = entry['preview'] if count == 1 else f"{count} new messages"
+            self.notifications += 1
+            for start in range(0, len(recipient_tokens), MULTICAST_MAX_TOKENS):
+                chunk = recipient_tokens[start:start + MULTICAST_MAX_TOKENS]
+                result = send_notification_to_multiple(
+                    fcm_tokens=chunk,
+                    sender_name=entry['sender_name'],
+                    message_content=body,
+                    conversation_id=entry['conversation_id'],
+                    sender_id=entry['sender_id'],
+                    sender_type=entry['sender_type'],
+                    sender_avatar=entry['sender_avatar'],
+                    message_count=count
+                )
+                self.multicasts += 1
+                self.tokens += len(chunk)
+                self.delivered += result['success_count']
+                self.undelivered += result['failure_count']
+                invalid.update(result.get('invalid_tokens', []))
+            self.last_delay_ms = round((time.monotonic() - entry['queued_at']) * 1000)
+
+        if invalid:
+            self.pruned += DeviceToken.prune(invalid)
+            db.session.commit()
+            logger.info(f"✓ Pruned {len(invalid)} unregistered device tokens")
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'coalesce_seconds': self.coalesce_seconds,
+            'pending': len(self._pending),
+            'queued': self.queued,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'notifications': self.notifications,
+            'multicasts': self.multicasts,
+            'tokens': self.tokens,
+            'delivered': self.delivered,
+            'undelivered': self.undelivered,
+            'pruned': self.pruned,
+            'errors': self.errors,
+            'last_delay_ms': self.last_delay_ms,
+        }
+
+
+push_dispatcher = PushDispatcher()
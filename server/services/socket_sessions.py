@@ -0,0 +1,200 @@
+"""
+Per-socket identity and conversation membership.
+
+HTTP requests re-decode the JWT and re-query ConversationParticipant on
+every call. A socket is authenticated once, at ``connect``: ``bind`` records
+which principal a sid belongs to, and later events look it up with
+``principal(sid)`` instead of trusting ids in the payload.
+
+Membership answers come from a per-principal set of conversation ids,
+shared by all of that principal's sockets and loaded with one query the
+first time it is needed, so authorizing join, typing, read and send is an
+in-memory check. A miss still gets one participant lookup (and is
+remembered), so a conversation created through another worker is not
+refused. The cache lives only while the principal has sockets in this
+process.
+
+Creating or deleting a conversation calls ``invalidate`` for its
+participants and their sets are reloaded on next use. With several workers
+a cached positive on another worker must go too: when Redis is reachable
+(the Redis ``SOCKETIO_MESSAGE_QUEUE``, else ``REDIS_URL``) invalidations are
+published on ``SOCKET_SESSIONS_CHANNEL`` and applied by every worker. As a
+backstop, sets are also reloaded once they are older than
+``SOCKET_MEMBERSHIP_TTL`` seconds.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMBERSHIP_TTL = 60
+DEFAULT_CHANNEL = 'vpg-socket-sessions'
+
+
+class SocketSessions:
+    def __init__(self):
+        self.app = None
+        self.ttl = DEFAULT_MEMBERSHIP_TTL
+        self.channel = DEFAULT_CHANNEL
+        self.node_id = uuid.uuid4().hex[:12]
+        self._redis = None
+        self._listener = None
+        self._lock = threading.Lock()
+        self._sids = {}          # sid -> (participant_type, id)
+        self._members = {}       # (participant_type, id) -> {conversation_id, ...}, None until loaded
+        self._loaded_at = {}     # (participant_type, id) -> monotonic time the set was loaded
+        self._refs = {}          # (participant_type, id) -> number of bound sids
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.remote_invalidations = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = float(app.config.get('SOCKET_MEMBERSHIP_TTL', os.environ.get('SOCKET_MEMBERSHIP_TTL', DEFAULT_MEMBERSHIP_TTL)))
+        self.channel = app.config.get('SOCKET_SESSIONS_CHANNEL', os.environ.get('SOCKET_SESSIONS_CHANNEL', DEFAULT_CHANNEL))
+        queue = app.config.get('SOCKETIO_MESSAGE_QUEUE') or ''
+        redis_url = queue if queue.startswith(('redis://', 'rediss://')) else os.environ.get('REDIS_URL')
+        if redis_url and REDIS_AVAILABLE:
+            try:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=1)
+                self._redis.ping()
+                # The subscriber blocks in listen(), so it gets a connection without the read timeout
+                self._listener = threading.Thread(
+                    target=self._listen, args=(redis.Redis.from_url(redis_url),), name='socket-sessions', daemon=True
+                )
+                self._listener.start()
+            except Exception as e:
+                logger.warning(f"⚠ Socket session invalidations stay in-process, Redis unavailable: {e}")
+                self._redis = None
+        app.extensions['socket_sessions'] = self
+        logger.info(f"✓ Socket sessions ready (membership ttl {self.ttl:g}s, {'redis' if self._redis else 'in-process'} invalidation)")
+
+    # ---------- identity ----------
+
+    def bind(self, sid, participant_type, participant_id):
+        key = (participant_type, int(participant_id))
+        with self._lock:
+            if sid in self._sids:
+                self._release(self._sids[sid])
+            self._sids[sid] = key
+            self._refs[key] = self._refs.get(key, 0) + 1
+            self._members.setdefault(key, None)
+        return key
+
+    def principal(self, sid):
+        """(participant_type, id) bound to ``sid``, or None for anonymous sockets."""
+        return self._sids.get(sid)
+
+    def unbind(self, sid):
+        with self._lock:
+            key = self._sids.pop(sid, None)
+            if key is not None:
+                self._release(key)
+
+    def _release(self, key):
+        remaining = self._refs.get(key, 0) - 1
+        if remaining > 0:
+            self._refs[key] = remaining
+        else:
+            self._refs.pop(key, None)
+            self._members.pop(key, None)
+            self._loaded_at.pop(key, None)
+
+    # ---------- membership ----------
+
+    def _load(self, key):
+        from database import db
+        from models import ConversationParticipant
+
+        rows = db.session.query(ConversationParticipant.conversation_id).filter(
+            ConversationParticipant.participant_type == key[0],
+            ConversationParticipant.participant_id == key[1]
+        ).all()
+        self.loads += 1
+        return {conversation_id for (conversation_id,) in rows}
+
+    def is_member(self, key, conversation_id):
+        """Whether ``key`` participates in ``conversation_id``. Must run inside an app context."""
+        from models import ConversationParticipant
+
+        if key not in self._refs:
+            return False
+        members = self._members.get(key)
+        if members is None or time.monotonic() - self._loaded_at.get(key, 0) > self.ttl:
+            members = self._load(key)
+            with self._lock:
+                if key in self._refs:
+                    self._members[key] = members
+                    self._loaded_at[key] = time.monotonic()
+        if conversation_id in members:
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        found = ConversationParticipant.query.filter_by(
+            conversation_id=conversation_id,
+            participant_type=key[0],
+            participant_id=key[1]
+        ).first() is not None
+        if found:
+            with self._lock:
+                members.add(conversation_id)
+        return found
+
+    def invalidate(self, keys):
+        """Reload these principals' membership on next use, on every worker (a conversation was created or deleted)."""
+        keys = [(participant_type, int(participant_id)) for participant_type, participant_id in keys]
+        self._drop(keys)
+        if self._redis is None or not keys:
+            return
+        try:
+            self._redis.publish(self.channel, json.dumps({'node': self.node_id, 'keys': keys}))
+        except Exception as e:
+            logger.warning(f"⚠ Socket session invalidation publish failed: {e}")
+
+    def _drop(self, keys):
+        with self._lock:
+            for key in keys:
+                if key in self._members:
+                    self._members[key] = None
+
+    def _listen(self, client):
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    data = json.loads(message['data'])
+                    if data.get('node') == self.node_id:
+                        continue
+                    self._drop([tuple(key) for key in data.get('keys', [])])
+                    self.remote_invalidations += 1
+            except Exception as e:
+                logger.warning(f"⚠ Socket session invalidation listener error, resubscribing: {e}")
+                time.sleep(1)
+
+    def stats(self):
+        return {
+            'sockets': len(self._sids),
+            'principals': len(self._refs),
+            'membership_ttl': self.ttl,
+            'invalidation': 'redis' if self._redis else 'in-process',
+            'membership_loads': self.loads,
+            'membership_hits': self.hits,
+            'membership_misses': self.misses,
+            'remote_invalidations': self.remote_invalidations,
+        }
+
+
+socket_sessions = SocketSessions()
@@ -0,0 +1,37 @@
+# tasks/device_tokens.py - Drop push tokens of devices that stopped checking in
+import logging
+import os
+from models.device_token import DeviceToken
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# FCM treats tokens idle for ~270 days as expired; the app re-registers its token on every launch
+MAX_IDLE_DAYS = int(os.environ.get('DEVICE_TOKEN_MAX_IDLE_DAYS', 270))
+
+
+def prune_stale_device_tokens(days=MAX_IDLE_DAYS):
+    """Delete device tokens not refreshed within ``days``"""
+    deleted = DeviceToken.prune_stale(days)
+    db.session.commit()
+
+    logger.info(f"✓ Pruned {deleted} stale device tokens")
+    return deleted
+
+
+def register_device_token_jobs(scheduler, app):
+    """Schedule the daily prune on an existing APScheduler instance"""
+    def run():
+        with app.app_context():
+            prune_stale_device_tokens()
+
+    scheduler.add_job(
+        func=run,
+        trigger='cron',
+        hour=4,
+        minute=30,
+        id='device_token_prune',
+        name='Prune stale push device tokens',
+        replace_existing=True
+    )
+    logger.info("✓ Device token prune scheduled")
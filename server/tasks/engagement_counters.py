@@ -0,0 +1,160 @@
+# tasks/engagement_counters.py - Repair drifted denormalized engagement counters
+import logging
+from sqlalchemy import func
+from models.posts import Post
+from models.post_like import PostLike
+from models.comment import Comment
+from models.commentlike import CommentLike
+from database import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+
+# Live counts correlated to the row being updated
+_post_likes_count = (
+    db.select(func.count(PostLike.id)).where(PostLike.post_id == Post.id).scalar_subquery()
+)
+_post_comments_count = (
+    db.select(func.count(Comment.id)).where(
+        Comment.target_type == 'post',
+        Comment.target_id == Post.id,
+        Comment.is_deleted == False
+    ).scalar_subquery()
+)
+_comment_likes_count = (
+    db.select(func.count(CommentLike.id)).where(CommentLike.comment_id == Comment.id).scalar_subquery()
+)
+
+
+def _reconcile_chunk(model, ids, stored, actual_by_column, count_by_column):
+    """
+    Write back the counters that differ from the recomputed values for one chunk of rows.
+
+    The drift check uses the counts read up front, but the write recomputes
+    them with correlated subqueries inside the UPDATE, so a like or comment
+    landing between the read and the write is counted rather than overwritten.
+    """
+    drifted = [
+        row_id for row_id in ids
+        if any((stored[row_id].get(column) or 0) != actual.get(row_id, 0) for column, actual in actual_by_column.items())
+    ]
+    if not drifted:
+        return 0
+    changes = {getattr(model, column): count for column, count in count_by_column.items()}
+    # Keep updated_at untouched; a counter repair is not a content edit
+    changes[model.updated_at] = model.updated_at
+    model.query.filter(model.id.in_(drifted)).update(changes, synchronize_session=False)
+    return len(drifted)
+
+
+def reconcile_post_counters(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Recompute posts.likes_count / posts.comments_count chunk by chunk and fix drifted rows"""
+    last_id = 0
+    scanned = 0
+    fixed = 0
+
+    while True:
+        rows = db.session.query(Post.id, Post.likes_count, Post.comments_count).filter(
+            Post.id > last_id
+        ).order_by(Post.id.asc()).limit(chunk_size).all()
+        if not rows:
+            break
+
+        ids = [r.id for r in rows]
+        stored = {r.id: {'likes_count': r.likes_count, 'comments_count': r.comments_count} for r in rows}
+
+        likes = dict(
+            db.session.query(PostLike.post_id, func.count(PostLike.id))
+            .filter(PostLike.post_id.in_(ids))
+            .group_by(PostLike.post_id)
+            .all()
+        )
+        comments = dict(
+            db.session.query(Comment.target_id, func.count(Comment.id))
+            .filter(
+                Comment.target_type == 'post',
+                Comment.target_id.in_(ids),
+                Comment.is_deleted == False
+            )
+            .group_by(Comment.target_id)
+            .all()
+        )
+
+        fixed += _reconcile_chunk(
+            Post, ids, stored,
+            {'likes_count': likes, 'comments_count': comments},
+            {'likes_count': _post_likes_count, 'comments_count': _post_comments_count}
+        )
+        db.session.commit()
+
+        scanned += len(ids)
+        last_id = ids[-1]
+
+    logger.info(f"✓ Post counters reconciled: {scanned} scanned, {fixed} fixed")
+    return {'scanned': scanned, 'fixed': fixed}
+
+
+def reconcile_comment_counters(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Recompute comments.likes_count chunk by chunk and fix drifted rows"""
+    last_id = 0
+    scanned = 0
+    fixed = 0
+
+    while True:
+        rows = db.session.query(Comment.id, Comment.likes_count).filter(
+            Comment.id > last_id
+        ).order_by(Comment.id.asc()).limit(chunk_size).all()
+        if not rows:
+            break
+
+        ids = [r.id for r in rows]
+        stored = {r.id: {'likes_count': r.likes_count} for r in rows}
+
+        likes = dict(
+            db.session.query(CommentLike.comment_id, func.count(CommentLike.id))
+            .filter(CommentLike.comment_id.in_(ids))
+            .group_by(CommentLike.comment_id)
+            .all()
+        )
+
+        fixed += _reconcile_chunk(Comment, ids, stored, {'likes_count': likes}, {'likes_count': _comment_likes_count})
+        db.session.commit()
+
+        scanned += len(ids)
+        last_id = ids[-1]
+
+    logger.info(f"✓ Comment counters reconciled: {scanned} scanned, {fixed} fixed")
+    return {'scanned': scanned, 'fixed': fixed}
+
+
+def reconcile_all_counters(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Run every counter reconciliation; safe to run while the API is serving traffic"""
+    try:
+        logger.info("=== Running Engagement Counter Reconciliation ===")
+        return {
+            'posts': reconcile_post_counters(chunk_size),
+            'comments': reconcile_comment_counters(chunk_size),
+        }
+    except Exception as e:
+        logger.error(f"Error reconciling engagement counters: {e}")
+        db.session.rollback()
+        return None
+
+
+def register_counter_jobs(scheduler, app):
+    """Schedule the nightly reconciliation on an existing APScheduler instance"""
+    def run():
+        with app.app_context():
+            reconcile_all_counters()
+
+    scheduler.add_job(
+        func=run,
+        trigger='cron',
+        hour=3,
+        minute=30,
+        id='engagement_counter_reconcile',
+        name='Reconcile post/comment engagement counters',
+        replace_existing=True
+    )
+    logger.info("✓ Engagement counter reconciliation scheduled")
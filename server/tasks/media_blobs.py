@@ -0,0 +1,143 @@
+# tasks/media_blobs.py - Garbage-collect unreferenced content-addressed media
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models.media_blob import MediaBlob
+from models.message import Message
+from models.posts import Post
+from utils.storage import get_storage, media_key_for
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Blobs stay this long after their last reference goes, covering uploads whose message/post is still being created
+GRACE_PERIOD = timedelta(hours=24)
+DEFAULT_CHUNK_SIZE = 200
+
+
+def _actual_references(blob_ids):
+    """{blob_id: count} of messages and posts that really point at each blob"""
+    counts = {}
+    for model in (Message, Post):
+        rows = db.session.query(model.media_blob_id, func.count(model.id)).filter(
+            model.media_blob_id.in_(blob_ids)
+        ).group_by(model.media_blob_id).all()
+        for blob_id, count in rows:
+            counts[blob_id] = counts.get(blob_id, 0) + count
+    return counts
+
+
+def _delete_stored_files(blob):
+    storage = get_storage()
+    keys = [blob.path, media_key_for(blob.thumbnail_url)]
+    variants = (blob.media_metadata or {}).get('variants') if isinstance(blob.media_metadata, dict) else None
+    for variant in (variants or {}).values():
+        keys.extend(media_key_for(variant.get(fmt)) for fmt in ('webp', 'jpeg'))
+    for key in keys:
+        if key:
+            storage.delete(key)
+
+
+def _delete_cloudinary_image(blob):
+    from cloudinary_service import get_service as get_cloudinary_service
+    result = get_cloudinary_service().delete_image(blob.path)
+    if not result['success']:
+        raise RuntimeError(result.get('error') or result.get('result'))
+
+
+def _repair_overcounts(chunk_size):
+    """
+    Lower ref_counts above the real number of references (rows removed by
+    cascades or bulk deletes never decrement them), so such blobs become
+    eligible for the purge. Each write only applies if the count is still the
+    one that was read, so a concurrent add_ref/unref is never overwritten.
+    """
+    last_id = 0
+    repaired = 0
+
+    while True:
+        blobs = db.session.query(MediaBlob.id, MediaBlob.ref_count).filter(
+            MediaBlob.id > last_id,
+            MediaBlob.ref_count > 0
+        ).order_by(MediaBlob.id.asc()).limit(chunk_size).all()
+        if not blobs:
+            break
+
+        actual = _actual_references([b.id for b in blobs])
+        for blob_id, stored in blobs:
+            expected = actual.get(blob_id, 0)
+            if stored <= expected:
+                continue
+            changes = {MediaBlob.ref_count: expected}
+            if expected == 0:
+                # The grace period starts from the repair, not from the blob's last real reference
+                changes[MediaBlob.last_referenced_at] = datetime.utcnow()
+            repaired += MediaBlob.query.filter(
+                MediaBlob.id == blob_id,
+                MediaBlob.ref_count == stored
+            ).update(changes, synchronize_session=False)
+        db.session.commit()
+        last_id = blobs[-1].id
+
+    return repaired
+
+
+def purge_unreferenced_blobs(chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Delete blobs whose ref_count has been zero for GRACE_PERIOD. Counts that
+    are too high are lowered first; zero counts are re-checked against
+    messages/posts before deleting, and a drifted count is repaired instead.
+    """
+    cutoff = datetime.utcnow() - GRACE_PERIOD
+    last_id = 0
+    deleted = 0
+    repaired = _repair_overcounts(chunk_size)
+
+    while True:
+        blobs = MediaBlob.query.filter(
+            MediaBlob.id > last_id,
+            MediaBlob.ref_count <= 0,
+            MediaBlob.last_referenced_at < cutoff
+        ).order_by(MediaBlob.id.asc()).limit(chunk_size).all()
+        if not blobs:
+            break
+
+        actual = _actual_references([b.id for b in blobs])
+        for blob in blobs:
+            if actual.get(blob.id):
+                blob.ref_count = actual[blob.id]
+                repaired += 1
+                continue
+            try:
+                if blob.storage == 'cloudinary':
+                    _delete_cloudinary_image(blob)
+                else:
+                    _delete_stored_files(blob)
+            except Exception as e:
+                logger.warning(f"⚠ Could not delete media blob {blob.id}: {e}")
+                continue
+            db.session.delete(blob)
+            deleted += 1
+        db.session.commit()
+        last_id = blobs[-1].id
+
+    logger.info(f"✓ Media blobs purged: {deleted} deleted, {repaired} ref counts repaired")
+    return {'deleted': deleted, 'repaired': repaired}
+
+
+def register_media_blob_jobs(scheduler, app):
+    """Schedule the nightly purge on an existing APScheduler instance"""
+    def run():
+        with app.app_context():
+            purge_unreferenced_blobs()
+
+    scheduler.add_job(
+        func=run,
+        trigger='cron',
+        hour=4,
+        minute=0,
+        id='media_blob_purge',
+        name='Delete unreferenced media blobs',
+        replace_existing=True
+    )
+    logger.info("✓ Media blob purge scheduled")
@@ -0,0 +1,35 @@
+# tasks/presence.py - Write socket presence to the database in batches
+import logging
+import os
+from services.presence import presence
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = int(os.environ.get('PRESENCE_FLUSH_SECONDS', 30))
+
+
+def flush_presence():
+    """Persist is_online / last_active changes collected since the last flush"""
+    written = presence.flush()
+    if written:
+        logger.info(f"✓ Presence flushed for {written} principals")
+    return written
+
+
+def register_presence_jobs(scheduler, app):
+    """Schedule the periodic flush on an existing APScheduler instance"""
+    def run():
+        with app.app_context():
+            flush_presence()
+
+    scheduler.add_job(
+        func=run,
+        trigger='interval',
+        seconds=FLUSH_SECONDS,
+        id='presence_flush',
+        name='Flush socket presence to the database',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    logger.info(f"✓ Presence flush scheduled every {FLUSH_SECONDS}s")
@@ -0,0 +1,40 @@
+# tasks/upload_sessions.py - Clean up abandoned resumable uploads
+import logging
+from datetime import datetime
+from models.upload_session import UploadSession
+from utils.media_utils import discard_partial_upload
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+def purge_expired_upload_sessions():
+    """Delete open upload sessions past their expiry along with their .part files"""
+    expired = UploadSession.query.filter(
+        UploadSession.status == 'open',
+        UploadSession.expires_at < datetime.utcnow()
+    ).all()
+    for upload in expired:
+        discard_partial_upload(upload.id)
+        db.session.delete(upload)
+    db.session.commit()
+
+    logger.info(f"✓ Purged {len(expired)} expired upload sessions")
+    return len(expired)
+
+
+def register_upload_session_jobs(scheduler, app):
+    """Schedule the hourly purge on an existing APScheduler instance"""
+    def run():
+        with app.app_context():
+            purge_expired_upload_sessions()
+
+    scheduler.add_job(
+        func=run,
+        trigger='interval',
+        hours=1,
+        id='upload_session_purge',
+        name='Purge expired resumable upload sessions',
+        replace_existing=True
+    )
+    logger.info("✓ Upload session purge scheduled")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the app the way wsgi.py does, from the server directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,162 @@
+"""
+Two workers sharing SOCKETIO_MESSAGE_QUEUE: a message created on worker A
+must reach a socket connected to worker B.
+
+Flask-SocketIO's test client refuses to run with a message queue, so worker
+B is served on a local port and a python-socketio client connects to it.
+The queue is a throwaway redis-server when one is on PATH, otherwise
+fakeredis (pip install fakeredis).
+"""
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+import pytest
+
+redis = pytest.importorskip('redis')
+socketio_client = pytest.importorskip('socketio')
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def message_queue_url(monkeypatch):
+    if shutil.which('redis-server'):
+        port = _free_port()
+        proc = subprocess.Popen(
+            ['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        url = f'redis://127.0.0.1:{port}/0'
+        client = redis.Redis.from_url(url)
+        for _ in range(50):
+            try:
+                client.ping()
+                break
+            except redis.ConnectionError:
+                time.sleep(0.1)
+        yield url
+        proc.terminate()
+        proc.wait()
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        server = fakeredis.FakeServer()
+        # Every client (both workers' queue managers) talks to the same in-memory server
+        monkeypatch.setattr(
+            redis.Redis, 'from_url', classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server))
+        )
+        yield 'redis://fakeredis:6379/0'
+
+
+@pytest.fixture
+def workers(message_queue_url, tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'vpg.db'}")
+    monkeypatch.setenv('SOCKETIO_MESSAGE_QUEUE', message_queue_url)
+    monkeypatch.setenv('MEDIA_ROOT', str(tmp_path / 'media'))
+    monkeypatch.delenv('REDIS_URL', raising=False)
+
+    from app import create_app
+    from database import db
+
+    app_a = create_app()
+    app_b = create_app()
+    with app_a.app_context():
+        db.create_all()
+    yield app_a, app_b
+    for app in (app_a, app_b):
+        scheduler = app.extensions.get('scheduler')
+        if scheduler and scheduler.running:
+            scheduler.shutdown(wait=False)
+
+
+def _seed_conversation():
+    from database import db
+    from models import Conversation, ConversationParticipant, User
+
+    sender = User(username='alice', name='Alice', email='alice@example.com', phone_number='1',
+                  location='Nairobi', gender='Female')
+    recipient = User(username='bob', name='Bob', email='bob@example.com', phone_number='2',
+                     location='Nairobi', gender='Male')
+    db.session.add_all([sender, recipient])
+    db.session.flush()
+    conversation = Conversation(type='direct', user_id=sender.id)
+    db.session.add(conversation)
+    db.session.flush()
+    db.session.add_all([
+        ConversationParticipant(conversation_id=conversation.id, participant_type='user', participant_id=sender.id),
+        ConversationParticipant(conversation_id=conversation.id, participant_type='user', participant_id=recipient.id),
+    ])
+    db.session.commit()
+    return conversation.id, sender.id, recipient.id
+
+
+@pytest.fixture
+def serve(workers):
+    """Serve an app on a free local port; yields a function returning its base URL."""
+    from werkzeug.serving import make_server
+
+    servers = []
+
+    def start(app):
+        server = make_server('127.0.0.1', _free_port(), app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def _listen(client, event):
+    received = []
+    arrived = threading.Event()
+
+    @client.on(event)
+    def on_event(data):
+        received.append(data)
+        arrived.set()
+
+    return received, arrived
+
+
+def test_message_created_on_one_worker_reaches_socket_on_another(workers, serve):
+    from apis.auth import generate_tokens
+    from apis.message_api import _create_message
+    from database import db
+    from models import Conversation, User
+
+    app_a, app_b = workers
+    with app_a.app_context():
+        conversation_id, sender_id, recipient_id = _seed_conversation()
+
+    token, _, _ = generate_tokens(recipient_id, 'user')
+    client_b = socketio_client.Client()
+    joined, joined_event = _listen(client_b, 'joined_conversation')
+    messages, message_event = _listen(client_b, 'new_message')
+    client_b.connect(serve(app_b), auth={'token': token}, transports=['polling'], wait_timeout=5)
+    try:
+        client_b.emit('join_conversation', {'conversation_id': conversation_id})
+        assert joined_event.wait(5), 'worker B did not let the participant join the conversation room'
+
+        with app_a.test_request_context():
+            conversation = db.session.get(Conversation, conversation_id)
+            sender = db.session.get(User, sender_id)
+            message, _, created = _create_message(conversation, sender, 'user', 'hello from worker A')
+            message_id = message.id
+        assert created
+
+        assert message_event.wait(5), 'new_message emitted on worker A never reached worker B'
+    finally:
+        client_b.disconnect()
+
+    payload = messages[0]
+    assert payload['id'] == message_id
+    assert payload['conversation_id'] == conversation_id
+    assert payload['content'] == 'hello from worker A'
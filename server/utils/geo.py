@@ -0,0 +1,157 @@
+"""
+Geo helpers for advertiser location queries: geohash encoding, bounding
+boxes for SQL prefilters and vectorized haversine distances.
+"""
+import math
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.32
+GEOHASH_PRECISION = 9
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+# ========== GEOHASH ==========
+
+def encode_geohash(lat, lon, precision=GEOHASH_PRECISION):
+    """Standard base32 geohash of a point."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size_deg(precision):
+    """(height, width) in degrees of a geohash cell at ``precision``."""
+    lon_bits = math.ceil(5 * precision / 2)
+    lat_bits = math.floor(5 * precision / 2)
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def covering_geohashes(lat, lon, radius_km):
+    """
+    Geohash prefixes whose cells cover a circle: the centre cell and its eight
+    neighbours at the finest precision whose cells are still at least
+    radius_km across. Returns None when the radius is too large to be worth
+    prefiltering on (coarser than a single character).
+    """
+    cos_lat = max(math.cos(math.radians(lat)), 0.01)
+    chosen = None
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        height_deg, width_deg = geohash_cell_size_deg(precision)
+        if min(height_deg * KM_PER_DEGREE_LAT, width_deg * KM_PER_DEGREE_LAT * cos_lat) < radius_km:
+            break
+        chosen = precision
+    if chosen is None:
+        return None
+
+    height_deg, width_deg = geohash_cell_size_deg(chosen)
+    cells = set()
+    for dlat in (-height_deg, 0.0, height_deg):
+        for dlon in (-width_deg, 0.0, width_deg):
+            cell_lat = min(max(lat + dlat, -89.999999), 89.999999)
+            cell_lon = ((lon + dlon + 180.0) % 360.0) - 180.0
+            cells.add(encode_geohash(cell_lat, cell_lon, chosen))
+    return sorted(cells)
+
+
+# ========== BOUNDING BOX ==========
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing the circle; longitude is None near the poles/antimeridian."""
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-6 or max_lat >= 90.0 or min_lat <= -90.0:
+        return min_lat, max_lat, None, None
+    dlon = radius_km / (KM_PER_DEGREE_LAT * cos_lat)
+    if dlon >= 180.0 or lon - dlon < -180.0 or lon + dlon > 180.0:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+def spatial_prefilter(model, lat, lon, radius_km):
+    """SQL criteria narrowing ``model`` rows to the circle's geohash cells and bounding box."""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    criteria = [
+        model.latitude.isnot(None),
+        model.longitude.isnot(None),
+        model.latitude.between(min_lat, max_lat),
+    ]
+    if min_lon is not None:
+        criteria.append(model.longitude.between(min_lon, max_lon))
+    cells = covering_geohashes(lat, lon, radius_km)
+    if cells:
+        from sqlalchemy import or_
+        criteria.append(or_(*[model.geohash.like(f'{cell}%') for cell in cells]))
+    return criteria
+
+
+# ========== DISTANCES ==========
+
+def haversine_km(lat, lon, lats, lons):
+    """
+    Great-circle distances from one point to many.
+
+    With NumPy ``lats``/``lons`` may be arrays and the result is an array
+    computed in one vectorized pass; without it they must be sequences and
+    a list is returned.
+    """
+    if NUMPY_AVAILABLE:
+        lat1 = np.radians(lat)
+        lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+        dlat = lat2 - lat1
+        dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    out = []
+    lat1 = math.radians(lat)
+    for lat2, lon2 in zip(lats, lons):
+        lat2 = math.radians(lat2)
+        dlat = lat2 - lat1
+        dlon = math.radians(lon2 - lon)
+        a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+        out.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(max(a, 0.0), 1.0))))
+    return out
+
+
+def distances_km(lat, lon, coords):
+    """
+    Distances from one point to a list of (lat, lon) pairs, some of which may be
+    None. Returns a float array with NaN for missing coordinates (NumPy), or a
+    list with None entries (fallback).
+    """
+    if NUMPY_AVAILABLE:
+        points = np.array(coords, dtype=np.float64).reshape(-1, 2)
+        return haversine_km(lat, lon, points[:, 0], points[:, 1])
+
+    known = [i for i, (a, b) in enumerate(coords) if a is not None and b is not None]
+    out = [None] * len(coords)
+    computed = haversine_km(lat, lon, [float(coords[i][0]) for i in known], [float(coords[i][1]) for i in known])
+    for i, d in zip(known, computed):
+        out[i] = d
+    return out
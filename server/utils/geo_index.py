@@ -0,0 +1,122 @@
+"""
+In-memory spatial index of advertiser coordinates for /advertisers/nearby.
+
+Coordinates are held in parallel NumPy arrays (ids, latitudes, longitudes)
+so a nearby query is one vectorized haversine pass plus an argsort, with no
+ORM objects built for advertisers that are out of range. The arrays are
+loaded with a single column-only query, patched in place when an advertiser
+saves coordinates (AdvertiserCoords.post), and rebuilt every
+``GEO_INDEX_TTL`` seconds so other workers' writes are picked up.
+
+Without NumPy (or with GEO_INDEX_ENABLED=false) queries fall back to the
+geohash + bounding-box SQL prefilter from utils.geo.
+"""
+import logging
+import os
+import threading
+import time
+
+from database import db
+from models import Advertiser
+from utils.geo import NUMPY_AVAILABLE, haversine_km, spatial_prefilter
+
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 300
+
+
+class AdvertiserGeoIndex:
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else int(os.environ.get('GEO_INDEX_TTL', DEFAULT_TTL_SECONDS))
+        self.enabled = NUMPY_AVAILABLE and os.environ.get('GEO_INDEX_ENABLED', 'true').lower() == 'true'
+        self._lock = threading.Lock()
+        self._ids = None
+        self._lats = None
+        self._lons = None
+        self._positions = {}
+        self._built_at = 0.0
+
+    # ---------- building ----------
+
+    def _stale(self):
+        return self._ids is None or (time.monotonic() - self._built_at) > self.ttl
+
+    def rebuild(self):
+        rows = db.session.query(Advertiser.id, Advertiser.latitude, Advertiser.longitude).filter(
+            Advertiser.latitude.isnot(None),
+            Advertiser.longitude.isnot(None)
+        ).all()
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        lats = np.fromiter((float(r[1]) for r in rows), dtype=np.float64, count=len(rows))
+        lons = np.fromiter((float(r[2]) for r in rows), dtype=np.float64, count=len(rows))
+        with self._lock:
+            self._ids, self._lats, self._lons = ids, lats, lons
+            self._positions = {int(advertiser_id): i for i, advertiser_id in enumerate(ids)}
+            self._built_at = time.monotonic()
+        logger.info(f"✓ Geo index rebuilt with {len(ids)} advertisers")
+
+    def _ensure_built(self):
+        if self._stale():
+            self.rebuild()
+
+    def upsert(self, advertiser_id, lat, lon):
+        """Apply one advertiser's new coordinates without a rebuild."""
+        if not self.enabled or self._ids is None:
+            return
+        with self._lock:
+            position = self._positions.get(advertiser_id)
+            if lat is None or lon is None:
+                if position is not None:
+                    keep = np.ones(len(self._ids), dtype=bool)
+                    keep[position] = False
+                    self._ids, self._lats, self._lons = self._ids[keep], self._lats[keep], self._lons[keep]
+                    self._positions = {int(a): i for i, a in enumerate(self._ids)}
+                return
+            if position is None:
+                self._positions[advertiser_id] = len(self._ids)
+                self._ids = np.append(self._ids, advertiser_id)
+                self._lats = np.append(self._lats, float(lat))
+                self._lons = np.append(self._lons, float(lon))
+            else:
+                self._lats[position] = float(lat)
+                self._lons[position] = float(lon)
+
+    def remove(self, advertiser_id):
+        self.upsert(advertiser_id, None, None)
+
+    # ---------- querying ----------
+
+    def nearby(self, lat, lon, radius_km, limit=50, offset=0):
+        """
+        Advertiser ids within radius_km, nearest first.
+
+        Returns (ids, distances_km, total) for the requested slice, where
+        total counts every advertiser within the radius.
+        """
+        if self.enabled:
+            self._ensure_built()
+            with self._lock:
+                ids, lats, lons = self._ids, self._lats, self._lons
+            distances = haversine_km(lat, lon, lats, lons)
+            inside = np.nonzero(distances <= radius_km)[0]
+            order = inside[np.argsort(distances[inside], kind='stable')]
+            window = order[offset:offset + limit]
+            return [int(i) for i in ids[window]], [float(d) for d in distances[window]], int(len(order))
+
+        # Fallback: SQL prefilter, then rank the (small) candidate set
+        rows = db.session.query(Advertiser.id, Advertiser.latitude, Advertiser.longitude).filter(
+            *spatial_prefilter(Advertiser, lat, lon, radius_km)
+        ).all()
+        distances = haversine_km(lat, lon, [float(r[1]) for r in rows], [float(r[2]) for r in rows])
+        ranked = sorted(
+            ((d, r[0]) for d, r in zip(distances, rows) if d <= radius_km),
+            key=lambda pair: (pair[0], pair[1])
+        )
+        window = ranked[offset:offset + limit]
+        return [r[1] for r in window], [float(r[0]) for r in window], len(ranked)
+
+
+advertiser_geo_index = AdvertiserGeoIndex()
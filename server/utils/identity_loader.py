@@ -0,0 +1,103 @@
+"""
+Request-scoped batch loader for User / Advertiser identities.
+
+Serializers used to call ``User.find_by_id`` / ``Advertiser.find_by_id`` once
+per row. Instead, register every ``(participant_type, id)`` key a response
+will need, then resolve them: pending keys are fetched with one ``IN`` query
+per type and memoized on ``flask.g`` for the rest of the request.
+
+    loader = get_identity_loader()
+    loader.want(('user', c.user_id) for c in comments)
+    for c in comments:
+        author = loader.get('user', c.user_id)
+
+``get`` on a key that was never registered still works; it is simply
+batched on its own.
+"""
+from flask import g, has_app_context
+from models import User, Advertiser
+
+IDENTITY_MODELS = {
+    'user': User,
+    'advertiser': Advertiser,
+}
+
+
+def identity_key(participant_type, participant_id):
+    """Normalize a (type, id) pair; legacy sender types map onto advertiser/user."""
+    participant_type = (participant_type or 'user').lower()
+    if participant_type in ('advertiser', 'escort', 'provider'):
+        participant_type = 'advertiser'
+    elif participant_type not in IDENTITY_MODELS:
+        participant_type = 'user'
+    return participant_type, participant_id
+
+
+class IdentityLoader:
+    """DataLoader-style cache: collect keys, load them in batches, memoize misses too."""
+
+    def __init__(self):
+        self._loaded = {}
+        self._pending = set()
+        self.queries = 0
+
+    def prime(self, principal):
+        """Seed the cache with an already-loaded principal (e.g. the authenticated user)."""
+        if principal is None:
+            return
+        participant_type = 'advertiser' if isinstance(principal, Advertiser) else 'user'
+        self._loaded[(participant_type, principal.id)] = principal
+
+    def want(self, keys):
+        """Register keys to be fetched on the next resolve."""
+        for participant_type, participant_id in keys:
+            if participant_id is None:
+                continue
+            key = identity_key(participant_type, participant_id)
+            if key not in self._loaded:
+                self._pending.add(key)
+
+    def resolve(self):
+        """Fetch every pending key: one IN query per participant type."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, set()
+        by_type = {}
+        for participant_type, participant_id in pending:
+            by_type.setdefault(participant_type, set()).add(participant_id)
+        for participant_type, ids in by_type.items():
+            model = IDENTITY_MODELS[participant_type]
+            self.queries += 1
+            found = {row.id: row for row in model.query.filter(model.id.in_(ids)).all()}
+            for participant_id in ids:
+                # Missing rows are memoized as None so they are not re-queried
+                self._loaded[(participant_type, participant_id)] = found.get(participant_id)
+
+    def get(self, participant_type, participant_id):
+        if participant_id is None:
+            return None
+        key = identity_key(participant_type, participant_id)
+        if key not in self._loaded:
+            self._pending.add(key)
+            self.resolve()
+        return self._loaded.get(key)
+
+    def get_many(self, keys):
+        """{key: principal} for every key that exists; loads what is missing in one pass."""
+        keys = [identity_key(t, i) for t, i in keys if i is not None]
+        self.want(keys)
+        self.resolve()
+        return {key: self._loaded[key] for key in keys if self._loaded.get(key) is not None}
+
+    def forget(self, participant_type, participant_id):
+        self._loaded.pop(identity_key(participant_type, participant_id), None)
+
+
+def get_identity_loader():
+    """The loader for the current request (a throwaway one outside an app context)."""
+    if not has_app_context():
+        return IdentityLoader()
+    loader = g.get('_identity_loader')
+    if loader is None:
+        loader = g._identity_loader = IdentityLoader()
+    return loader
@@ -1,16 +1,19 @@
 import os
 import uuid
 import mimetypes
+import hashlib
+import tempfile
+from werkzeug.formparser import parse_form_data
 from werkzeug.utils import secure_filename
 from PIL import Image
 import io
+from utils.storage import STAGING_DIR, get_storage, media_key, media_url, staging_path
 
 # === CONFIGURATION ===
-MEDIA_ROOT = os.path.join(os.getcwd(), "uploads")   # Base folder for uploads
+# Files live in the backend from utils.storage (MEDIA_STORAGE); MEDIA_ROOT/partial is node-local staging
 MAX_FILE_SIZE_MB = 100                              # Max file size (MB)
-
-# Get base URL from environment or use default
-BASE_URL = 'https://vpg-9wlv.onrender.com'
+MAX_IMAGE_SIZE_MB = int(os.environ.get('MAX_IMAGE_SIZE_MB', 20))  # Max streamed image upload (MB)
+SPOOL_MEMORY_BYTES = 1024 * 1024                    # Streamed uploads roll over to disk past this
 
 # Allowed file extensions by category
 ALLOWED_TYPES = {
@@ -23,12 +26,8 @@ ALLOWED_TYPES = {
 
 
 def ensure_media_dirs():
-    """Ensure upload directories exist."""
-    os.makedirs(MEDIA_ROOT, exist_ok=True)
-    for cat in ALLOWED_TYPES:
-        os.makedirs(os.path.join(MEDIA_ROOT, cat), exist_ok=True)
-    # Create thumbnails directory
-    os.makedirs(os.path.join(MEDIA_ROOT, "thumbnails"), exist_ok=True)
+    """Ensure the staging directory exists (storage creates its fan-out directories on write)."""
+    os.makedirs(STAGING_DIR, exist_ok=True)
 
 
 def get_media_category(file_ext):
@@ -77,16 +76,209 @@ def validate_file(file_storage, expected_type=None):
     }
 
 
+# === STREAMED UPLOADS ===
+
+# Leading bytes of the image formats in ALLOWED_TYPES["image"]
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+SNIFF_BYTES = 12
+
+
+def sniff_image_type(head):
+    """Image extension from a file's first bytes, or None if it is not an allowed image."""
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class ValidatingSpool(tempfile.SpooledTemporaryFile):
+    """
+    Spooled temp file that enforces the size limit and sniffs the content type
+    as chunks are written, so an oversized or non-image upload is rejected
+    while it is still being received instead of after it is fully buffered.
+    """
+
+    def __init__(self, max_bytes, expected_type=None):
+        super().__init__(max_size=SPOOL_MEMORY_BYTES)
+        self.max_bytes = max_bytes
+        self.expected_type = expected_type
+        self.size_bytes = 0
+        self.detected_ext = None
+        self._head = b""
+
+    def write(self, data):
+        self.size_bytes += len(data)
+        if self.size_bytes > self.max_bytes:
+            raise ValueError(f"File exceeds {self.max_bytes // (1024 * 1024)} MB limit")
+        if self.expected_type == "image" and self.detected_ext is None:
+            self._head += bytes(data[:SNIFF_BYTES - len(self._head)])
+            if len(self._head) >= SNIFF_BYTES:
+                self._check_head()
+        return super().write(data)
+
+    def _check_head(self):
+        self.detected_ext = sniff_image_type(self._head)
+        if self.detected_ext is None:
+            raise ValueError(f"File is not an allowed image. Allowed: {', '.join(ALLOWED_TYPES['image'])}")
+
+    def finish(self):
+        """Run the checks that need the whole stream (tiny files), then rewind for reading."""
+        if self.size_bytes == 0:
+            raise ValueError("Uploaded file is empty")
+        if self.expected_type == "image" and self.detected_ext is None:
+            self._check_head()
+        self.seek(0)
+        return self
+
+
+def stream_multipart_upload(environ, field="file", expected_type="image", max_size_mb=None):
+    """
+    Parse a multipart/form-data request, streaming ``field`` into a
+    ValidatingSpool instead of buffering it (or a base64 copy of it) in memory.
+
+    Must be called before anything touches request.form / request.files.
+    Returns (form, spool, meta); the caller owns the spool and must close it.
+    Raises ValueError for a missing, oversized or disallowed file.
+    """
+    max_bytes = (max_size_mb or (MAX_IMAGE_SIZE_MB if expected_type == "image" else MAX_FILE_SIZE_MB)) * 1024 * 1024
+    spools = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        spool = ValidatingSpool(max_bytes, expected_type)
+        spools.append(spool)
+        return spool
+
+    try:
+        _, form, files = parse_form_data(environ, stream_factory=stream_factory, silent=False)
+    except Exception:
+        for spool in spools:
+            spool.close()
+        raise
+
+    file_storage = files.get(field)
+    if file_storage is None:
+        for spool in spools:
+            spool.close()
+        raise ValueError(f"'{field}' file is required")
+    for other in files.values():
+        if other is not file_storage:
+            other.stream.close()
+
+    spool = file_storage.stream.finish()
+    filename = secure_filename(file_storage.filename or "")
+    ext = spool.detected_ext or os.path.splitext(filename)[1].lower().lstrip(".")
+    if expected_type and expected_type != "image" and ext not in ALLOWED_TYPES.get(expected_type, []):
+        spool.close()
+        raise ValueError(f"File type '.{ext}' not allowed. Allowed: {', '.join(ALLOWED_TYPES[expected_type])}")
+
+    mime_type, _ = mimetypes.guess_type(f"upload.{ext}")
+    return form, spool, {
+        "filename": filename,
+        "extension": ext,
+        "category": get_media_category(ext),
+        "mime_type": mime_type or "application/octet-stream",
+        "size_bytes": spool.size_bytes
+    }
+
+
+# === CONTENT HASHING ===
+
+def hash_stream_to_file(stream, dest_path):
+    """Copy ``stream`` to ``dest_path`` block by block, hashing as it goes. Returns (sha256 hex, size)."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(dest_path, "wb") as out:
+        while True:
+            block = stream.read(CHUNK_COPY_BYTES)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+            out.write(block)
+    return digest.hexdigest(), size
+
+
+def hash_file(path):
+    """SHA-256 of a file already on disk. Returns (sha256 hex, size)."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(CHUNK_COPY_BYTES)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+# === RESUMABLE UPLOADS ===
+
+MAX_RESUMABLE_UPLOAD_MB = int(os.environ.get('MAX_RESUMABLE_UPLOAD_MB', 1024))
+CHUNK_COPY_BYTES = 1024 * 1024
+
+
+def check_media_extension(filename, expected_type):
+    """Extension of ``filename`` if it is allowed for ``expected_type``; raises ValueError otherwise."""
+    ext = os.path.splitext(secure_filename(filename or ""))[1].lower().lstrip(".")
+    if expected_type not in ALLOWED_TYPES or expected_type == "other":
+        raise ValueError(f"Invalid media type: {expected_type}")
+    if ext not in ALLOWED_TYPES[expected_type]:
+        raise ValueError(f"File type '.{ext}' not allowed for {expected_type}. Allowed: {', '.join(ALLOWED_TYPES[expected_type])}")
+    return ext
+
+
+def partial_upload_path(upload_id):
+    # Chunks are appended on the node that received them; the finished file moves into storage
+    return os.path.join(STAGING_DIR, f"{upload_id}.part")
+
+
+def create_partial_upload(upload_id):
+    ensure_media_dirs()
+    open(partial_upload_path(upload_id), "wb").close()
+
+
+def append_upload_chunk(upload_id, offset, stream, limit):
+    """
+    Copy ``stream`` into the upload's .part file starting at ``offset``, one
+    CHUNK_COPY_BYTES block at a time (the chunk is never held in memory whole).
+    Returns the number of bytes written; raises ValueError past ``limit``.
+    """
+    written = 0
+    with open(partial_upload_path(upload_id), "r+b") as part:
+        part.seek(offset)
+        while True:
+            block = stream.read(CHUNK_COPY_BYTES)
+            if not block:
+                break
+            written += len(block)
+            if offset + written > limit:
+                raise ValueError(f"Chunk runs past the declared upload size of {limit} bytes")
+            part.write(block)
+    return written
+
+
+def discard_partial_upload(upload_id):
+    try:
+        os.remove(partial_upload_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
 def generate_image_thumbnail(image_path, thumbnail_path, size=(300, 300)):
     """Generate a thumbnail for an image."""
     try:
         with Image.open(image_path) as img:
-            if img.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
+            # JPEG only: decode at reduced scale instead of full resolution
+            img.draft('RGB', size)
+            img = _flatten_to_rgb(img)
             
             img.thumbnail(size, Image.Resampling.LANCZOS)
             img.save(thumbnail_path, 'JPEG', quality=85, optimize=True)
@@ -97,6 +289,80 @@ def generate_image_thumbnail(image_path, thumbnail_path, size=(300, 300)):
         return False
 
 
+# Widths of the responsive variants made for every uploaded image (chat bubble, feed tile, full screen)
+IMAGE_VARIANT_WIDTHS = (160, 480, 1080)
+
+
+def _flatten_to_rgb(img):
+    """Composite transparent images onto white so they can be saved as JPEG."""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        return background
+    return img.convert('RGB') if img.mode != 'RGB' else img
+
+
+def generate_image_variants(image_path, widths=IMAGE_VARIANT_WIDTHS):
+    """
+    Store width-bounded WebP + JPEG copies of an image and return
+    {"<width>": {"width", "height", "webp", "jpeg"}}.
+
+    JPEGs are decoded at reduced scale via draft(), and each variant is made
+    from the next larger one with reduce() before the final resize, so the
+    full-resolution bitmap is only touched once. Widths at or above the
+    original are skipped; the original already covers them.
+    """
+    variants = {}
+    try:
+        with Image.open(image_path) as img:
+            targets = sorted((w for w in widths if w < img.width), reverse=True)
+            if not targets:
+                return variants
+
+            # JPEG only: let the decoder downscale by a power of two while reading
+            largest = targets[0]
+            img.draft('RGB', (largest, max(1, img.height * largest // img.width)))
+            current = _flatten_to_rgb(img)
+
+            storage = get_storage()
+            base = uuid.uuid4().hex
+            for width in targets:
+                height = max(1, round(current.height * width / current.width))
+                factor = min(current.width // width, current.height // height)
+                if factor >= 2:
+                    current = current.reduce(factor)
+                if current.size != (width, height):
+                    current = current.resize((width, height), Image.Resampling.LANCZOS)
+
+                webp_key = media_key("variants", f"{base}_{width}.webp")
+                jpeg_key = media_key("variants", f"{base}_{width}.jpg")
+                webp_path, jpeg_path = staging_path("webp"), staging_path("jpg")
+                current.save(webp_path, 'WEBP', quality=80, method=4)
+                current.save(jpeg_path, 'JPEG', quality=82, optimize=True, progressive=True)
+                storage.put_file(webp_path, webp_key, "image/webp")
+                storage.put_file(jpeg_path, jpeg_key, "image/jpeg")
+                variants[str(width)] = {
+                    "width": width,
+                    "height": height,
+                    "webp": media_url(webp_key),
+                    "jpeg": media_url(jpeg_key)
+                }
+        print(f"[MediaUtils] Image variants generated: {', '.join(variants)}")
+    except Exception as e:
+        print(f"[MediaUtils] Error generating image variants: {e}")
+    return variants
+
+
+def srcset_from_metadata(media_metadata):
+    """Srcset-style map {"<width>": {"webp", "jpeg"}} from a message's media_metadata, or None."""
+    variants = (media_metadata or {}).get("variants") if isinstance(media_metadata, dict) else None
+    if not variants:
+        return None
+    return {width: {"webp": v.get("webp"), "jpeg": v.get("jpeg")} for width, v in variants.items()}
+
+
 def generate_video_thumbnail(video_path, thumbnail_path):
     """Generate a thumbnail for a video using ffmpeg."""
     try:
@@ -219,8 +485,12 @@ def get_media_metadata(file_path, category, file_size):
     return metadata
 
 
-def upload_media_file(file_storage, message_type=None):
-    """Handles saving a Flask FileStorage object with thumbnail generation."""
+def save_media_file(file_storage, message_type=None):
+    """
+    Validate and save a Flask FileStorage object. Cheap part of an upload:
+    returns the public URL plus what process_media_file needs, without any
+    thumbnailing or ffprobe work.
+    """
     ensure_media_dirs()
 
     # Validate and extract metadata
@@ -228,41 +498,80 @@ def upload_media_file(file_storage, message_type=None):
 
     # Unique filename to avoid collisions
     unique_name = f"{uuid.uuid4().hex}.{meta['extension']}"
-    save_dir = os.path.join(MEDIA_ROOT, meta["category"])
-    save_path = os.path.join(save_dir, unique_name)
+    key = media_key(meta["category"], unique_name)
 
-    # Save file locally
-    file_storage.save(save_path)
-    print(f"[MediaUtils] File saved: {save_path}")
+    # Stage locally, then hand over to the storage backend
+    tmp_path = staging_path(meta["extension"])
+    file_storage.save(tmp_path)
+    get_storage().put_file(tmp_path, key, meta["mime_type"])
+    print(f"[MediaUtils] File saved: {key}")
 
     # Generate ABSOLUTE URL
-    file_url = f"{BASE_URL}/media/{meta['category']}/{unique_name}"
-    
-    # Initialize result
-    result = {
+    file_url = media_url(key)
+
+    return {
         "url": file_url,
-        "thumbnail_url": None,
-        "metadata": get_media_metadata(save_path, meta["category"], meta["size_bytes"])
+        "key": key,
+        "category": meta["category"],
+        "size_bytes": meta["size_bytes"],
+        "metadata": {
+            "size_bytes": meta["size_bytes"],
+            "size_mb": round(meta["size_bytes"] / (1024 * 1024), 2)
+        }
     }
 
-    # Generate thumbnails
-    if meta["category"] == "image":
-        thumbnail_name = f"{uuid.uuid4().hex}_thumb.jpg"
-        thumbnail_path = os.path.join(MEDIA_ROOT, "thumbnails", thumbnail_name)
-        
-        if generate_image_thumbnail(save_path, thumbnail_path):
-            result["thumbnail_url"] = f"{BASE_URL}/media/thumbnails/{thumbnail_name}"
-    
-    elif meta["category"] == "video":
-        thumbnail_name = f"{uuid.uuid4().hex}_thumb.jpg"
-        thumbnail_path = os.path.join(MEDIA_ROOT, "thumbnails", thumbnail_name)
+
+def _store_thumbnail(thumbnail_path):
+    key = media_key("thumbnails", f"{uuid.uuid4().hex}_thumb.jpg")
+    get_storage().put_file(thumbnail_path, key, "image/jpeg")
+    return media_url(key)
+
+
+def process_media_file(key, category, size_bytes):
+    """
+    Expensive part of an upload: metadata extraction and thumbnail generation.
+    Only takes and returns plain values so it can run in a worker process.
+    """
+    with get_storage().open_local(key) as save_path:
+        result = {
+            "thumbnail_url": None,
+            "metadata": get_media_metadata(save_path, category, size_bytes)
+        }
+
+        # Generate thumbnails
+        if category == "image":
+            thumbnail_path = staging_path("jpg")
+            
+            if generate_image_thumbnail(save_path, thumbnail_path):
+                result["thumbnail_url"] = _store_thumbnail(thumbnail_path)
+            
+            variants = generate_image_variants(save_path)
+            if variants:
+                result["metadata"]["variants"] = variants
         
-        print(f"[MediaUtils] Attempting to generate video thumbnail...")
-        if generate_video_thumbnail(save_path, thumbnail_path):
-            result["thumbnail_url"] = f"{BASE_URL}/media/thumbnails/{thumbnail_name}"
-        else:
-            print(f"[MediaUtils] Warning: Could not generate video thumbnail. Client will show fallback.")
+        elif category == "video":
+            thumbnail_path = staging_path("jpg")
+            
+            print(f"[MediaUtils] Attempting to generate video thumbnail...")
+            if generate_video_thumbnail(save_path, thumbnail_path):
+                result["thumbnail_url"] = _store_thumbnail(thumbnail_path)
+            else:
+                print(f"[MediaUtils] Warning: Could not generate video thumbnail. Client will show fallback.")
+                if os.path.exists(thumbnail_path):
+                    os.remove(thumbnail_path)
+
+    return result
 
-    print(f"[MediaUtils] Uploaded {meta['category']} file: {file_url}")
 
-    return result
\ No newline at end of file
+def upload_media_file(file_storage, message_type=None):
+    """Handles saving a Flask FileStorage object with thumbnail generation (synchronously)."""
+    saved = save_media_file(file_storage, message_type)
+    processed = process_media_file(saved["key"], saved["category"], saved["size_bytes"])
+
+    print(f"[MediaUtils] Uploaded {saved['category']} file: {saved['url']}")
+
+    return {
+        "url": saved["url"],
+        "thumbnail_url": processed["thumbnail_url"],
+        "metadata": processed["metadata"]
+    }
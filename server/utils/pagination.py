@@ -0,0 +1,205 @@
+"""
+Keyset (cursor) pagination shared by the list endpoints.
+
+Clients that send ``cursor`` (empty for the first page) get keyset pages:
+rows are selected with ``WHERE (created_at, id) < (:last_created_at, :last_id)``
+style predicates served straight from an index, so page 1000 costs the same
+as page 1 and no COUNT(*) is run unless ``include_total=true`` is asked for.
+
+Clients that keep sending ``page``/``per_page`` still get OFFSET pages with the
+old response keys; their totals come from a short-lived count cache instead of
+a fresh COUNT(*) on every request. Both modes return ``next_cursor`` so a
+client can switch over without a second round trip.
+"""
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import and_, or_
+
+DEFAULT_MAX_PER_PAGE = 100
+COUNT_CACHE_TTL_SECONDS = 30
+COUNT_CACHE_MAX_ENTRIES = 1024
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue."""
+
+
+# ========== CURSOR ENCODING ==========
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and '$dt' in value:
+        return datetime.fromisoformat(value['$dt'])
+    return value
+
+
+def encode_cursor(values):
+    """Encode the sort-key values of the last row into an opaque cursor string."""
+    raw = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, expected_length):
+    """Decode a cursor produced by encode_cursor; raises InvalidCursor on tampering."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise InvalidCursor('Malformed cursor')
+    if not isinstance(values, list) or len(values) != expected_length:
+        raise InvalidCursor('Cursor does not match this listing')
+    try:
+        return [_decode_value(v) for v in values]
+    except ValueError:
+        raise InvalidCursor('Malformed cursor')
+
+
+# ========== KEYSET PREDICATES ==========
+
+def created_desc(model):
+    """The default feed ordering: newest first, id as tie-breaker."""
+    return [(model.created_at, 'desc'), (model.id, 'desc')]
+
+
+def keyset_after(order, values):
+    """
+    WHERE clause selecting rows strictly after ``values`` in ``order``.
+
+    ``order`` is a list of (column, 'asc'|'desc'); the last column must be
+    unique (normally the primary key). Expands to the portable form
+    ``a < :a OR (a = :a AND b < :b) ...`` so it works on MySQL and PostgreSQL.
+    """
+    clauses = []
+    for i, (column, direction) in enumerate(order):
+        value = values[i]
+        past = column < value if direction == 'desc' else column > value
+        equal_prefix = [order[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equal_prefix, past) if equal_prefix else past)
+    return or_(*clauses)
+
+
+def keyset_before(order, values):
+    """WHERE clause selecting rows strictly before ``values`` in ``order``."""
+    flipped = [(column, 'asc' if direction == 'desc' else 'desc') for column, direction in order]
+    return keyset_after(flipped, values)
+
+
+def _order_by_clauses(order):
+    return [column.desc() if direction == 'desc' else column.asc() for column, direction in order]
+
+
+def _default_key(order):
+    names = [column.key for column, _ in order]
+    return lambda item: tuple(getattr(item, name) for name in names)
+
+
+# ========== CACHED TOTALS ==========
+
+_count_cache = OrderedDict()
+_count_lock = threading.Lock()
+
+
+def _count_cache_key(query):
+    compiled = query.statement.compile()
+    return str(compiled), repr(sorted(compiled.params.items()))
+
+
+def cached_count(query, ttl=None):
+    """
+    COUNT(*) for ``query``, memoized per SQL + parameters for ``ttl`` seconds.
+
+    Totals are therefore approximate (they may lag inserts by up to ttl),
+    which is fine for "N results" labels and page counts.
+    """
+    if ttl is None:
+        try:
+            ttl = current_app.config.get('PAGINATION_COUNT_TTL', COUNT_CACHE_TTL_SECONDS)
+        except RuntimeError:
+            ttl = COUNT_CACHE_TTL_SECONDS
+
+    count_query = query.order_by(None)
+    key = _count_cache_key(count_query)
+    now = time.monotonic()
+
+    with _count_lock:
+        hit = _count_cache.get(key)
+        if hit and hit[1] > now:
+            _count_cache.move_to_end(key)
+            return hit[0]
+
+    total = count_query.count()
+
+    with _count_lock:
+        _count_cache[key] = (total, now + ttl)
+        _count_cache.move_to_end(key)
+        while len(_count_cache) > COUNT_CACHE_MAX_ENTRIES:
+            _count_cache.popitem(last=False)
+    return total
+
+
+# ========== ENTRY POINT ==========
+
+def _flag(name):
+    return (request.args.get(name) or '').lower() in ('1', 'true', 'yes')
+
+
+def paginate(query, order, key=None, default_per_page=10, max_per_page=DEFAULT_MAX_PER_PAGE):
+    """
+    Paginate ``query`` according to the current request's arguments.
+
+    Args:
+        query: un-ordered SQLAlchemy query
+        order: list of (column, 'asc'|'desc'), unique column last
+        key: callable returning the order values for a result row
+             (defaults to reading the order columns off the row)
+        default_per_page: page size when the client sends none
+
+    Returns:
+        (items, meta) where meta holds ``next_cursor``/``has_more``/``per_page``
+        plus ``total``/``pages``/``current_page`` in page mode (and ``total``
+        in cursor mode when include_total=true).
+    """
+    key = key or _default_key(order)
+    per_page = request.args.get('per_page', None, type=int) or request.args.get('limit', default_per_page, type=int)
+    per_page = max(1, min(per_page, max_per_page))
+    cursor = request.args.get('cursor')
+
+    ordered = query.order_by(*_order_by_clauses(order))
+
+    if cursor is not None:
+        page_query = ordered
+        if cursor:
+            page_query = page_query.filter(keyset_after(order, decode_cursor(cursor, len(order))))
+        rows = page_query.limit(per_page + 1).all()
+        meta = {}
+        if _flag('include_total'):
+            meta['total'] = cached_count(query)
+    else:
+        page = max(1, request.args.get('page', 1, type=int))
+        rows = ordered.offset((page - 1) * per_page).limit(per_page + 1).all()
+        total = cached_count(query)
+        meta = {
+            'total': total,
+            'pages': (total + per_page - 1) // per_page if total else 0,
+            'current_page': page,
+        }
+
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    meta.update({
+        'per_page': per_page,
+        'has_more': has_more,
+        'next_cursor': encode_cursor(key(items[-1])) if has_more and items else None,
+    })
+    return items, meta
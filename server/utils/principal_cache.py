@@ -0,0 +1,299 @@
+"""
+Cache of authenticated principals (User / Advertiser) for the auth decorators.
+
+token_required / advertiser_required used to run a primary-key SELECT on every
+request after decoding the JWT. The row is now cached as a plain column
+snapshot keyed by ``(user_type, user_id)``; on a hit the snapshot is attached
+to the request's session with ``merge(load=False)``, so handlers still get a
+regular persistent instance and no query is issued. Credential columns
+(``password_hash`` and the like) are left out of the snapshot.
+
+Entries expire after ``PRINCIPAL_CACHE_TTL`` seconds and are dropped as soon
+as a User/Advertiser row is updated or deleted through the ORM, or the
+principal logs out. By default the cache is an in-process LRU bounded by
+``PRINCIPAL_CACHE_SIZE``; set ``PRINCIPAL_CACHE_REDIS_URL`` to share it
+between workers (invalidations then reach every process).
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, date
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+
+from database import db
+from models import User, Advertiser
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+PRINCIPAL_MODELS = {
+    'user': User,
+    'advertiser': Advertiser,
+}
+
+DEFAULT_TTL_SECONDS = 60
+DEFAULT_MAX_ENTRIES = 10000
+
+# Credential columns are never written to the cache; on a hydrated principal
+# they stay unloaded and are fetched from the database if a handler reads them
+CREDENTIAL_COLUMN = re.compile(r'password|token|secret', re.IGNORECASE)
+
+
+# ========== SNAPSHOTS ==========
+
+def _snapshot(principal):
+    return {
+        attr.key: getattr(principal, attr.key)
+        for attr in db.inspect(principal).mapper.column_attrs
+        if not CREDENTIAL_COLUMN.search(attr.key)
+    }
+
+
+def _hydrate(model, snapshot):
+    """Turn a snapshot back into a persistent instance of the current session, without a query."""
+    identity = db.session.identity_map.get(db.inspect(model).identity_key_from_primary_key([snapshot['id']]))
+    if identity is not None:
+        return identity
+    principal = model(**snapshot)
+    make_transient_to_detached(principal)
+    return db.session.merge(principal, load=False)
+
+
+def _encode(snapshot):
+    return json.dumps({
+        key: {'$dt': value.isoformat()} if isinstance(value, (datetime, date)) else value
+        for key, value in snapshot.items()
+    })
+
+
+def _decode(raw):
+    return {
+        key: datetime.fromisoformat(value['$dt']) if isinstance(value, dict) and '$dt' in value else value
+        for key, value in json.loads(raw).items()
+    }
+
+
+# ========== BACKENDS ==========
+
+class LocalBackend:
+    """Bounded in-process LRU with per-entry expiry."""
+
+    name = 'local'
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            snapshot, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(snapshot)
+
+    def set(self, key, snapshot):
+        with self._lock:
+            self._entries[key] = (dict(snapshot), time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared backend: one SETEX'd JSON snapshot per principal."""
+
+    name = 'redis'
+    prefix = 'vpg:principal:'
+
+    def __init__(self, url, ttl):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.evictions = 0
+
+    def _key(self, key):
+        return f'{self.prefix}{key[0]}:{key[1]}'
+
+    def get(self, key):
+        raw = self.client.get(self._key(key))
+        return _decode(raw) if raw else None
+
+    def set(self, key, snapshot):
+        self.client.setex(self._key(key), self.ttl, _encode(snapshot))
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def clear(self):
+        for name in self.client.scan_iter(f'{self.prefix}*'):
+            self.client.delete(name)
+
+    def size(self):
+        return None
+
+
+# ========== CACHE ==========
+
+class PrincipalCache:
+    """Front for the configured backend that counts hits, misses and invalidations."""
+
+    def __init__(self):
+        self.backend = LocalBackend(DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS)
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def init_app(self, app):
+        ttl = int(app.config.get('PRINCIPAL_CACHE_TTL', os.environ.get('PRINCIPAL_CACHE_TTL', DEFAULT_TTL_SECONDS)))
+        size = int(app.config.get('PRINCIPAL_CACHE_SIZE', os.environ.get('PRINCIPAL_CACHE_SIZE', DEFAULT_MAX_ENTRIES)))
+        redis_url = app.config.get('PRINCIPAL_CACHE_REDIS_URL', os.environ.get('PRINCIPAL_CACHE_REDIS_URL'))
+        self.enabled = ttl > 0
+
+        self.backend = LocalBackend(size, ttl)
+        if redis_url:
+            if REDIS_AVAILABLE:
+                try:
+                    backend = RedisBackend(redis_url, ttl)
+                    backend.client.ping()
+                    self.backend = backend
+                except Exception as e:
+                    logger.warning(f"⚠ Principal cache: Redis unavailable ({e}), using in-process cache")
+            else:
+                logger.warning("⚠ Principal cache: redis package not installed, using in-process cache")
+
+        _register_invalidation_listeners()
+        app.extensions['principal_cache'] = self
+        logger.info(f"✓ Principal cache ready ({self.backend.name}, ttl={ttl}s)")
+
+    def load(self, user_type, user_id):
+        """The User/Advertiser for a token's claims, from cache when possible (None if gone)."""
+        model = PRINCIPAL_MODELS.get(user_type)
+        if model is None or user_id is None:
+            return None
+        key = (user_type, int(user_id))
+
+        if self.enabled:
+            try:
+                snapshot = self.backend.get(key)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Principal cache read failed: {e}")
+                snapshot = None
+            if snapshot is not None:
+                self.hits += 1
+                return _hydrate(model, snapshot)
+
+        self.misses += 1
+        principal = model.find_by_id(user_id)
+        if principal is not None and self.enabled:
+            try:
+                self.backend.set(key, _snapshot(principal))
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Principal cache write failed: {e}")
+        return principal
+
+    def invalidate(self, user_type, user_id):
+        if user_id is None:
+            return
+        self.invalidations += 1
+        try:
+            self.backend.delete((user_type, int(user_id)))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Principal cache invalidation failed: {e}")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend.name,
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'invalidations': self.invalidations,
+            'evictions': self.backend.evictions,
+            'errors': self.errors,
+            'size': self.backend.size(),
+        }
+
+
+principal_cache = PrincipalCache()
+
+
+# ========== INVALIDATION ==========
+
+_listeners_registered = False
+
+
+def _principal_key(target):
+    return ('advertiser' if isinstance(target, Advertiser) else 'user', target.id)
+
+
+def _on_principal_changed(mapper, connection, target):
+    key = _principal_key(target)
+    # Drop now, and again once the transaction commits, so a concurrent miss
+    # cannot re-cache the pre-commit row for a whole TTL
+    principal_cache.invalidate(*key)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('principal_cache_dirty', set()).add(key)
+
+
+def _on_commit(session):
+    for key in session.info.pop('principal_cache_dirty', ()):
+        principal_cache.invalidate(*key)
+
+
+def _register_invalidation_listeners():
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    for model in PRINCIPAL_MODELS.values():
+        event.listen(model, 'after_update', _on_principal_changed)
+        event.listen(model, 'after_delete', _on_principal_changed)
+    event.listen(Session, 'after_commit', _on_commit)
+    _listeners_registered = True
+
+
+def load_principal(user_type, user_id):
+    return principal_cache.load(user_type, user_id)
+
+
+def invalidate_principal(user_type, user_id):
+    principal_cache.invalidate(user_type, user_id)
@@ -0,0 +1,208 @@
+"""
+Media storage backends.
+
+Every stored file is addressed by a key, ``<category>/<aa>/<bb>/<filename>``,
+where ``aa``/``bb`` are the first characters of the (hex) filename. The
+fan-out keeps directories small once there are millions of files; keys
+written before it existed (``<category>/<filename>``) still resolve.
+
+    LocalStorage   files under MEDIA_ROOT (a single node, or a shared volume)
+    S3Storage      any S3-compatible bucket (AWS, R2, MinIO...); set
+                   MEDIA_S3_ENDPOINT_URL to point at a local stand-in
+
+Processing (Pillow, ffmpeg) needs a real file, so ``open_local`` yields a
+path: the stored file itself on disk, or a temporary download from S3.
+New files are written to ``staging_path`` first and moved in by ``put_file``.
+Staging sits under MEDIA_ROOT (``partial/``) so the move is a rename, but it
+holds other users' in-progress uploads: keys inside it never resolve.
+
+Everything is configured from the environment so media worker processes,
+which have no Flask app, build the same backend:
+
+    MEDIA_STORAGE        local (default) | s3
+    MEDIA_ROOT           local root / staging area (default ./uploads)
+    MEDIA_FANOUT_DEPTH   directory levels (default 2)
+    MEDIA_PUBLIC_URL     CDN origin for media URLs (default BASE_URL/media)
+    MEDIA_S3_BUCKET, MEDIA_S3_PREFIX, MEDIA_S3_ENDPOINT_URL, MEDIA_S3_REGION
+"""
+import os
+import uuid
+import posixpath
+import shutil
+import tempfile
+import mimetypes
+from contextlib import contextmanager
+from werkzeug.security import safe_join
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+    BOTO3_AVAILABLE = True
+except ImportError:
+    BOTO3_AVAILABLE = False
+
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(os.getcwd(), "uploads"))
+BASE_URL = os.environ.get('BASE_URL', 'https://vpg-9wlv.onrender.com')
+MEDIA_PUBLIC_URL = (os.environ.get('MEDIA_PUBLIC_URL') or f"{BASE_URL}/media").rstrip('/')
+FANOUT_DEPTH = int(os.environ.get('MEDIA_FANOUT_DEPTH', 2))
+STAGING_PREFIX = "partial"
+STAGING_DIR = os.path.join(MEDIA_ROOT, STAGING_PREFIX)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+# ========== KEYS AND URLS ==========
+
+def media_key(category, filename, depth=None):
+    """Fan-out storage key for a new file, e.g. image/3f/a2/3fa2...jpg"""
+    depth = FANOUT_DEPTH if depth is None else depth
+    shards = [filename[i * 2:i * 2 + 2].lower() for i in range(depth)]
+    return "/".join([category, *shards, filename])
+
+
+def media_url(key):
+    return f"{MEDIA_PUBLIC_URL}/{key}"
+
+
+def media_key_for(url):
+    """Storage key of a URL built by media_url (current or legacy /media/ form), or None."""
+    if not url:
+        return None
+    if url.startswith(MEDIA_PUBLIC_URL + "/"):
+        return url[len(MEDIA_PUBLIC_URL) + 1:]
+    marker = "/media/"
+    if marker in url:
+        return url.split(marker, 1)[1]
+    return None
+
+
+def is_staging_key(key):
+    """Whether ``key`` points into the staging area (after normalizing ``..`` and slashes)."""
+    parts = posixpath.normpath(key.replace('\\', '/')).lstrip('/').split('/')
+    return parts[0] == STAGING_PREFIX
+
+
+def staging_path(suffix="tmp"):
+    """Node-local path for a file being written before it goes into storage."""
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    return os.path.join(STAGING_DIR, f"{uuid.uuid4().hex}.{suffix}")
+
+
+# ========== BACKENDS ==========
+
+class LocalStorage:
+    name = 'local'
+
+    def __init__(self, root=MEDIA_ROOT):
+        self.root = root
+
+    def local_path(self, key):
+        """Path of the stored file (None for keys escaping the root or inside staging)."""
+        if is_staging_key(key):
+            return None
+        return safe_join(self.root, key)
+
+    def put_file(self, src_path, key, content_type=None):
+        """Move ``src_path`` into storage under ``key``."""
+        dest = self.local_path(key)
+        if dest is None:
+            raise ValueError(f"Invalid media key: {key}")
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.move(src_path, dest)
+        return key
+
+    def exists(self, key):
+        path = self.local_path(key)
+        return path is not None and os.path.isfile(path)
+
+    def delete(self, key):
+        path = self.local_path(key)
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def open_local(self, key):
+        path = self.local_path(key)
+        if path is None or not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        yield path
+
+    def presigned_url(self, key, expires=3600):
+        return None
+
+
+class S3Storage:
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None):
+        if not BOTO3_AVAILABLE:
+            raise RuntimeError("MEDIA_STORAGE=s3 requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def local_path(self, key):
+        return None
+
+    def put_file(self, src_path, key, content_type=None):
+        content_type = content_type or mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        self.client.upload_file(src_path, self.bucket, self._object_key(key), ExtraArgs={
+            'ContentType': content_type,
+            # Keys are content/UUID-named and never rewritten
+            'CacheControl': IMMUTABLE_CACHE_CONTROL,
+        })
+        os.remove(src_path)
+        return key
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    @contextmanager
+    def open_local(self, key):
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._object_key(key), path)
+            yield path
+        finally:
+            os.remove(path)
+
+    def presigned_url(self, key, expires=3600):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._object_key(key)}, ExpiresIn=expires
+        )
+
+
+_storage = None
+
+
+def get_storage():
+    """Process-wide storage backend, built from the environment on first use."""
+    global _storage
+    if _storage is None:
+        backend = os.environ.get('MEDIA_STORAGE', 'local').lower()
+        if backend == 's3':
+            _storage = S3Storage(
+                bucket=os.environ['MEDIA_S3_BUCKET'],
+                prefix=os.environ.get('MEDIA_S3_PREFIX', ''),
+                endpoint_url=os.environ.get('MEDIA_S3_ENDPOINT_URL') or None,
+                region=os.environ.get('MEDIA_S3_REGION') or None
+            )
+        else:
+            _storage = LocalStorage()
+    return _storage
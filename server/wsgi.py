@@ -0,0 +1,10 @@
+# wsgi.py - Production entry point
+#
+#   gunicorn -w 1 --threads 100 --bind 0.0.0.0:8000 wsgi:app
+#
+# Socket.IO needs one gunicorn worker per process; scale out by running more
+# processes behind a sticky-session proxy with SOCKETIO_MESSAGE_QUEUE set
+# (see "Running multiple workers" in README.md).
+from app import create_app
+
+app = create_app()